@@ -0,0 +1,169 @@
+"""
+Latency of GET /api/photos/ while photo uploads are in flight.
+
+The storage is replaced by one whose upload sleeps for --upload-delay
+seconds in its executor of --workers threads, so the benchmark runs without
+network access and measures the same whatever STORAGE_BACKEND is set to.
+Use --inline to run the uploads on the event loop thread, the way
+create_photo did before the storage executor was introduced.
+
+    python -m benchmarks.photos_latency --uploads 20 --requests 200
+    python -m benchmarks.photos_latency --uploads 20 --requests 200 --inline
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+os.environ.setdefault("TESTING", "True")
+
+import httpx
+from fastapi_limiter.depends import RateLimiter
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from main import app
+from src.conf.config import config
+from src.database.db import get_db
+from src.models.models import Base, Photo, User
+from src.services.auth import auth_service
+from src.services.storage import Storage
+
+IMAGE = Path(__file__).parent.parent / "tests" / "test.jpg"
+
+
+class DelayedStorage(Storage):
+    """
+    A storage whose upload blocks its worker thread for delay seconds, like
+    an SDK call, and keeps nothing.
+    """
+
+    def __init__(self, delay: float, max_workers: int, timeout: float):
+        super().__init__(max_workers, timeout)
+        self.delay = delay
+
+    def _upload(self, public_id: str) -> dict:
+        time.sleep(self.delay)
+        url = self.build_url(public_id)
+        return {"url": url, "secure_url": url, "public_id": public_id, "version": 1}
+
+    async def upload(self, file, public_id: str, **options) -> dict:
+        return await self._run(self._upload, public_id)
+
+    async def destroy(self, public_id: str) -> dict:
+        return {"result": "ok"}
+
+    async def read(self, public_id: str) -> bytes:
+        return IMAGE.read_bytes()
+
+    def build_url(self, public_id: str, **options) -> str:
+        return f"http://res.example.com/{public_id}"
+
+
+def disable_rate_limits():
+    for route in app.routes:
+        for dependency in getattr(route, "dependencies", []):
+            if isinstance(dependency.dependency, RateLimiter):
+                app.dependency_overrides[dependency.dependency] = lambda: None
+
+
+async def prepare_db(photos: int):
+    path = Path(tempfile.mkdtemp()) / "bench.db"
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", poolclass=NullPool)
+    session_maker = async_sessionmaker(engine, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with session_maker() as session:
+        user = User(username="bench", email="bench@example.com", password="x")
+        session.add(user)
+        await session.flush()
+        for i in range(photos):
+            session.add(
+                Photo(
+                    path=f"http://res.example.com/{i}",
+                    description=f"photo {i}",
+                    user_id=user.id,
+                    public_photo_id=str(i),
+                )
+            )
+        await session.commit()
+        await session.refresh(user)
+
+    async def override_get_db():
+        async with session_maker() as session:
+            yield session
+
+    app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[auth_service.get_current_user] = lambda: user
+
+
+async def upload(client: httpx.AsyncClient, number: int):
+    with open(IMAGE, "rb") as file:
+        response = await client.post(
+            "/api/photos/",
+            files={"file": ("test.jpg", file, "image/jpeg")},
+            data={"photo_description": "benchmark", "tags": f"bench{number}"},
+        )
+    assert response.status_code == 201, response.text
+
+
+async def probe(client: httpx.AsyncClient, requests: int) -> list[float]:
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        response = await client.get("/api/photos/")
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200, response.text
+    return latencies
+
+
+async def run(args):
+    await prepare_db(args.photos)
+    disable_rate_limits()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        uploads = [asyncio.create_task(upload(client, i)) for i in range(args.uploads)]
+        latencies = await probe(client, args.requests)
+        await asyncio.gather(*uploads)
+
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    mode = "inline" if args.inline else f"executor({args.workers} workers)"
+    print(f"uploads in flight: {args.uploads}, upload delay: {args.upload_delay}s, mode: {mode}")
+    print(f"GET /api/photos/ x {len(latencies)}")
+    print(f"  p50 {percentiles[49] * 1000:8.2f} ms")
+    print(f"  p95 {percentiles[94] * 1000:8.2f} ms")
+    print(f"  p99 {percentiles[98] * 1000:8.2f} ms")
+    print(f"  max {max(latencies) * 1000:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--photos", type=int, default=100)
+    parser.add_argument("--upload-delay", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=config.STORAGE_MAX_WORKERS)
+    parser.add_argument("--inline", action="store_true")
+    args = parser.parse_args()
+
+    storage = DelayedStorage(args.upload_delay, args.workers, config.STORAGE_TIMEOUT)
+
+    async def inline(func, *func_args, **kwargs):
+        return func(*func_args, **kwargs)
+
+    with patch("src.repository.photos.storage", storage):
+        if args.inline:
+            with patch.object(storage, "_run", inline):
+                asyncio.run(run(args))
+        else:
+            asyncio.run(run(args))
+    storage.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -19,8 +19,17 @@ from src.models.models import User
 from src.routes import photos
 from src.database.db import get_db
 from src.conf.config import config
-from src.routes import auth, users, comments, seed, ratings
+from src.conf.constants import BULK_UPLOAD_MAX_FILES, PHOTO_MAX_SIZE, UPLOAD_FORM_OVERHEAD
+from src.routes import auth, users, comments, seed, ratings, tags
 from src.services.auth import auth_service
+from src.services.outbox import asset_reaper
+from src.services.chunked_uploads import upload_sessions
+from src.services.rendering import rendering
+from src.services.storage import storage
+from src.services.tag_dictionary import tag_dictionary
+from src.services.jobs import transform_jobs
+from src.services.leaderboard import leaderboard
+from src.services.uploads import UploadSizeLimit
 from src.conf import messages
 
 
@@ -38,7 +47,19 @@ async def lifespan(app: FastAPI):
     )
 
     delay = await FastAPILimiter.init(r)
+    transform_jobs.start()
+    asset_reaper.start()
+    upload_sessions.start()
+    tag_dictionary.start(r)
+    leaderboard.start()
     yield delay
+    await leaderboard.stop()
+    await tag_dictionary.stop()
+    await upload_sessions.stop()
+    await asset_reaper.stop()
+    await transform_jobs.stop()
+    storage.shutdown()
+    rendering.shutdown()
 
 
 # start = True
@@ -47,6 +68,17 @@ app = FastAPI(lifespan=lifespan)
 
 origins = ["*"]
 
+# the multipart body of an upload is bounded before Starlette spools it to disk
+app.add_middleware(
+    UploadSizeLimit,
+    limits={
+        ("POST", "/api/photos/"): PHOTO_MAX_SIZE + UPLOAD_FORM_OVERHEAD,
+        ("POST", "/api/photos/bulk/"): BULK_UPLOAD_MAX_FILES
+        * (PHOTO_MAX_SIZE + UPLOAD_FORM_OVERHEAD),
+        ("PATCH", "/api/users/avatar"): PHOTO_MAX_SIZE + UPLOAD_FORM_OVERHEAD,
+    },
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
@@ -98,11 +130,19 @@ app.mount("/img", StaticFiles(directory=image_directory), name="image")
 
 app.mount("/static", StaticFiles(directory=BASE_DIR / "src" / "static"), name="static")
 
+# photos of the local storage backend; StaticFiles passes the file path to servers
+# with the "http.response.pathsend" extension, so they can use sendfile
+if config.STORAGE_BACKEND == "local":
+    app.mount(
+        config.STORAGE_LOCAL_URL, StaticFiles(directory=storage.root), name="media"
+    )
+
 app.include_router(auth.auth_router, prefix="/api")
 app.include_router(users.router, prefix="/api")
 app.include_router(photos.router, prefix="/api")
 app.include_router(comments.router, prefix="/api")
 app.include_router(ratings.router, prefix="/api")
+app.include_router(tags.router, prefix="/api")
 app.include_router(seed.router, prefix="")
 
 
@@ -0,0 +1,28 @@
+"""add content_hash to photos
+
+Revision ID: 3f9c2d71b6a4
+Revises: aae1a8cddec8
+Create Date: 2026-10-18 10:12:31.104715
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9c2d71b6a4'
+down_revision: Union[str, None] = 'aae1a8cddec8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('photos', sa.Column('content_hash', sa.String(length=64), nullable=True))
+    op.create_index(op.f('ix_photos_content_hash'), 'photos', ['content_hash'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_photos_content_hash'), table_name='photos')
+    op.drop_column('photos', 'content_hash')
@@ -0,0 +1,34 @@
+"""trigram indexes of tags and descriptions
+
+Revision ID: a6e2b9d0c471
+Revises: f3c8d1b95e20
+Create Date: 2026-10-18 18:31:55.204718
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a6e2b9d0c471'
+down_revision: Union[str, None] = 'f3c8d1b95e20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        op.create_index('ix_tags_name_trgm', 'tags', ['name'], unique=False)
+        op.create_index('ix_photos_description_trgm', 'photos', ['description'], unique=False)
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_tags_name_trgm', 'tags', ['name'], unique=False, postgresql_using='gin', postgresql_ops={'name': 'gin_trgm_ops'})
+    op.create_index('ix_photos_description_trgm', 'photos', ['description'], unique=False, postgresql_using='gin', postgresql_ops={'description': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_photos_description_trgm', table_name='photos')
+    op.drop_index('ix_tags_name_trgm', table_name='tags')
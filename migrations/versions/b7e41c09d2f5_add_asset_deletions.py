@@ -0,0 +1,36 @@
+"""add asset_deletions outbox
+
+Revision ID: b7e41c09d2f5
+Revises: 3f9c2d71b6a4
+Create Date: 2026-10-18 12:40:05.318227
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e41c09d2f5'
+down_revision: Union[str, None] = '3f9c2d71b6a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('asset_deletions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('public_id', sa.String(length=250), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(length=250), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_asset_deletions_next_attempt_at'), 'asset_deletions', ['next_attempt_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_asset_deletions_next_attempt_at'), table_name='asset_deletions')
+    op.drop_table('asset_deletions')
@@ -0,0 +1,34 @@
+"""sort keys of photos
+
+Revision ID: b9d4e7a2c518
+Revises: a6e2b9d0c471
+Create Date: 2026-10-18 20:05:37.841126
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b9d4e7a2c518'
+down_revision: Union[str, None] = 'a6e2b9d0c471'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('photos', sa.Column('comment_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        "UPDATE photos SET "
+        "comment_count = (SELECT count(*) FROM comments WHERE comments.photo_id = photos.id)"
+    )
+    op.create_index('ix_photos_comment_count_id', 'photos', ['comment_count', 'id'], unique=False)
+    op.create_index('ix_photos_rating_score_id', 'photos', [sa.text('coalesce(rating_avg, 0)'), 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_photos_rating_score_id', table_name='photos')
+    op.drop_index('ix_photos_comment_count_id', table_name='photos')
+    op.drop_column('photos', 'comment_count')
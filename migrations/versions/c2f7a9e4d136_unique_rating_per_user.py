@@ -0,0 +1,36 @@
+"""one rating of a photo per user
+
+Revision ID: c2f7a9e4d136
+Revises: b9d4e7a2c518
+Create Date: 2026-10-18 21:14:52.209637
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2f7a9e4d136'
+down_revision: Union[str, None] = 'b9d4e7a2c518'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the first rating of a photo by a user stays, the duplicates are removed from the aggregates
+    op.execute(
+        "DELETE FROM ratings WHERE id NOT IN "
+        "(SELECT min(id) FROM ratings GROUP BY photo_id, user_id)"
+    )
+    op.execute(
+        "UPDATE photos SET "
+        "rating_sum = (SELECT coalesce(sum(rating), 0) FROM ratings WHERE ratings.photo_id = photos.id), "
+        "rating_count = (SELECT count(*) FROM ratings WHERE ratings.photo_id = photos.id)"
+    )
+    op.create_index('ix_ratings_photo_id_user_id', 'ratings', ['photo_id', 'user_id'], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_ratings_photo_id_user_id', table_name='ratings')
@@ -0,0 +1,36 @@
+"""unique photo tag links
+
+Revision ID: c41d7e9a0b83
+Revises: b7e41c09d2f5
+Create Date: 2026-10-18 14:05:41.902117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7e9a0b83'
+down_revision: Union[str, None] = 'b7e41c09d2f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # keep the first link of every repeated (photo_id, tag_id) pair
+    op.execute(
+        "DELETE FROM photo_m2m_tag WHERE id NOT IN "
+        "(SELECT min(id) FROM photo_m2m_tag GROUP BY photo_id, tag_id)"
+    )
+    # SQLite can not add a constraint to a table, the batch copies the table
+    with op.batch_alter_table('photo_m2m_tag') as batch_op:
+        batch_op.create_unique_constraint('uq_photo_m2m_tag_photo_id_tag_id', ['photo_id', 'tag_id'])
+    op.create_index('ix_photo_m2m_tag_tag_id', 'photo_m2m_tag', ['tag_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_photo_m2m_tag_tag_id', table_name='photo_m2m_tag')
+    with op.batch_alter_table('photo_m2m_tag') as batch_op:
+        batch_op.drop_constraint('uq_photo_m2m_tag_photo_id_tag_id', type_='unique')
@@ -0,0 +1,90 @@
+"""full text search vector of photos
+
+Revision ID: d8a2f61c3e57
+Revises: c41d7e9a0b83
+Create Date: 2026-10-18 15:20:12.664380
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8a2f61c3e57'
+down_revision: Union[str, None] = 'c41d7e9a0b83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('photos', sa.Column('search_vector', postgresql.TSVECTOR().with_variant(sa.Text(), 'sqlite'), nullable=True))
+    if op.get_bind().dialect.name != 'postgresql':
+        op.create_index('ix_photos_search_vector', 'photos', ['search_vector'], unique=False)
+        return
+
+    # 'simple' is SEARCH_CONFIG; the tag names weigh more than the description
+    op.execute("""
+        CREATE FUNCTION photo_search_vector(photo integer, description text) RETURNS tsvector AS $$
+            SELECT setweight(to_tsvector('simple', coalesce(string_agg(tags.name, ' '), '')), 'A')
+                || setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+            FROM photo_m2m_tag JOIN tags ON tags.id = photo_m2m_tag.tag_id
+            WHERE photo_m2m_tag.photo_id = photo
+        $$ LANGUAGE sql STABLE
+    """)
+    op.execute("""
+        CREATE FUNCTION photos_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            NEW.search_vector := photo_search_vector(NEW.id, NEW.description);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute(
+        "CREATE TRIGGER photos_search_vector BEFORE INSERT OR UPDATE OF description "
+        "ON photos FOR EACH ROW EXECUTE FUNCTION photos_search_vector_update()"
+    )
+    op.execute("""
+        CREATE FUNCTION photo_m2m_tag_search_vector_update() RETURNS trigger AS $$
+        DECLARE
+            photo integer := CASE WHEN TG_OP = 'DELETE' THEN OLD.photo_id ELSE NEW.photo_id END;
+        BEGIN
+            UPDATE photos SET search_vector = photo_search_vector(id, description) WHERE id = photo;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute(
+        "CREATE TRIGGER photo_m2m_tag_search_vector AFTER INSERT OR DELETE "
+        "ON photo_m2m_tag FOR EACH ROW EXECUTE FUNCTION photo_m2m_tag_search_vector_update()"
+    )
+    op.execute("""
+        CREATE FUNCTION tags_search_vector_update() RETURNS trigger AS $$
+        BEGIN
+            UPDATE photos SET search_vector = photo_search_vector(id, description)
+            WHERE id IN (SELECT photo_id FROM photo_m2m_tag WHERE tag_id = NEW.id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute(
+        "CREATE TRIGGER tags_search_vector AFTER UPDATE OF name "
+        "ON tags FOR EACH ROW EXECUTE FUNCTION tags_search_vector_update()"
+    )
+    op.execute("UPDATE photos SET search_vector = photo_search_vector(id, description)")
+    op.create_index('ix_photos_search_vector', 'photos', ['search_vector'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_photos_search_vector', table_name='photos')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP TRIGGER tags_search_vector ON tags")
+        op.execute("DROP FUNCTION tags_search_vector_update()")
+        op.execute("DROP TRIGGER photo_m2m_tag_search_vector ON photo_m2m_tag")
+        op.execute("DROP FUNCTION photo_m2m_tag_search_vector_update()")
+        op.execute("DROP TRIGGER photos_search_vector ON photos")
+        op.execute("DROP FUNCTION photos_search_vector_update()")
+        op.execute("DROP FUNCTION photo_search_vector(integer, text)")
+    op.drop_column('photos', 'search_vector')
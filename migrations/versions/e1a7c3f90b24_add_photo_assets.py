@@ -0,0 +1,54 @@
+"""add photo_assets
+
+Revision ID: e1a7c3f90b24
+Revises: c2f7a9e4d136
+Create Date: 2026-10-18 23:05:41.672310
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1a7c3f90b24'
+down_revision: Union[str, None] = 'c2f7a9e4d136'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def qr_public_id(data: str, qr_format: str) -> str:
+    # the same as src.services.qr_code.qr_public_id at this revision
+    digest = hashlib.sha256(f"{qr_format}:{data}".encode()).hexdigest()
+    return f"Qr_Code/{digest[:32]}"
+
+
+def upgrade() -> None:
+    photo_assets = op.create_table('photo_assets',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('photo_id', sa.Integer(), nullable=False),
+    sa.Column('public_id', sa.String(length=250), nullable=False),
+    sa.ForeignKeyConstraint(['photo_id'], ['photos.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_photo_assets_public_id'), 'photo_assets', ['public_id'], unique=False)
+    op.create_index('ix_photo_assets_photo_id_public_id', 'photo_assets', ['photo_id', 'public_id'], unique=True)
+    # the QR codes of the transformed photos built so far, in either format
+    photos = op.get_bind().execute(
+        sa.text("SELECT id, path_transform FROM photos WHERE path_transform IS NOT NULL")
+    )
+    rows = [
+        {"photo_id": photo_id, "public_id": qr_public_id(path_transform, qr_format)}
+        for photo_id, path_transform in photos
+        for qr_format in ("png", "svg")
+    ]
+    if rows:
+        op.bulk_insert(photo_assets, rows)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_photo_assets_photo_id_public_id', table_name='photo_assets')
+    op.drop_index(op.f('ix_photo_assets_public_id'), table_name='photo_assets')
+    op.drop_table('photo_assets')
@@ -0,0 +1,30 @@
+"""indexes of keyset pagination
+
+Revision ID: e5b9c0d47a12
+Revises: d8a2f61c3e57
+Create Date: 2026-10-18 16:02:37.140925
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5b9c0d47a12'
+down_revision: Union[str, None] = 'd8a2f61c3e57'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_photos_created_at_id', 'photos', ['created_at', 'id'], unique=False)
+    op.create_index('ix_users_created_at_id', 'users', ['created_at', 'id'], unique=False)
+    op.create_index('ix_comments_photo_id_created_at_id', 'comments', ['photo_id', 'created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_comments_photo_id_created_at_id', table_name='comments')
+    op.drop_index('ix_users_created_at_id', table_name='users')
+    op.drop_index('ix_photos_created_at_id', table_name='photos')
@@ -0,0 +1,44 @@
+"""rating aggregates of photos
+
+Revision ID: f3c8d1b95e20
+Revises: e5b9c0d47a12
+Create Date: 2026-10-18 17:42:09.318265
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3c8d1b95e20'
+down_revision: Union[str, None] = 'e5b9c0d47a12'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('photos', sa.Column('rating_sum', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('photos', sa.Column('rating_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+        "UPDATE photos SET "
+        "rating_sum = (SELECT coalesce(sum(rating), 0) FROM ratings WHERE ratings.photo_id = photos.id), "
+        "rating_count = (SELECT count(*) FROM ratings WHERE ratings.photo_id = photos.id)"
+    )
+    # SQLite adds only virtual generated columns to an existing table
+    persisted = op.get_bind().dialect.name != 'sqlite'
+    op.add_column('photos', sa.Column(
+        'rating_avg',
+        sa.Float(),
+        sa.Computed('CASE WHEN rating_count > 0 THEN CAST(rating_sum AS FLOAT) / rating_count END', persisted=persisted),
+        nullable=True,
+    ))
+    op.create_index('ix_photos_rating_avg_id', 'photos', ['rating_avg', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_photos_rating_avg_id', table_name='photos')
+    op.drop_column('photos', 'rating_avg')
+    op.drop_column('photos', 'rating_count')
+    op.drop_column('photos', 'rating_sum')
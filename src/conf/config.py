@@ -32,6 +32,31 @@ class Settings(BaseSettings):
     CLOUDINARY_API_KEY: str
     CLOUDINARY_API_SECRET: str
 
+    STORAGE_BACKEND: str = "cloudinary"
+    STORAGE_LOCAL_ROOT: str = "media"
+    STORAGE_LOCAL_URL: str = "/media"
+    STORAGE_MAX_WORKERS: int = 8
+    STORAGE_TIMEOUT: float = 30.0
+
+    TRANSFORM_WORKERS: int = 4
+    TRANSFORM_QUEUE_SIZE: int = 100
+
+    BULK_UPLOAD_CONCURRENCY: int = 8
+
+    RENDER_WORKERS: int = 2
+    RENDER_TIMEOUT: float = 30.0
+
+    UPLOAD_STAGING_ROOT: str = "uploads"
+    # seconds between the removals of abandoned staging files
+    UPLOAD_REAPER_INTERVAL: float = 600.0
+
+    OUTBOX_INTERVAL: float = 10.0
+    # seconds between the rebuilds of the leaderboards from the database
+    LEADERBOARD_INTERVAL: float = 300.0
+
+    # minimal trigram similarity of a word matched by the fuzzy search
+    SEARCH_SIMILARITY: float = 0.3
+
     # нахіба?
     @field_validator("ALGORITHM")
     @classmethod
@@ -40,6 +65,13 @@ class Settings(BaseSettings):
             raise ValueError("algorithm must be HS256 or HS512")
         return v
 
+    @field_validator("STORAGE_BACKEND")
+    @classmethod
+    def validate_storage_backend(cls, v: Any):
+        if v not in ["cloudinary", "local"]:
+            raise ValueError("storage backend must be cloudinary or local")
+        return v
+
     model_config = SettingsConfigDict(
         extra="ignore", env_file=".env", env_file_encoding="utf-8"
     )  # noqa
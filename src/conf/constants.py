@@ -28,6 +28,40 @@ TRANSFORM_PATH_LENGTH = 250
 PHOTO_MIN_DESCRIPTION_LENGTH = 5
 PHOTO_MAX_DESCRIPTION_LENGTH = 250
 AVATAR_PATH_LENGTH = 250
+CONTENT_HASH_LENGTH = 64
+
+PHOTO_MAX_SIZE = 5 * 1024 * 1024
+# every extension needs a signature in src/services/uploads.py IMAGE_SIGNATURES
+ALLOWED_PHOTO_EXTENSIONS = ("jpg", "jpeg", "bmp", "gif", "png", "tiff", "psd")
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# the form fields and the multipart boundaries around the files of an upload
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+BULK_UPLOAD_MAX_FILES = 200
+CHUNKED_PHOTO_MAX_SIZE = 200 * 1024 * 1024
+UPLOAD_SESSION_CHUNK_SIZE = 5 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 60 * 60
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_BACKOFF = 6 * 60 * 60
+QR_CACHE_SIZE = 256
+RENDITION_CACHE_SIZE = 1024
+TAGS_CHANNEL = "tags"
+TAGS_RESUBSCRIBE_DELAY = 5
+TAG_SUGGEST_LIMIT = 10
+TAG_SUGGEST_MAX_LIMIT = 50
+TAG_QUERY_MAX_LENGTH = 500
+# text search configuration of photos.search_vector, names the language of stemming
+SEARCH_CONFIG = "simple"
+# similar tag names tried for one misspelled word by the fuzzy search without pg_trgm
+FUZZY_MAX_TERMS = 20
+# seconds the trigram index of the tags table is kept when the tag dictionary is not in use
+FUZZY_INDEX_TTL = 60
+# seconds a page of search results is cached
+SEARCH_CACHE_TTL = 60
+# the score of the leaderboards is the average of the ratings with this many
+# more ratings of this value, so the photos with few ratings are not on the top
+LEADERBOARD_PRIOR_VOTES = 5
+LEADERBOARD_PRIOR_MEAN = 3.0
+LEADERBOARD_MAX_SIZE = 100
 
 ALLOWED_CROP_MODES = ("fill", "thumb", "fit", "limit", "pad", "scale", None)
 ACCESS_TOKEN_TIME_LIVE = 30
@@ -42,6 +76,35 @@ class CropMode(str, enum.Enum):
     scale = "scale"
 
 
+class PhotoSort(str, enum.Enum):
+    created_at = "created_at"
+    rating = "rating"
+    comments = "comments"
+
+
+class SortOrder(str, enum.Enum):
+    asc = "asc"
+    desc = "desc"
+
+
+class LeaderboardWindow(str, enum.Enum):
+    day = "day"
+    week = "week"
+    all = "all"
+
+
+class QrFormat(str, enum.Enum):
+    png = "png"
+    svg = "svg"
+
+
+class JobStatus(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
 class EffectMode(str, enum.Enum):
     vignette = "vignette"
     sepia = "sepia"
@@ -1,4 +1,9 @@
-from src.conf.constants import RATING_MIN_VALUE, RATING_MAX_VALUE
+from src.conf.constants import (
+    PHOTO_MAX_DESCRIPTION_LENGTH,
+    RATING_MIN_VALUE,
+    RATING_MAX_VALUE,
+    TAGS_MAX_NUMBER,
+)
 
 ACCOUNT_EXIST = "Account already exists!"
 EMAIL_NOT_CONFIRMED = "Email not confirmed!"
@@ -27,8 +32,27 @@ RATING_VALUE_INCORRECT = (
 SOMETHING_WRONG = "Something went wrong!"
 PHOTO_SUCCESSFULLY_ADDED = "Photo successfully added!"
 TAG_SUCCESSFULLY_ADDED = "Tag successfully added!"
+TAG_SUCCESSFULLY_DELETED = "Tag successfully deleted"
+TAG_NOT_FOUND = "Tag not found"
+TAG_NAME_EMPTY = "Tag name can not be empty"
+TAG_ALREADY_ADDED = "This photo has had this tag!"
+PHOTO_HAS_NOT_TAG = "This photo don't has this tag!"
+TOO_MANY_TAGS = f"You can add no more {TAGS_MAX_NUMBER} tags to one photo."
 PHOTO_SUCCESSFULLY_DELETED = "Photo successfully deleted!"
 NO_PHOTO_BY_ID = "Not found photo by this ID"
+STORAGE_TIMEOUT = "Image storage did not respond in time"
+RENDERING_TIMEOUT = "Image rendering did not finish in time"
+WRONG_FILE_SIZE = "Wrong file size (it need less than 5 Mb)!"
+WRONG_FILE_TYPE = "Wrong file type (only pictures needed)!"
+JOB_QUEUE_FULL = "Too many transformations in progress, try again later"
+JOB_NOT_FOUND = "Job not found"
+TOO_MANY_FILES = "Too many files in one upload"
+DESCRIPTION_TOO_LONG = f"The description can have no more {PHOTO_MAX_DESCRIPTION_LENGTH} characters"
+UPLOAD_NOT_FOUND = "Upload session not found"
+UPLOAD_INCOMPLETE = "Not all chunks of the upload were received"
+WRONG_CHUNK = "The chunk does not match the upload session"
+INVALID_CURSOR = "Invalid cursor of the page"
+INVALID_TAG_QUERY = "Invalid query of tags"
 
 COMMENT_NOT_FOUND = "Comments not found"
 YOU_CAN_NOT_EDIT_COMMENT = "You can not edit this comment"
@@ -1,7 +1,7 @@
 import contextlib
 
 from os import environ
-from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.pool import NullPool
 
 from src.conf.config import config
@@ -43,3 +43,18 @@ else:
 async def get_db():
     async with sessionmanager.session() as session:
         yield session
+
+
+def insert_ignore(db: AsyncSession, model):
+    """
+    The insert_ignore function returns an INSERT ... ON CONFLICT DO NOTHING
+    for the dialect of the session, or None if the dialect has no such statement.
+    """
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(model).on_conflict_do_nothing()
@@ -5,6 +5,8 @@ from typing import Optional
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy import (
     Column,
+    Computed,
+    Float,
     Integer,
     String,
     func,
@@ -13,7 +15,12 @@ from sqlalchemy import (
     Enum,
     ForeignKey,
     Boolean,
+    Index,
+    Text,
+    UniqueConstraint,
+    text,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR
 
 # from sqlalchemy.orm import column_property
 from sqlalchemy.sql.sqltypes import Date, DateTime
@@ -35,6 +42,7 @@ from src.conf.constants import (
     PASSWORD_MAX_LENGTH,
     TOKEN_MAX_LENGTH,
     AVATAR_PATH_LENGTH,
+    CONTENT_HASH_LENGTH,
 )
 
 
@@ -48,6 +56,16 @@ class Tag(Base):
         String(TAG_MAX_LENGTH), nullable=False, unique=True
     )
 
+    __table_args__ = (
+        # fuzzy search
+        Index(
+            "ix_tags_name_trgm",
+            "name",
+            postgresql_using="gin",
+            postgresql_ops={"name": "gin_trgm_ops"},
+        ),
+    )
+
 
 photo_m2m_tag = Table(
     "photo_m2m_tag",
@@ -55,6 +73,9 @@ photo_m2m_tag = Table(
     Column("id", Integer, primary_key=True),
     Column("photo_id", Integer, ForeignKey("photos.id", ondelete="CASCADE")),
     Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE")),
+    # the unique index serves the lookups by photo_id too
+    UniqueConstraint("photo_id", "tag_id", name="uq_photo_m2m_tag_photo_id_tag_id"),
+    Index("ix_photo_m2m_tag_tag_id", "tag_id"),
 )
 
 
@@ -88,6 +109,50 @@ class Photo(Base, Datefield):
     public_photo_id: Mapped[str] = mapped_column(
         String(PHOTO_PATH_LENGTH), nullable=False
     )
+    content_hash: Mapped[str] = mapped_column(
+        String(CONTENT_HASH_LENGTH), nullable=True, index=True
+    )
+    # description and tag names, kept up to date by triggers on PostgreSQL
+    search_vector: Mapped[str] = mapped_column(
+        TSVECTOR().with_variant(Text(), "sqlite"), nullable=True, deferred=True
+    )
+    # aggregates of the ratings, kept up to date by src/repository/ratings.py
+    rating_sum: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
+    rating_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
+    rating_avg: Mapped[Optional[float]] = mapped_column(
+        Float,
+        Computed(
+            "CASE WHEN rating_count > 0 THEN CAST(rating_sum AS FLOAT) / rating_count END",
+            persisted=True,
+        ),
+    )
+    # kept up to date by src/repository/comments.py
+    comment_count: Mapped[int] = mapped_column(
+        Integer, default=0, server_default="0", nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_photos_search_vector", "search_vector", postgresql_using="gin"),
+        # fuzzy search
+        Index(
+            "ix_photos_description_trgm",
+            "description",
+            postgresql_using="gin",
+            postgresql_ops={"description": "gin_trgm_ops"},
+        ),
+        # keyset pagination
+        Index("ix_photos_created_at_id", "created_at", "id"),
+        # rating filters and keyset pagination by rating
+        Index("ix_photos_rating_avg_id", "rating_avg", "id"),
+        # sorting by rating, the photos without ratings have 0;
+        # the expression must stay the same as RATING_SCORE in src/repository/photos.py
+        Index("ix_photos_rating_score_id", text("coalesce(rating_avg, 0)"), "id"),
+        Index("ix_photos_comment_count_id", "comment_count", "id"),
+    )
 
 
 class Comment(Base, Datefield):
@@ -101,6 +166,11 @@ class Comment(Base, Datefield):
         ForeignKey("photos.id", ondelete="CASCADE"), nullable=False
     )
 
+    __table_args__ = (
+        # keyset pagination of the comments of a photo
+        Index("ix_comments_photo_id_created_at_id", "photo_id", "created_at", "id"),
+    )
+
 
 class Role(enum.Enum):
     admin: str = "admin"
@@ -139,6 +209,11 @@ class User(Base, Datefield):
         "Rating", backref="users", cascade="all, delete-orphan"
     )
 
+    __table_args__ = (
+        # keyset pagination
+        Index("ix_users_created_at_id", "created_at", "id"),
+    )
+
 
 class Rating(Base, Datefield):
     __tablename__ = "ratings"
@@ -150,3 +225,45 @@ class Rating(Base, Datefield):
     user_id: Mapped[uuid.UUID] = mapped_column(
         ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
+
+    __table_args__ = (
+        # one rating of a photo by a user, the conflict target of create_rating
+        Index("ix_ratings_photo_id_user_id", "photo_id", "user_id", unique=True),
+    )
+
+
+class AssetDeletion(Base):
+    """
+    Outbox of stored assets to delete, written in the same transaction as the
+    deleted rows and drained by the reaper in src/services/outbox.py.
+    """
+
+    __tablename__ = "asset_deletions"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    public_id: Mapped[str] = mapped_column(String(PHOTO_PATH_LENGTH), nullable=False)
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    last_error: Mapped[str] = mapped_column(String(PHOTO_PATH_LENGTH), nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.now)
+    next_attempt_at: Mapped[datetime] = mapped_column(
+        DateTime, default=datetime.now, nullable=False, index=True
+    )
+
+
+class PhotoAsset(Base):
+    """
+    Stored assets derived from a photo (its QR codes and uploaded avatars),
+    written by the process that builds them and queued for deletion with the photo.
+    """
+
+    __tablename__ = "photo_assets"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    photo_id: Mapped[int] = mapped_column(
+        ForeignKey("photos.id", ondelete="CASCADE"), nullable=False
+    )
+    public_id: Mapped[str] = mapped_column(
+        String(PHOTO_PATH_LENGTH), nullable=False, index=True
+    )
+
+    __table_args__ = (
+        Index("ix_photo_assets_photo_id_public_id", "photo_id", "public_id", unique=True),
+    )
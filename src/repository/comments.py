@@ -7,6 +7,7 @@ import uuid
 from fastapi import Depends, HTTPException
 from sqlalchemy import select, update, func, extract, and_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.dml import Update
 
 from src.database.db import get_db
 from src.schemas.comments import (
@@ -17,6 +18,24 @@ from src.schemas.comments import (
 from src.conf import messages
 from src.models.models import Comment, Photo
 from src.repository.photos import get_photo_by_id
+from src.services.pagination import Keyset
+
+
+def count_comment(photo_id: int, count: int = 1) -> Update:
+    """
+    Update of the number of comments of the photo, applied by the database
+
+    :param: photo_id: int - id of the commented photo
+    :param: count: int - 1 to add a comment, -1 to remove it
+    :return: Update - statement to execute in the transaction of the comment
+    """
+
+    return (
+        update(Photo)
+        .where(Photo.id == photo_id)
+        .values(comment_count=Photo.comment_count + count)
+        .execution_options(synchronize_session=False)
+    )
 
 
 async def create_comment(
@@ -41,6 +60,7 @@ async def create_comment(
         user_id=user_id,
     )
     db.add(comment)
+    await db.execute(count_comment(photo_id))
     await db.commit()
     await db.refresh(comment)
     return comment
@@ -84,19 +104,24 @@ async def get_user_comments_for_photo(
 
 async def get_all_comment_for_photo(
     photo_id: int,
+    limit: int,
+    cursor: str | None,
     db: AsyncSession = Depends(get_db),
 ):
     """
-    Get comment by photo_id
+    Get a page of the comments of the photo, the oldest first
 
     :param: photo_id: int - id of photo to get comment
+    :param: limit: int - number of comments on the page
+    :param: cursor: str | None - cursor of the previous page, None for the first page
     :param: db: AsyncSession - database session
-    :return: Comment - comment with photo_id = photo_id
+    :return: dict - comments with photo_id = photo_id and the cursor of the next page
     """
 
-    stmt = select(Comment).filter_by(photo_id=photo_id)
+    keyset = Keyset(Comment.created_at, Comment.id)
+    stmt = keyset.apply(select(Comment).filter_by(photo_id=photo_id), cursor, limit)
     comment = await db.execute(stmt)
-    return comment.scalars().all()
+    return keyset.page(comment, limit)
 
 
 async def edit_comment(
@@ -151,5 +176,6 @@ async def delete_comment(
     comment = result.scalar_one_or_none()
     if comment:
         await db.delete(comment)
+        await db.execute(count_comment(comment.photo_id, -1))
         await db.commit()
     return comment
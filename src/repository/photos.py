@@ -1,17 +1,27 @@
+import asyncio
 import datetime as DT
 from typing import List
 import uuid
-import qrcode
-import cloudinary
-import cloudinary.uploader
 from src.conf.config import config
-from src.conf.constants import ALLOWED_CROP_MODES
+from src.conf.constants import (
+    ALLOWED_CROP_MODES,
+    FUZZY_MAX_TERMS,
+    LeaderboardWindow,
+    PhotoSort,
+    RATING_MAX_VALUE,
+    RATING_MIN_VALUE,
+    SEARCH_CONFIG,
+    SortOrder,
+    TAGS_MAX_NUMBER,
+    QrFormat,
+)
 from src.conf.messages import PHOTO_NOT_FOUND
 
-from src.models.models import Rating, Role, User, Tag, photo_m2m_tag
-from sqlalchemy import or_, select, update, func, extract, and_, delete
+from src.models.models import PhotoAsset, Rating, Role, User, Tag, photo_m2m_tag
+from sqlalchemy import or_, select, update, func, extract, and_, delete, case, true, Float, literal, literal_column, not_, type_coerce
+from sqlalchemy.exc import IntegrityError
 from datetime import date, timedelta
-from fastapi import File, HTTPException
+from fastapi import HTTPException
 
 # from sqlalchemy.sql.sqltypes import Date
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -19,129 +29,274 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from src.conf.messages import (
     SOMETHING_WRONG,
     PHOTO_SUCCESSFULLY_ADDED,
+    PHOTO_HAS_NOT_TAG,
+    TAG_ALREADY_ADDED,
+    TAG_NAME_EMPTY,
+    TAG_NOT_FOUND,
     TAG_SUCCESSFULLY_ADDED,
+    TAG_SUCCESSFULLY_DELETED,
+    TOO_MANY_TAGS,
 )
+from src.database.db import insert_ignore
 from src.models.models import Photo
+from src.services.qr_code import make_qr_code, qr_public_id, uploaded_qr_codes
+from src.services.rendering import rendering
+from src.services.renditions import forget_photo, renditions
+from src.services.outbox import cancel_deletions, enqueue_deletions, record_assets
+from src.services.leaderboard import leaderboard
+from src.services.pagination import Keyset, invalid_cursor
+from src.services.search_cache import record_search_changes
+from src.services.storage import storage
+from src.services.tag_query import fold, parse_tag_query
+from src.services.tag_dictionary import (
+    record_created_tags,
+    record_tag_links,
+    record_tag_usage,
+    tag_dictionary,
+)
+from src.services.uploads import UploadedImage
 
 
-def init_cloudinary():
-    cloudinary.config(
-        cloud_name=config.CLOUDINARY_NAME,
-        api_key=config.CLOUDINARY_API_KEY,
-        api_secret=config.CLOUDINARY_API_SECRET,
-        secure=True,
-    )
+def normalize_tags(tag_names) -> list[str]:
+    """
+    The normalize_tags function strips and lowercases the tag names and drops
+    the empty ones and the repeated ones, keeping the order.
+
+    :param tag_names: Names of the tags
+    :return: The normalized names
+    """
+    names = (name.strip().lower() for name in tag_names if name)
+    return list(dict.fromkeys(name for name in names if name))
 
 
 async def get_or_create_tag(tag_name: str, db: AsyncSession) -> Tag:
 
     """
     The get_or_create_tag function takes a tag name and an async database session.
-    It then checks if the tag exists in the database, and returns it if so.
-    If not, it creates a new Tag object with that name, adds it to the session, commits 
-    the changes to the database (which generates its primary key), refreshes that object from 
-    the database (to get its primary key) and returns it.
+    It returns the tag with the normalized name, the tag is created if it does not exist.
     
     :param tag_name: str: Specify the name of the tag that we want to create or get
     :param db: AsyncSession: Pass in the database session to the function
     :return: A tag object
     :doc-author: Trelent
     """
-    existing_tag = await db.execute(select(Tag).filter(Tag.name == tag_name))
-    tag = existing_tag.scalar_one_or_none()
-
-    if not tag:
-        tag = Tag(name=tag_name)
-        db.add(tag)
-        # await db.commit()
-        # await db.refresh(tag)
-
-    return tag
+    tags = await get_or_create_tags([tag_name], db)
+    return next(iter(tags.values()), None)
 
 
 def check_tags_quantity(tags: list[str]) -> bool | None:
-    if len(tags) > 5:
-        raise HTTPException(
-            status_code=400, detail="You can add no more 5 tags to one photo."
-        )
+    if len(tags) > TAGS_MAX_NUMBER:
+        raise HTTPException(status_code=400, detail=TOO_MANY_TAGS)
     return True
 
 
-async def assembling_tags(source_tags: list[str], db: AsyncSession) -> List[Tag]:
-    tags = []
+async def get_or_create_tags(tag_names, db: AsyncSession) -> dict[str, Tag]:
+    """
+    The get_or_create_tags function resolves many tags at once. The names are
+    normalized and taken from the tag dictionary, the other existing tags are
+    selected with one SELECT ... IN and the missing ones are created with one
+    INSERT ... ON CONFLICT DO NOTHING RETURNING. A tag inserted by a concurrent
+    request in between is selected again, so two uploads creating the same new
+    tag do not fail on the unique name.
+
+    :param tag_names: Names of the tags
+    :param db: AsyncSession: Pass in the database session to the function
+    :return: A dictionary of the tags by normalized name, in the order of the names
+    """
+    names = normalize_tags(tag_names)
+    if not names:
+        return {}
+
+    tags = {}
+    for name in names:
+        tag = tag_dictionary.tag(name)
+        if tag is not None:
+            tags[name] = await db.merge(tag, load=False)
+    unknown = [name for name in names if name not in tags]
+    if not unknown:
+        return tags
+
+    result = await db.execute(select(Tag).filter(Tag.name.in_(unknown)))
+    found = {tag.name: tag for tag in result.scalars()}
+    tag_dictionary.remember({name: tag.id for name, tag in found.items()})
+    tags.update(found)
+    missing = [name for name in unknown if name not in tags]
+
+    if missing:
+        stmt = insert_ignore(db, Tag)
+        if stmt is None:
+            for name in missing:
+                tags[name] = Tag(name=name)
+                db.add(tags[name])
+            await db.flush()
+            created = {name: tags[name].id for name in missing}
+        else:
+            inserted = (
+                await db.scalars(
+                    stmt.values([{"name": name} for name in missing]).returning(Tag)
+                )
+            ).all()
+            created = {tag.name: tag.id for tag in inserted}
+            tags.update({tag.name: tag for tag in inserted})
+            lost = [name for name in missing if name not in tags]
+            if lost:
+                result = await db.execute(select(Tag).filter(Tag.name.in_(lost)))
+                found = {tag.name: tag for tag in result.scalars()}
+                tag_dictionary.remember({name: tag.id for name, tag in found.items()})
+                tags.update(found)
+        record_created_tags(db, created)
 
-    for tag_name in source_tags:
-        existing_tag = await get_or_create_tag(tag_name, db)
-        tags.append(existing_tag)
+    return {name: tags[name] for name in names if name in tags}
 
-    return tags
+
+async def assembling_tags(source_tags: list[str], db: AsyncSession) -> List[Tag]:
+    tags = await get_or_create_tags(source_tags, db)
+    return list(tags.values())
 
 
-async def get_QR_code(path: str, unique_photo_id: uuid, db: AsyncSession) -> str:
+async def get_QR_code(
+    path: str, db: AsyncSession, qr_format: QrFormat = QrFormat.png
+) -> str:
     """
-    The get_QR_code function takes in a path and unique_photo_id,
-        creates a QR code from the path, uploads it to cloudinary with the unique photo id as its name.
+    The get_QR_code function takes in a path,
+        creates a QR code from the path in memory and uploads it with a public id derived from the path.
+        A path that was already encoded reuses the uploaded QR code instead of uploading it again.
         It returns the secure url of that image.
+        The QR code is taken out of the deletion outbox in the session, the caller commits it
+        with the rest of its transaction.
     
     :param path: str: Pass in the path to the image that is being uploaded
-    :param unique_photo_id: uuid: Make sure that the qr code is unique and not used by another photo
-    :param db: AsyncSession: Create a database session
-    :return: A string, but you're trying to assign it to a photo object
-    """
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=qrcode.constants.ERROR_CORRECT_L,
-        box_size=10,
-        border=4,
+    :param db: AsyncSession: The session of the caller, it is not committed
+    :param qr_format: QrFormat: png or svg
+    :return: The secure url of the QR code
+    """
+    public_id = qr_public_id(path, qr_format)
+    url = uploaded_qr_codes.get(public_id)
+    if url is not None:
+        return url
+
+    # the QR code of the same link may be queued for deletion with a deleted photo;
+    # it is kept from the commit of the caller, the upload below creates it again
+    # if it is gone already
+    await cancel_deletions(db, [public_id])
+
+    image = await make_qr_code(path, qr_format)
+    # overwrite=False: the asset with this public id is already the same QR code;
+    # the format is explicit, an SVG has no signature to guess its extension from
+    upload_result = await storage.upload(
+        image,
+        public_id=public_id,
+        overwrite=False,
+        format=QrFormat(qr_format).value,
     )
+    url = upload_result["secure_url"]
+    uploaded_qr_codes.set(public_id, url)
+    return url
+
+
+async def create_photo(
+    image: UploadedImage,
+    description: str | None,
+    user: User,
+    db: AsyncSession,
+    list_tags: List[str],
+):
+    """
+    The create_photo function save data of a new photo in cloud storage.
+    The image must be already validated by read_image, the tags are checked
+    before the upload, so nothing is stored for a rejected request.
+    If a photo with the same content was uploaded before, its stored asset is reused
+    and nothing is uploaded.
 
-    qr.add_data(path)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
+    :param image: UploadedImage: The validated image
+    :param description: str | None: Description of the photo
+    :param user: User: Get the user id from the token
+    :param db: AsyncSession: Pass the database session to the function
+    :param list_tags: List[str]: Tags of the photo
+    :return: A dictionary with success message
+    :doc-author: Trelent
+    """
 
-    qr_code_file = "my_qr_code.png"
-    img.save(qr_code_file)
+    async def upload(public_photo_id: str) -> dict:
+        return await storage.upload(image.data, public_id=public_photo_id, overwrite=True)
 
-    init_cloudinary()
-    upload_result = cloudinary.uploader.upload(
-        qr_code_file,
-        public_id=f"Qr_Code/{unique_photo_id}",
-        overwrite=True,
-        invalidate=True,
+    return await save_photo(
+        image.content_hash, upload, description, user, db, list_tags
     )
-    return upload_result["secure_url"]
 
 
-async def create_photo(
-    photofile: File(), #type: ignore
+async def create_photo_from_file(
+    path: str,
+    content_hash: str,
     description: str | None,
     user: User,
     db: AsyncSession,
     list_tags: List[str],
 ):
     """
-    The create_photo function save data of a new photo in cloud storage.
+    The create_photo_from_file function saves a photo assembled from a chunked upload.
+    The file is sent to the storage from the disk, a big file in parts.
 
-    :param body: ContactSchema: Validate the request body
-    :param db: AsyncSession: Pass the database session to the function
+    :param path: str: Path of the validated file
+    :param content_hash: str: sha256 of the file
+    :param description: str | None: Description of the photo
     :param user: User: Get the user id from the token
-    :return: A contact object
-    :doc-author: Trelent
+    :param db: AsyncSession: Pass the database session to the function
+    :param list_tags: List[str]: Tags of the photo
+    :return: A dictionary with success message
     """
-    init_cloudinary()
 
-    unique_photo_id = uuid.uuid4()
-    public_photo_id = f"Photos_of_user/{user.username}/{unique_photo_id}"
-    try:
-        r = cloudinary.uploader.upload(
-            photofile.file, public_id=public_photo_id, overwrite=True
-        )
-    except Exception as e:
-        raise HTTPException(status_code=400, detail="Wrong file type (need a picture)!")
+    async def upload(public_photo_id: str) -> dict:
+        return await storage.upload_large(path, public_id=public_photo_id, overwrite=True)
+
+    return await save_photo(content_hash, upload, description, user, db, list_tags)
 
-    src_url = r["url"]
 
+async def save_photo(
+    content_hash: str,
+    upload,
+    description: str | None,
+    user: User,
+    db: AsyncSession,
+    list_tags: List[str],
+):
+    """
+    The save_photo function stores the content unless a photo with the same
+    content_hash is stored already, and saves the new photo with its tags.
+
+    :param content_hash: str: sha256 of the content
+    :param upload: Coroutine function that stores the content under the given public id
+    :param description: str | None: Description of the photo
+    :param user: User: The owner of the photo
+    :param db: AsyncSession: Pass the database session to the function
+    :param list_tags: List[str]: Tags of the photo
+    :return: A dictionary with success message
+    """
+    list_tags = normalize_tags(list_tags)
     check_tags_quantity(list_tags)
+
+    result = await db.execute(
+        select(Photo.path, Photo.public_photo_id)
+        .filter(Photo.content_hash == content_hash)
+        .limit(1)
+    )
+    existing = result.first()
+    if existing:
+        src_url, public_photo_id = existing
+    else:
+        unique_photo_id = uuid.uuid4()
+        public_photo_id = f"Photos_of_user/{user.username}/{unique_photo_id}"
+        try:
+            r = await upload(public_photo_id)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=400, detail="Wrong file type (need a picture)!"
+            )
+        src_url = r["url"]
+        public_photo_id = r["public_id"]
+
     tags = await assembling_tags(list_tags, db)
 
     # QR_code = await get_QR_code(src_url, unique_photo_id, db)
@@ -153,6 +308,7 @@ async def create_photo(
         user_id=id,
         tags=tags,
         public_photo_id=public_photo_id,
+        content_hash=content_hash,
     )
 
     try:
@@ -164,78 +320,236 @@ async def create_photo(
         raise e
     return {"success message": PHOTO_SUCCESSFULLY_ADDED}
 
+async def create_photos(items: list[dict], user: User, db: AsyncSession) -> list[dict]:
+    """
+    The create_photos function saves many photos of one user.
+    The contents that are not stored yet are uploaded concurrently (no more than
+    BULK_UPLOAD_CONCURRENCY at a time, every content once), a content is read into
+    memory only for its upload. The tags of all photos are resolved in one batch and all photos are inserted in one transaction.
+    A file that fails does not stop the others.
+
+    :param items: list[dict]: filename, image (UploadedImage or None), error, description and tags of every file
+    :param user: User: The owner of the photos
+    :param db: AsyncSession: Pass the database session to the function
+    :return: A list with filename, photo_id and detail (the error) for every file
+    """
+    results = [
+        {"filename": item["filename"], "photo_id": None, "detail": item["error"]}
+        for item in items
+    ]
+    pending = []
+    for index, item in enumerate(items):
+        if item["error"] is not None:
+            continue
+        item["tags"] = normalize_tags(item["tags"])
+        try:
+            check_tags_quantity(item["tags"])
+        except HTTPException as e:
+            results[index]["detail"] = e.detail
+            continue
+        pending.append(index)
+
+    hashes = {items[index]["image"].content_hash for index in pending}
+    stored = {}
+    if hashes:
+        result = await db.execute(
+            select(Photo.content_hash, Photo.path, Photo.public_photo_id).filter(
+                Photo.content_hash.in_(hashes)
+            )
+        )
+        for content_hash, path, public_photo_id in result:
+            stored.setdefault(content_hash, (path, public_photo_id))
+
+    to_upload = {}
+    for index in pending:
+        image = items[index]["image"]
+        if image.content_hash not in stored:
+            to_upload.setdefault(image.content_hash, image)
+
+    semaphore = asyncio.Semaphore(config.BULK_UPLOAD_CONCURRENCY)
+
+    async def upload(image: UploadedImage) -> tuple[str, str]:
+        public_photo_id = f"Photos_of_user/{user.username}/{uuid.uuid4()}"
+        async with semaphore:
+            r = await storage.upload(
+                await image.read(), public_id=public_photo_id, overwrite=True
+            )
+        return r["url"], r["public_id"]
+
+    uploaded = await asyncio.gather(
+        *(upload(image) for image in to_upload.values()), return_exceptions=True
+    )
+    upload_errors = {}
+    new_assets = []
+    for content_hash, r in zip(to_upload, uploaded):
+        if isinstance(r, HTTPException):
+            upload_errors[content_hash] = r.detail
+        elif isinstance(r, Exception):
+            upload_errors[content_hash] = SOMETHING_WRONG
+        else:
+            stored[content_hash] = r
+            new_assets.append(r[1])
+
+    ready = [
+        index
+        for index in pending
+        if items[index]["image"].content_hash not in upload_errors
+    ]
+    for index in pending:
+        content_hash = items[index]["image"].content_hash
+        if content_hash in upload_errors:
+            results[index]["detail"] = upload_errors[content_hash]
+
+    tags = await get_or_create_tags(
+        {tag for index in ready for tag in items[index]["tags"]}, db
+    )
+    new_photos = {}
+    for index in ready:
+        item = items[index]
+        path, public_photo_id = stored[item["image"].content_hash]
+        new_photos[index] = Photo(
+            path=path,
+            description=item["description"],
+            path_transform=None,
+            user_id=user.id,
+            tags=[tags[tag] for tag in item["tags"]],
+            public_photo_id=public_photo_id,
+            content_hash=item["image"].content_hash,
+        )
+
+    if new_photos:
+        try:
+            db.add_all(new_photos.values())
+            await db.flush()
+            photo_ids = {index: photo.id for index, photo in new_photos.items()}
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            await asyncio.gather(
+                *(storage.destroy(public_id) for public_id in new_assets),
+                return_exceptions=True,
+            )
+            raise e
+        for index, photo_id in photo_ids.items():
+            results[index]["photo_id"] = photo_id
+
+    return results
+
+
+async def attach_tags(photo_id: int, tag_names, db: AsyncSession) -> dict[str, list[str]]:
+    """
+    The attach_tags function adds tags to the photo with one INSERT ... SELECT.
+    The photo row is locked in a CTE, the tags the photo does not have yet are
+    numbered in the order of the names, and only as many of them are inserted
+    as fit under TAGS_MAX_NUMBER, so two requests can not overfill the photo.
+    This is the only place the limit is enforced.
+    The photo is looked up again only when some tag was not added.
+
+    :param photo_id: int: Specify the photo to which you want to add the tags
+    :param tag_names: Names of the tags, missing tags are created
+    :param db: AsyncSession: Pass the database session to the function
+    :return: The names of the tags which were added, were present already,
+        or were rejected because the photo has TAGS_MAX_NUMBER tags
+    :raises HTTPException: 404 if there is no such photo
+    """
+    report = {"added": [], "present": [], "rejected": []}
+    tags = await get_or_create_tags(tag_names, db)
+    if not tags:
+        return report
+    ids = [tag.id for tag in tags.values()]
+
+    photo = select(Photo.id).filter(Photo.id == photo_id).with_for_update().cte("photo")
+    linked = select(photo_m2m_tag.c.tag_id).filter(photo_m2m_tag.c.photo_id == photo_id)
+    candidates = (
+        select(
+            Tag.id.label("tag_id"),
+            func.row_number()
+            .over(order_by=case({tag_id: i for i, tag_id in enumerate(ids)}, value=Tag.id))
+            .label("position"),
+        )
+        .filter(Tag.id.in_(ids), Tag.id.not_in(linked))
+        .cte("candidates")
+    )
+    current = (
+        select(func.count())
+        .select_from(photo_m2m_tag)
+        .filter(photo_m2m_tag.c.photo_id == photo_id)
+        .scalar_subquery()
+    )
+    stmt = insert_ignore(db, photo_m2m_tag)
+    if stmt is None:
+        stmt = photo_m2m_tag.insert()
+    stmt = stmt.from_select(
+        ["photo_id", "tag_id"],
+        select(photo.c.id, candidates.c.tag_id)
+        .join_from(photo, candidates, true())
+        .filter(candidates.c.position + current <= TAGS_MAX_NUMBER),
+    ).returning(photo_m2m_tag.c.tag_id)
+    try:
+        result = await db.execute(stmt)
+        added = set(result.scalars().all())
+    except IntegrityError:
+        # the dialect has no ON CONFLICT, the unique constraint refused a concurrent link
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=TAG_ALREADY_ADDED)
+
+    present = set()
+    if len(added) < len(ids):
+        result = await db.execute(
+            select(Photo.id, photo_m2m_tag.c.tag_id)
+            .outerjoin(
+                photo_m2m_tag,
+                and_(
+                    photo_m2m_tag.c.photo_id == Photo.id,
+                    photo_m2m_tag.c.tag_id.in_(ids),
+                ),
+            )
+            .filter(Photo.id == photo_id)
+        )
+        rows = result.all()
+        if not rows:
+            raise HTTPException(status_code=404, detail=PHOTO_NOT_FOUND)
+        present = {tag_id for _, tag_id in rows} - added
+
+    for name, tag in tags.items():
+        if tag.id in added:
+            report["added"].append(name)
+        elif tag.id in present:
+            report["present"].append(name)
+        else:
+            report["rejected"].append(name)
+    record_tag_usage(db, dict.fromkeys(report["added"], 1))
+    record_tag_links(db, photo_id, linked=added)
+    if added:
+        record_search_changes(db, [photo_id], added, report["added"])
+    await db.commit()
+    return report
+
+
 async def add_tag_to_photo(photo_id: int, name_tag: str, db: AsyncSession):
     """
-    The add_tag_to_photo function adds a tag to the photo with max numbers tags = 5.
+    The add_tag_to_photo function adds a tag to the photo with max numbers tags = TAGS_MAX_NUMBER.
+    Several tags can be given separated by commas.
         Args:
             photo_id (int): The id of the photo.
             name_tag (str): The name of the tag.
         Returns:
-            dict: A dictionary with success message if everything went well, or an error message otherwise.
+            dict: A dictionary with success message and the report of attach_tags.
     
     :param photo_id: int: Specify the photo to which you want to add a tag
     :param name_tag: str: Specify the name of the tag to be added
     :param db: AsyncSession: Pass the database session to the function
     :return: A dictionary
+    :raises HTTPException: 404 if there is no such photo, 400 if no tag was added
     """
-    stmt = select(Photo).filter_by(id=photo_id)
-    result = await db.execute(stmt)
-    photo = result.scalar_one_or_none()
-    if photo is None:
-        raise HTTPException(status_code=404, detail="Photo not found")
-    # Определим колічество тегов под фото
-    stmt = (
-        select(func.count())
-        .select_from(Photo)
-        .where(
-            and_(
-                Photo.id == photo_id,
-                # mtm
-                Photo.id == photo_m2m_tag.c.photo_id,
-            )
-        )
-    )
-    num_tags: int = await db.scalar(stmt)
-    # num_tags = num_tags.scalar()
-    if num_tags is None:
-        num_tags = 0
-    if num_tags >= 5:
-        raise HTTPException(
-            status_code=400, detail="You can add no more 5 tags to one photo."
-        )
-    # Определим существование тега
-    stmt = select(Tag).filter_by(name=name_tag)
-    result = await db.execute(stmt)
-    tag = result.scalar_one_or_none()
-    # Если тега нет, создадим его
-    if tag is None:
-        tag = Tag(name=name_tag)
-        db.add(tag)
-        # Используем flush, чтобы получить id тега, коториий будет добавлен
-        await db.flush()
-    else:
-        # Определим есть ли у єтого фото такой тег
-        stmt = (
-            select(func.count())
-            .select_from(Photo)
-            .where(
-                and_(
-                    Photo.id == photo_id,
-                    # mtm
-                    Photo.id == photo_m2m_tag.c.photo_id,
-                    Tag.id == photo_m2m_tag.c.tag_id,
-                )
-            )
-        )
-        num_tags: int = await db.execute(stmt)
-        num_tags = num_tags.scalar_one_or_none()
-        if num_tags:
-            raise HTTPException(status_code=400, detail="This photo has had this tag!")
-    # Добавляем связь
-    stmt = photo_m2m_tag.insert().values(photo_id=photo.id, tag_id=tag.id)
-    await db.execute(stmt)
-    await db.commit()
-    return {"success message": TAG_SUCCESSFULLY_ADDED}
+    report = await attach_tags(photo_id, name_tag.split(","), db)
+    if not report["added"]:
+        if report["rejected"]:
+            raise HTTPException(status_code=400, detail=TOO_MANY_TAGS)
+        if report["present"]:
+            raise HTTPException(status_code=400, detail=TAG_ALREADY_ADDED)
+        raise HTTPException(status_code=400, detail=TAG_NAME_EMPTY)
+    return {"success message": TAG_SUCCESSFULLY_ADDED, **report}
 
 
 async def edit_photo_description(
@@ -280,25 +594,41 @@ async def edit_photo_description(
             raise e
 
 
+# the 0 is not a bound parameter, so the expression matches ix_photos_rating_score_id
+RATING_SCORE = func.coalesce(Photo.rating_avg, literal_column("0"))
+SORT_KEYS = {
+    PhotoSort.created_at: Photo.created_at,
+    PhotoSort.rating: RATING_SCORE,
+    PhotoSort.comments: Photo.comment_count,
+}
+
+
+def photo_keyset(sort: PhotoSort, order: SortOrder) -> Keyset:
+    """
+    The photo_keyset function pages the photos by the sort key and the id;
+    every sort key has an index on (key, id), read forwards or backwards.
+    """
+    return Keyset(SORT_KEYS[sort], Photo.id, descending=order == SortOrder.desc)
+
+
 async def get_all_photos(
-    skip_photos: int, photos_per_page: int, db: AsyncSession
-) -> list[Photo]:
+    cursor: str | None, photos_per_page: int, db: AsyncSession,
+    sort: PhotoSort = PhotoSort.created_at, order: SortOrder = SortOrder.asc,
+) -> dict:
 
     """
-    The get_all_photos function returns a list of Photo objects.
+    The get_all_photos function returns a page of Photo objects, the oldest first by default.
     
-    :param skip_photos: int: Skip the first n photos
+    :param cursor: str | None: Cursor of the previous page, None for the first page
     :param photos_per_page: int: Specify the number of photos to be returned per page
     :param db: AsyncSession: Pass in the database connection
-    :return: A list of photo objects
+    :param sort: PhotoSort: Sort by the creation time, the average rating or the number of comments
+    :param order: SortOrder: Ascending or descending
+    :return: The photos of the page and the cursor of the next page
     """
-    result = await db.execute(
-        select(Photo).order_by(Photo.id).offset(skip_photos).limit(photos_per_page)
-    )
-
-    photos = result.scalars().all()
-
-    return photos
+    keyset = photo_keyset(sort, order)
+    result = await db.execute(keyset.apply(select(Photo), cursor, photos_per_page))
+    return keyset.page(result, photos_per_page)
 
 
 async def get_photo_by_id(photo_id: int, db: AsyncSession) -> dict | None:
@@ -323,7 +653,9 @@ async def get_photo_by_id(photo_id: int, db: AsyncSession) -> dict | None:
 async def delete_photo(photo_id: int, user: User, db: AsyncSession) -> bool:
 
     """
-    The delete_photo function deletes a photo from the database and cloudinary.
+    The delete_photo function deletes a photo from the database; its stored assets
+    (the photo and the QR codes of its renditions) go to the deletion outbox in the
+    same transaction and are removed from the storage by the reaper.
         Args:
             photo_id (int): The id of the photo to be deleted.
             user (User): The user who is deleting the photo.
@@ -357,7 +689,6 @@ async def delete_photo(photo_id: int, user: User, db: AsyncSession) -> bool:
         or user.role == Role.moderator
         or photo.user_id == user.id
     ):
-        init_cloudinary()
 # =======
 # <<<<<<< oleksandr
 #    if user.role == Role.admin or photo.user_id == user.id:
@@ -382,7 +713,25 @@ async def delete_photo(photo_id: int, user: User, db: AsyncSession) -> bool:
 # >>>>>>> dev
 # >>>>>>> dev
 # >>>>>>> dev
-        cloudinary.uploader.destroy(photo.public_photo_id)
+        # the asset can be shared by re-posts of the same file
+        shared = await db.execute(
+            select(Photo.id)
+            .filter(
+                Photo.public_photo_id == photo.public_photo_id,
+                Photo.id != photo.id,
+            )
+            .limit(1)
+        )
+        forget_photo(photo_id)
+        # QR codes and avatars built from the photo by any process
+        result = await db.execute(
+            delete(PhotoAsset)
+            .filter(PhotoAsset.photo_id == photo_id)
+            .returning(PhotoAsset.public_id)
+        )
+        assets = result.scalars().all()
+        if shared.first() is None:
+            enqueue_deletions(db, [photo.public_photo_id, *assets])
         try:
             # Видалення пов'язаних рейтингів
             await db.execute(
@@ -397,53 +746,84 @@ async def delete_photo(photo_id: int, user: User, db: AsyncSession) -> bool:
             raise e
 
 
+async def detach_tags(photo_id: int, tag_names, db: AsyncSession) -> dict[str, list[str]]:
+    """
+    The detach_tags function removes tags from the photo with one
+    DELETE ... RETURNING; the ids of the tags come from the tag dictionary.
+    The photo is looked up only when some tag was not removed.
+
+    :param photo_id: int: Find the photo in the database
+    :param tag_names: Names of the tags to be removed
+    :param db: AsyncSession: Pass the database connection to the function
+    :return: The names of the tags which were removed and of the ones the photo had not
+    :raises HTTPException: 404 if there is no such photo
+    """
+    names = normalize_tags(tag_names)
+    if not names:
+        return {"removed": [], "absent": []}
+    ids = [tag_dictionary.get(name) for name in names]
+    unknown = [name for name, tag_id in zip(names, ids) if tag_id is None]
+    tag_filter = photo_m2m_tag.c.tag_id.in_([tag_id for tag_id in ids if tag_id is not None])
+    if unknown:
+        tag_filter = or_(
+            tag_filter,
+            photo_m2m_tag.c.tag_id.in_(select(Tag.id).filter(Tag.name.in_(unknown))),
+        )
+    stmt = (
+        delete(photo_m2m_tag)
+        .where(photo_m2m_tag.c.photo_id == photo_id, tag_filter)
+        .returning(
+            photo_m2m_tag.c.tag_id,
+            select(Tag.name)
+            .filter(Tag.id == photo_m2m_tag.c.tag_id)
+            .scalar_subquery(),
+        )
+    )
+    result = await db.execute(stmt)
+    rows = result.all()
+    removed = {name for _, name in rows}
+    if len(removed) < len(names):
+        photo = await db.scalar(select(Photo.id).filter(Photo.id == photo_id))
+        if photo is None:
+            raise HTTPException(status_code=404, detail=PHOTO_NOT_FOUND)
+    record_tag_usage(db, dict.fromkeys(removed, -1))
+    record_tag_links(db, photo_id, unlinked=[tag_id for tag_id, _ in rows])
+    if removed:
+        record_search_changes(db, [photo_id], words=removed)
+    await db.commit()
+    return {
+        "removed": [name for name in names if name in removed],
+        "absent": [name for name in names if name not in removed],
+    }
+
+
 async def del_photo_tag(photo_id: int, name_tag: str, db: AsyncSession):
     """
     The del_photo_tag function deletes a tag from the photo.
+    Several tags can be given separated by commas.
         Args:
             photo_id (int): The id of the photo to delete a tag from.
             name_tag (str): The name of the tag to be deleted.
         Returns:
-            dict: A dictionary containing success message if successful, or an error message otherwise.
+            dict: A dictionary with success message and the report of detach_tags.
     
     :param photo_id: int: Find the photo in the database
     :param name_tag: str: Specify the name of the tag to be deleted
     :param db: AsyncSession: Pass the database connection to the function
     :return: A dictionary
+    :raises HTTPException: 404 if there is no such photo or tag, 400 if the photo has not the tag
     """
-    stmt = select(Photo).filter_by(id=photo_id)
-    result = await db.execute(stmt)
-    photo = result.scalar_one_or_none()
-    if photo is None:
-        raise HTTPException(status_code=404, detail="Photo not found")
-    # Определим существование тега
-    stmt = select(Tag).filter_by(name=name_tag)
-    result = await db.execute(stmt)
-    tag = result.scalar_one_or_none()
-    # Если тега нет, сообщаем ошибку
-    if tag is None:
-        raise HTTPException(status_code=404, detail="Tag not found")
-    # Определим есть ли у єтого фото такой тег
-    stmt = select(Photo).where(
-        and_(
-            Photo.id == photo_id,
-            # mtm
-            Photo.id == photo_m2m_tag.c.photo_id,
-            tag.id == photo_m2m_tag.c.tag_id,
-        )
-    )
-    photo_tag = await db.execute(stmt)
-    photo_tag = photo_tag.scalar_one_or_none()
-    if not photo_tag:
-        raise HTTPException(status_code=400, detail="This photo don't has this tag!")
-    # удаляем связь из m2m
-    stmt = delete(photo_m2m_tag).where(
-        photo_m2m_tag.c.photo_id == photo_id, photo_m2m_tag.c.tag_id == tag.id
-    )
-    await db.execute(stmt)
-    await db.commit()
-    return {"success message": "Tag successfully deleted"}
-
+    report = await detach_tags(photo_id, name_tag.split(","), db)
+    if not report["removed"]:
+        known = any(tag_dictionary.get(name) for name in report["absent"])
+        if not known:
+            known = await db.scalar(
+                select(Tag.id).filter(Tag.name.in_(report["absent"])).limit(1)
+            )
+        if not known:
+            raise HTTPException(status_code=404, detail=TAG_NOT_FOUND)
+        raise HTTPException(status_code=400, detail=PHOTO_HAS_NOT_TAG)
+    return {"success message": TAG_SUCCESSFULLY_DELETED, **report}
 
 
 async def change_photo(
@@ -454,13 +834,15 @@ async def change_photo(
     height: int,
     crop_mode: str,
     effect: str,
+    qr_format: QrFormat = QrFormat.png,
 ) -> Photo:
 
     """
     The change_photo function takes a photo_id, width, height, crop_mode and effect as input.
     It then checks if the crop mode is allowed. If it is not allowed an error message will be returned to the user.
-    If it is allowed then the transformation of the image will take place on cloudinary and a new url for that transformed image 
-    will be returned along with its QR code.
+    If it is allowed then a derived url with the transformation is built from the public id of the photo
+    (nothing is uploaded) and returned along with its QR code. A rendition built before is taken from the cache;
+    the photo is then only read, it is written when its path_transform is another rendition.
     
     :param user: User: Get the username of the user
     :param photo_id: int: Identify the photo in the database
@@ -469,6 +851,7 @@ async def change_photo(
     :param height: int: Set the height of the photo
     :param crop_mode: str: Specify the crop mode that will be used to transform the photo
     :param effect: str: Apply a filter to the image
+    :param qr_format: QrFormat: Format of the QR code
     :return: A dictionary with two keys: transformed_url and qr code
     :doc-author: Trelent
     """
@@ -481,38 +864,54 @@ async def change_photo(
     else:
         raise HTTPException(status_code=400, detail="This crop mode is not allowed!")
 
-    query = select(Photo).filter(Photo.id == photo_id)
-    result = await db.execute(query)
-    photo = result.scalar_one_or_none()
-
-    if not photo:
-        raise HTTPException(status_code=400, detail=PHOTO_NOT_FOUND)
+    key = ("change", photo_id, width, height, crop_mode, effect, qr_format)
+    rendition = renditions.get(key)
+    if rendition is not None:
+        result = await db.execute(
+            select(Photo.path_transform).filter(Photo.id == photo_id)
+        )
+        row = result.first()
+        if row is None:
+            # the cache of this process still had the rendition of a photo deleted by another one
+            forget_photo(photo_id)
+            raise HTTPException(status_code=404, detail=PHOTO_NOT_FOUND)
+        if row.path_transform == rendition["transformed_url"]:
+            return dict(rendition)
+    else:
+        query = select(Photo).filter(Photo.id == photo_id)
+        result = await db.execute(query)
+        photo = result.scalar_one_or_none()
 
-    # завантажуємо файл на клаудинарі з трансформацією
-    init_cloudinary()
+        if not photo:
+            raise HTTPException(status_code=400, detail=PHOTO_NOT_FOUND)
 
-    unique_photo_id = uuid.uuid4()
-    public_photo_id = f"Photos_of_user/{user.username}/{unique_photo_id}"
-    r = cloudinary.uploader.upload(
-        photo.path,
-        public_id=public_photo_id,
-        overwrite=True,
-        transformation=transformation,
-    )
-
-    url = cloudinary.CloudinaryImage(public_photo_id).build_url()
-    photo.path_transform = url
-    QR_code = await get_QR_code(url, unique_photo_id, db)
+        url = storage.build_url(photo.public_photo_id, transformation=transformation)
+        try:
+            QR_code = await get_QR_code(url, db, qr_format)
+            await record_assets(db, photo_id, [qr_public_id(url, qr_format)])
+        except Exception as e:
+            await db.rollback()
+            raise e
+        rendition = {"transformed_url": url, "QR code": QR_code}
+        renditions.set(key, rendition)
 
     try:
-        # db.add(new_photo)
+        # one commit with the QR code kept out of the deletion outbox
+        result = await db.execute(
+            update(Photo)
+            .filter(Photo.id == photo_id)
+            .values(path_transform=rendition["transformed_url"])
+        )
         await db.commit()
-        await db.refresh(photo)
     except Exception as e:
         await db.rollback()
         raise e
+    if result.rowcount == 0:
+        # the photo was deleted by another request since it was read
+        forget_photo(photo_id)
+        raise HTTPException(status_code=404, detail=PHOTO_NOT_FOUND)
 
-    return {"transformed_url": url, "QR code": QR_code}
+    return dict(rendition)
 
 
 async def make_avatar_from_photo(
@@ -520,20 +919,33 @@ async def make_avatar_from_photo(
     photo_id: int,
     effect_mode: str,
     db: AsyncSession,
+    qr_format: QrFormat = QrFormat.png,
 ) -> Photo:
 
     """
     The make_avatar_from_photo function takes a photo_id, effect_mode and user as input.
-    It then queries the database for the photo with that id. If it exists, it uploads
-    the image to cloudinary using the given effect mode and returns a url to that image.
+    It then queries the database for the photo with that id. If it exists, it builds
+    a derived url of the photo with the avatar transformation (nothing is uploaded) and returns it.
+    A storage without transformations gets an avatar rendered locally and uploaded instead.
+    A rendition built before is taken from the cache once the photo is found to still exist.
     
     :param user: User: Get the username of the user
     :param photo_id: int: Identify the photo that will be used to create an avatar
     :param effect_mode: str: Apply a filter to the photo
     :param db: AsyncSession: Pass a database session to the function
+    :param qr_format: QrFormat: Format of the QR code
     :return: A dictionary with two keys: avatar and qr code
     :doc-author: Trelent
     """
+    key = ("avatar", photo_id, effect_mode, qr_format)
+    rendition = renditions.get(key)
+    if rendition is not None:
+        if await db.scalar(select(Photo.id).filter(Photo.id == photo_id)) is None:
+            # the cache of this process still had the rendition of a photo deleted by another one
+            forget_photo(photo_id)
+            raise HTTPException(status_code=404, detail=PHOTO_NOT_FOUND)
+        return dict(rendition)
+
     query = select(Photo).filter(Photo.id == photo_id)
     result = await db.execute(query)
     photo = result.scalar_one_or_none()
@@ -549,146 +961,275 @@ async def make_avatar_from_photo(
     if not photo:
         raise HTTPException(status_code=400, detail=PHOTO_NOT_FOUND)
 
-    init_cloudinary()
+    assets = []
+    if storage.transforms:
+        url = storage.build_url(photo.public_photo_id, transformation=avatar)
+    else:
+        original = await storage.read(photo.public_photo_id)
+        image = await rendering.avatar(original, size=200, effect=effect_mode)
+        r = await storage.upload(
+            image, public_id=f"Avatars/{photo.public_photo_id}", overwrite=True
+        )
+        url = r["secure_url"]
+        assets.append(r["public_id"])
+    try:
+        QR_code = await get_QR_code(url, db, qr_format)
+        await record_assets(db, photo_id, [*assets, qr_public_id(url, qr_format)])
+        await db.commit()
+    except Exception as e:
+        await db.rollback()
+        raise e
+    rendition = {"avatar": url, "QR code": QR_code}
+    renditions.set(key, rendition)
 
-    unique_photo_id = uuid.uuid4()
-    public_photo_id = f"Photos_of_user/{user.username}/{unique_photo_id}"
-    r = cloudinary.uploader.upload(
-        photo.path,
-        public_id=public_photo_id,
-        overwrite=True,
-        transformation=avatar,
-    )
+    return dict(rendition)
 
-    # забрати посилання но нове фото, покласти його у photo.path_transform та зберігти дані у базі
-    # url = cloudinary.CloudinaryImage(photo.public_photo_id).build_url(
-    #     transformation=avatar
-    # )
-    url = cloudinary.CloudinaryImage(public_photo_id).build_url()
-    QR_code = await get_QR_code(url, unique_photo_id, db)
+  
 
-    return {"avatar": url, "QR code": QR_code}
+def keyword_search(search_keyword: str, db: AsyncSession):
+    """
+    The keyword_search function builds the filter of a keyword search and its rank.
+    On PostgreSQL the keywords are a web search query (words, "a phrase", or, -word)
+    matched against photos.search_vector, which holds the description and the tag
+    names and has a GIN index; the photos are ranked with ts_rank. On other
+    databases every word must be in the description or be a tag of the photo,
+    and there is no rank.
+
+    :param search_keyword: str: The keywords
+    :param db: AsyncSession: The session, its dialect selects the way
+    :return: The filter of photos and the rank expression or None
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, search_keyword)
+        return (
+            Photo.search_vector.bool_op("@@")(query),
+            func.ts_rank(Photo.search_vector, query, type_=Float),
+        )
+    conditions = []
+    for word in search_keyword.split():
+        name = word.lower()
+        tag_id = tag_dictionary.get(name)
+        if tag_id is None:
+            tag_id = select(Tag.id).filter(Tag.name == name).scalar_subquery()
+        tagged = select(photo_m2m_tag.c.photo_id).filter(photo_m2m_tag.c.tag_id == tag_id)
+        conditions.append(or_(Photo.description.ilike(f"%{word}%"), Photo.id.in_(tagged)))
+    return and_(true(), *conditions), None
+
+
+async def fuzzy_search(search_keyword: str, db: AsyncSession):
+    """
+    The fuzzy_search function builds the filter of a search tolerating typos and
+    its rank. Every word must be similar to a tag of the photo or to a word of its
+    description, with the similarity at least config.SEARCH_SIMILARITY, and the
+    photos are ranked by the sum of the similarities of the words.
+    On PostgreSQL the similar tags and descriptions are found with the pg_trgm
+    operators on their GIN indexes. On other databases the words are compared with
+    the tag names in the trigram index of the tag dictionary (of the tags table
+    if the dictionary is not in use), and the description must contain the
+    word or one of its similar tag names.
+
+    :param search_keyword: str: The keywords
+    :param db: AsyncSession: The session, its dialect selects the way
+    :return: The filter of photos and the rank expression
+    """
+    threshold = config.SEARCH_SIMILARITY
+    words = search_keyword.lower().split()
+    conditions, ranks = [], []
+    if db.get_bind().dialect.name == "postgresql":
+        # the thresholds of the indexed operators, for this transaction only
+        await db.execute(
+            select(
+                func.set_config("pg_trgm.similarity_threshold", str(threshold), True),
+                func.set_config("pg_trgm.word_similarity_threshold", str(threshold), True),
+            )
+        )
+        for word in words:
+            tags = (
+                select(photo_m2m_tag.c.photo_id)
+                .join(Tag, Tag.id == photo_m2m_tag.c.tag_id)
+            )
+            tagged = tags.filter(Tag.name.bool_op("%")(word))
+            best_tag = (
+                select(func.max(func.similarity(Tag.name, word)))
+                .join(photo_m2m_tag, photo_m2m_tag.c.tag_id == Tag.id)
+                .filter(photo_m2m_tag.c.photo_id == Photo.id)
+                .scalar_subquery()
+            )
+            conditions.append(
+                or_(Photo.description.bool_op("%>")(word), Photo.id.in_(tagged))
+            )
+            ranks.append(
+                func.greatest(
+                    func.coalesce(best_tag, 0),
+                    func.word_similarity(word, Photo.description),
+                    type_=Float,
+                )
+            )
+        return and_(true(), *conditions), sum(ranks[1:], ranks[0]) if ranks else literal(0.0)
+
+    index = await tag_dictionary.trigram_index(db)
+    for word in words:
+        similar = index.similar(word, threshold, FUZZY_MAX_TERMS)
+        options = [(Photo.description.ilike(f"%{word}%"), 1.0)]
+        for name, score in similar:
+            tag_id = tag_dictionary.get(name)
+            if tag_id is None:
+                tag_id = select(Tag.id).filter(Tag.name == name).scalar_subquery()
+            tagged = select(photo_m2m_tag.c.photo_id).filter(photo_m2m_tag.c.tag_id == tag_id)
+            options.append(
+                (or_(Photo.id.in_(tagged), Photo.description.ilike(f"%{name}%")), score)
+            )
+        options.sort(key=lambda option: -option[1])
+        conditions.append(or_(*(condition for condition, _ in options)))
+        ranks.append(case(*options, else_=0.0))
+    rank = type_coerce(sum(ranks[1:], ranks[0]) if ranks else literal(0.0), Float)
+    return and_(true(), *conditions), rank
 
-  
 
-async def search_photos(search_keyword: str, photos_per_page: int, skip_photos: int,
-                    db: AsyncSession, user: User) -> list[Photo]:
+def search_keyset(rank, sort: PhotoSort | None = None, order: SortOrder = SortOrder.desc) -> Keyset:
+    """
+    The search_keyset function pages the results of keyword_search by the sort
+    key if it is given, else the best matches first if there is a rank, else in
+    the order of the ids.
+    """
+    if sort is not None:
+        return photo_keyset(sort, order)
+    if rank is None:
+        return Keyset(Photo.id)
+    return Keyset(rank, Photo.id, descending=True)
+
+
+async def search_photos(search_keyword: str, photos_per_page: int, cursor: str | None,
+                    db: AsyncSession, user: User, fuzzy: bool = False,
+                    sort: PhotoSort | None = None, order: SortOrder = SortOrder.desc) -> dict:
     """
     The search_photos function searches for photos that match the search_keyword.
-        The function returns a list of Photo objects that match the search_keyword.
+        The function returns a page of Photo objects that match the search_keyword.
         
     
     :param search_keyword: str: Search for photos that contain the keyword in their description or tags
     :param photos_per_page: int: Limit the number of photos per page
-    :param skip_photos: int: Skip the number of photos specified by this parameter
+    :param cursor: str | None: Cursor of the previous page, None for the first page
     :param db: AsyncSession: Create a connection to the database
     :param user: User: Check if the user is logged in or not
-    :return: A list of photos
-    """
-    stmt = select(Photo).where(or_(Photo.description.ilike(f"%{search_keyword}%"),
-                            and_(
-                    Tag.name == search_keyword,
-                    # mtm
-                    Photo.id == photo_m2m_tag.c.photo_id,
-                    Tag.id == photo_m2m_tag.c.tag_id,
-                                )
-                            )).group_by(Photo.id).order_by(
-        Photo.id).offset(skip_photos).limit(photos_per_page)
+    :param fuzzy: bool: Tolerate typos in the keywords, see fuzzy_search
+    :param sort: PhotoSort | None: Sort key, None for the best matches first
+    :param order: SortOrder: Ascending or descending by the sort key
+    :return: The photos of the page and the cursor of the next page
+    """
+    if fuzzy:
+        keyword_filter, rank = await fuzzy_search(search_keyword, db)
+    else:
+        keyword_filter, rank = keyword_search(search_keyword, db)
+    keyset = search_keyset(rank, sort, order)
+    stmt = keyset.apply(select(Photo).where(keyword_filter), cursor, photos_per_page)
     result = await db.execute(stmt)
-    photos_key_word = result.scalars().all()
-    return photos_key_word
+    return keyset.page(result, photos_per_page)
 
 
-# может у кого то получится об'единить 2 запроса в один и вибрать со средним рейтингом
-# вмксто функции search_photos_by_filter где ми находим 2-мя запросами
-# async def search_photo(search_keyword: str, rate_min: float, rate_max: float, photos_per_page: int, skip_photos: int,
-#                     db: AsyncSession, user: User) -> list[Photo]:
-    
-#     if rate_min or rate_max:
-#         rate_min = rate_min or 0.01
-#         rate_max = rate_max or 5.0
-#     stmt = (select(Photo)
-#                 .join(photo_m2m_tag)
-#                 .join(Tag)
-#                 .join(Rating)
-#                 .where(or_(Photo.description.ilike(f"%{search_keyword}%"),
-#                            and_(
-#                             Tag.name == search_keyword,
-#                             Photo.id == photo_m2m_tag.c.photo_id,
-#                             Tag.id == photo_m2m_tag.c.tag_id,
-#                                 )
-#                            ))
-#                 .group_by(Photo.id)
-#                 .having(and_(
-#             func.avg(Rating.rating) >= rate_min,
-#             func.avg(Rating.rating) <= rate_max
-#         ))
-#                 .order_by(Photo.id)
-#                 .offset(skip_photos)
-#                 .limit(photos_per_page)
-#                 )
-#     print(stmt)
-#     result = await db.execute(stmt)
-#     photos_with_filter = result.scalars().all()
-#     return photos_with_filter
-
-async def search_photos_by_filter(search_keyword: str, rate_min: float, rate_max: float, photos_per_page: int, skip_photos: int,
-                    db: AsyncSession, user: User) -> list[Photo]:
+async def search_photos_by_filter(search_keyword: str, rate_min: float, rate_max: float, photos_per_page: int, cursor: str | None,
+                    db: AsyncSession, user: User, fuzzy: bool = False,
+                    sort: PhotoSort | None = None, order: SortOrder = SortOrder.desc) -> dict:
     # ищем по ключевому слову в Description Photo со средним рейтингом в диапазоне
     """
     The search_photos_by_filter function searches for photos by a search keyword,
         and filters the results with average rating in range from minimum to maximum rating.
+        The description and the tag matches are filtered and paginated in one statement.
         
     
-    :param search_keyword: str: Search for a keyword in the description of the photo
-    :param rate_min: float: Specify the minimum rating of a photo
-    :param rate_max: float: Specify the minimum rating of a photo
+    :param search_keyword: str: Search for the keywords in the description and the tags of the photo
+    :param rate_min: float: Specify the minimum average rating of a photo (included)
+    :param rate_max: float: Specify the maximum average rating of a photo (included)
     :param photos_per_page: int: Specify the number of photos to be displayed on one page
-    :param skip_photos: int: Skip the first n photos
+    :param cursor: str | None: Cursor of the previous page, None for the first page
     :param db: AsyncSession: Access the database
-    :return: A list of photo objects
-    """
-    if rate_min or rate_max:
-        rate_min = rate_min or 0.1
-        rate_max = rate_max or 5.0
-        print(rate_min, rate_max)
-    stmt = (select(Photo)
-                .join(Rating)
-                .where(Photo.description.ilike(f"%{search_keyword}%"))
-                .group_by(Photo.id)
-                .having(and_(
-            func.avg(Rating.rating) >= rate_min,
-            func.avg(Rating.rating) <= rate_max
-        ))
-                .order_by(Photo.id)
-                .offset(skip_photos)
-                .limit(photos_per_page)
-                )
-    result = await db.execute(stmt)
-    photos_key_word = result.scalars().all()
-     # ищем по совпадению ключевого слова и Тега со средним рейтингом в диапазоне
-    stmt = (select(Photo)
-            .join(photo_m2m_tag)
-            .join(Tag)
-            .join(Rating)
-            .where(and_(
-        Tag.name == search_keyword,
-        Photo.id == photo_m2m_tag.c.photo_id,
-        Tag.id == photo_m2m_tag.c.tag_id,
-    ))
-            .group_by(Photo.id)
-            .having(and_(
-        func.avg(Rating.rating) >= rate_min,
-        func.avg(Rating.rating) < rate_max
-    ))
-            .order_by(Photo.id)
-            .offset(skip_photos)
-            .limit(photos_per_page)
-            )
+    :param fuzzy: bool: Tolerate typos in the keywords, see fuzzy_search
+    :param sort: PhotoSort | None: Sort key, None for the best matches first
+    :param order: SortOrder: Ascending or descending by the sort key
+    :return: The photos of the page and the cursor of the next page
+    """
+    rate_min = RATING_MIN_VALUE if rate_min is None else rate_min
+    rate_max = RATING_MAX_VALUE if rate_max is None else rate_max
+    if fuzzy:
+        keyword_filter, rank = await fuzzy_search(search_keyword, db)
+    else:
+        keyword_filter, rank = keyword_search(search_keyword, db)
+    keyset = search_keyset(rank, sort, order)
+    # photos without ratings have no average and are not in any range
+    stmt = keyset.apply(
+        select(Photo).where(keyword_filter, Photo.rating_avg.between(rate_min, rate_max)),
+        cursor,
+        photos_per_page,
+    )
     result = await db.execute(stmt)
-    photos_by_tags = result.scalars().all()
-    # объединяем результаты поиска по ключевому слову и тегу со средним рейтингом в диапазоне и убираем дубликаты из результатов
-    photos = photos_key_word + [x for x in photos_by_tags if x not in photos_key_word]
-    if photos == []:
+    page = keyset.page(result, photos_per_page)
+    if page["items"] == []:
         raise  HTTPException(status_code=400, detail=f"Photo with keyword={search_keyword} not found")
-    return photos
+    return page
+
+
+def _tagged_photos(name: str):
+    tag_id = select(Tag.id).filter(Tag.name == name).scalar_subquery()
+    return Photo.id.in_(
+        select(photo_m2m_tag.c.photo_id).filter(photo_m2m_tag.c.tag_id == tag_id)
+    )
+
+
+async def get_top_photos(window: LeaderboardWindow, limit: int, db: AsyncSession) -> list[dict]:
+    """
+    The get_top_photos function returns the best rated photos of the window,
+    ranked by the leaderboard; the photos deleted since are left out.
+
+    :param window: LeaderboardWindow: Ratings of the current day, week or of all time
+    :param limit: int: The number of photos
+    :param db: AsyncSession: Pass in the database connection
+    :return: The photos with their scores, the best first
+    """
+    board = await leaderboard.top(window, limit, db)
+    if not board:
+        return []
+    result = await db.execute(select(Photo).filter(Photo.id.in_([photo_id for photo_id, _ in board])))
+    photos = {photo.id: photo for photo in result.scalars()}
+    return [
+        {"photo": photos[photo_id], "score": score}
+        for photo_id, score in board
+        if photo_id in photos
+    ]
+
+
+async def search_photos_by_tags(tags: str, photos_per_page: int, cursor: str | None,
+                                db: AsyncSession) -> dict:
+    """
+    The search_photos_by_tags function searches for photos by a boolean query of
+    their tags, like: sunset AND beach NOT night. The query is evaluated on the
+    Bitsets of the tag dictionary and only the photos of the page are read from
+    the database; without the dictionary the query becomes a SQL filter.
+    The photos are paginated in the order of their ids.
+
+    :param tags: str: The query, see src/services/tag_query.py
+    :param photos_per_page: int: Specify the number of photos to be displayed on one page
+    :param cursor: str | None: Cursor of the previous page, None for the first page
+    :param db: AsyncSession: Access the database
+    :return: The photos of the page and the cursor of the next page
+    :raises HTTPException: 400 if the query or the cursor is not valid
+    """
+    query = parse_tag_query(tags)
+    keyset = Keyset(Photo.id)
+    bits = tag_dictionary.photos(query)
+    if bits is None:
+        tag_filter = fold(query, tag=_tagged_photos, and_=and_, or_=or_, not_=not_)
+        result = await db.execute(keyset.apply(select(Photo).where(tag_filter), cursor, photos_per_page))
+        return keyset.page(result, photos_per_page)
+
+    after = keyset.decode(cursor)[0] if cursor else None
+    if after is not None and after < 0:
+        # not made by this list
+        raise invalid_cursor()
+    ids = bits.first(after, photos_per_page + 1)
+    page_ids = ids[:photos_per_page]
+    photos = []
+    if page_ids:
+        result = await db.execute(select(Photo).filter(Photo.id.in_(page_ids)).order_by(Photo.id))
+        photos = result.scalars().all()
+    next_cursor = keyset.encode(page_ids[-1:]) if len(ids) > photos_per_page else None
+    return {"items": photos, "next_cursor": next_cursor}
@@ -5,12 +5,38 @@ Module with functions to work with rating
 import uuid
 
 from fastapi import Depends, HTTPException
-from sqlalchemy import select, update, func, extract, and_
+from sqlalchemy import select, insert, update, func, extract, and_, literal
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.dml import Update
 
-from src.database.db import get_db
+from src.database.db import get_db, insert_ignore
 from src.conf import messages
 from src.models.models import Photo, Rating
+from src.services.leaderboard import record_rating
+from src.services.search_cache import record_search_changes
+
+
+def count_rating(photo_id: int, rating: int, count: int = 1) -> Update:
+    """
+    Update of the rating aggregates of the photo; the increments are applied
+    by the database, so concurrent ratings of the photo are all counted.
+
+    :param: photo_id: int - id of the rated photo
+    :param: rating: int - value added to the sum, negative to remove a rating
+    :param: count: int - 1 to add a rating, -1 to remove it
+    :return: Update - statement to execute in the transaction of the rating
+    """
+
+    return (
+        update(Photo)
+        .where(Photo.id == photo_id)
+        .values(
+            rating_sum=Photo.rating_sum + rating,
+            rating_count=Photo.rating_count + count,
+        )
+        .execution_options(synchronize_session=False)
+    )
 
 
 async def create_rating(rating: int,
@@ -18,23 +44,39 @@ async def create_rating(rating: int,
                         user_id: uuid.UUID,
                         db: AsyncSession = Depends(get_db), ):
     """
-    Create rating
+    Create rating with one INSERT ... SELECT, which inserts nothing if the photo
+    does not exist or belongs to the user, and ON CONFLICT nothing either if the
+    user rated the photo already, so a repeated request is not counted twice
 
     :param: rating: int - rating to create
     :param: photo_id: int - id of photo to create rating
     :param: user_id: uuid.UUID - id of user to create rating
     :param: db: AsyncSession - database session
-    :return: Rating - created rating
+    :return: Rating - created rating or None if the photo can not be rated by the user
     """
 
-    rating = Rating(rating=rating,
-                    photo_id=photo_id,
-                    user_id=user_id,
-                    )
-    db.add(rating)
+    rated_photo = select(
+        literal(rating), Photo.id, literal(user_id, Rating.user_id.type)
+    ).filter(Photo.id == photo_id, Photo.user_id != user_id)
+    stmt = insert_ignore(db, Rating)
+    if stmt is None:
+        stmt = insert(Rating)
+    stmt = stmt.from_select(["rating", "photo_id", "user_id"], rated_photo).returning(Rating)
+    try:
+        new_rating = (await db.scalars(stmt)).one_or_none()
+    except IntegrityError:
+        # the dialect has no ON CONFLICT, the unique index refused the second rating
+        await db.rollback()
+        return None
+    if new_rating is None:
+        return None
+    await db.execute(count_rating(photo_id, rating))
+    # the insert is not flushed, so the search cache does not see it
+    record_search_changes(db, photo_ids=[photo_id])
+    record_rating(db, photo_id, rating, new_rating.created_at)
     await db.commit()
-    await db.refresh(rating)
-    return rating
+    await db.refresh(new_rating)
+    return new_rating
 
 
 async def get_user_rating_for_photo(photo_id: int,
@@ -60,7 +102,15 @@ async def get_user_rating_for_photo(photo_id: int,
 async def get_avg_rating(photo_id: int,
                          db: AsyncSession = Depends(get_db),
                          ):
-    stmt = select(func.avg(Rating.rating)).filter_by(photo_id=photo_id)
+    """
+    Get average rating of photo
+
+    :param: photo_id: int - id of photo to get average rating
+    :param: db: AsyncSession - database session
+    :return: float - average rating or None if photo not found or not rated
+    """
+
+    stmt = select(Photo.rating_avg).filter_by(id=photo_id)
     rating = await db.execute(stmt)
     return rating.scalar_one_or_none()
 
@@ -92,11 +142,14 @@ async def delete_rating(rating_id: int,
     :return: Rating - deleted rating or None if rating not found and rating not deleted
     """
 
-    stmt = select(Rating).filter_by(id=rating_id)
+    # locked, so a rating deleted twice at once is uncounted once
+    stmt = select(Rating).filter_by(id=rating_id).with_for_update()
     result = await db.execute(stmt)
     rating = result.scalar_one_or_none()
 
     if rating:
         await db.delete(rating)
+        await db.execute(count_rating(rating.photo_id, -rating.rating, -1))
+        record_rating(db, rating.photo_id, rating.rating, rating.created_at, -1)
         await db.commit()
     return rating
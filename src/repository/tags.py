@@ -0,0 +1,36 @@
+"""
+Module with functions to work with tags
+"""
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.models.models import Tag, photo_m2m_tag
+from src.services.tag_dictionary import tag_dictionary
+
+
+async def suggest_tags(prefix: str, limit: int, db: AsyncSession) -> list[dict]:
+    """
+    The suggest_tags function returns the most used tags starting with the prefix.
+    They come from the tag dictionary; the database is queried only while the
+    dictionary is not in use.
+
+    :param prefix: str: Beginning of the tag names
+    :param limit: int: Maximal number of tags
+    :param db: AsyncSession: Pass the database session to the function
+    :return: Names of the tags with the numbers of their photos, the most used first
+    """
+    prefix = prefix.strip().lower()
+    suggestions = tag_dictionary.suggest(prefix, limit)
+    if suggestions is None:
+        used = func.count(photo_m2m_tag.c.tag_id)
+        result = await db.execute(
+            select(Tag.name, used)
+            .outerjoin(photo_m2m_tag, photo_m2m_tag.c.tag_id == Tag.id)
+            .filter(Tag.name.startswith(prefix, autoescape=True))
+            .group_by(Tag.id, Tag.name)
+            .order_by(used.desc(), Tag.name)
+            .limit(limit)
+        )
+        suggestions = result.all()
+    return [{"name": name, "count": count} for name, count in suggestions]
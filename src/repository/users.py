@@ -1,14 +1,71 @@
 import uuid
 
 from fastapi import Depends, HTTPException, status
-from sqlalchemy import select, func
+from sqlalchemy import select, update, func
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql.dml import Update
 from libgravatar import Gravatar
 
 from src.conf import messages
 from src.database.db import get_db
-from src.models.models import Role, User, Photo
+from src.models.models import Comment, Rating, Role, User, Photo
 from src.schemas.user import UserSchema, UserUpdateSchema
+from src.services.pagination import Keyset
+
+
+# the ratings and comments repositories import, through the search cache and
+# src.services.auth, this module, so the aggregates of a deleted user are uncounted here
+def uncount_user_ratings(user_id: uuid.UUID) -> Update:
+    """
+    Update removing the ratings of the user from the aggregates of the photos,
+    to execute before the ratings are deleted with the user.
+
+    :param: user_id: uuid.UUID - id of the user
+    :return: Update - statement to execute in the transaction of the deletion
+    """
+
+    rated = (
+        select(
+            Rating.photo_id,
+            func.sum(Rating.rating).label("rating_sum"),
+            func.count().label("rating_count"),
+        )
+        .filter_by(user_id=user_id)
+        .group_by(Rating.photo_id)
+        .subquery()
+    )
+    return (
+        update(Photo)
+        .where(Photo.id == rated.c.photo_id)
+        .values(
+            rating_sum=Photo.rating_sum - rated.c.rating_sum,
+            rating_count=Photo.rating_count - rated.c.rating_count,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+def uncount_user_comments(user_id: uuid.UUID) -> Update:
+    """
+    Update removing the comments of the user from the numbers of comments of
+    the photos, to execute before the comments are deleted with the user
+
+    :param: user_id: uuid.UUID - id of the user
+    :return: Update - statement to execute in the transaction of the deletion
+    """
+
+    commented = (
+        select(Comment.photo_id, func.count().label("comment_count"))
+        .filter_by(user_id=user_id)
+        .group_by(Comment.photo_id)
+        .subquery()
+    )
+    return (
+        update(Photo)
+        .where(Photo.id == commented.c.photo_id)
+        .values(comment_count=Photo.comment_count - commented.c.comment_count)
+        .execution_options(synchronize_session=False)
+    )
 
 
 async def get_user_by_email(email: str, db: AsyncSession = Depends(get_db)):
@@ -113,19 +170,19 @@ async def update_password(user: User, password: str, db: AsyncSession):
     await db.commit()
 
 
-async def get_all_users(limit: int, offset: int, db: AsyncSession):
+async def get_all_users(limit: int, cursor: str | None, db: AsyncSession) -> dict:
     """
-    The get_all_contacts function returns a list of all contacts in the database.
+    The get_all_users function returns a page of the users, the oldest first.
 
-    :param limit: int: Limit the number of contacts returned
-    :param offset: int: Specify the offset of the first row to return
+    :param limit: int: Limit the number of users returned
+    :param cursor: str | None: Cursor of the previous page, None for the first page
     :param db: AsyncSession: Pass in the database session to use
-    :return: A list of contact objects
+    :return: The users of the page and the cursor of the next page
     :doc-author: Trelent
     """
-    stmt = select(User).offset(offset).limit(limit)
-    users = await db.execute(stmt)
-    return users.scalars().all()
+    keyset = Keyset(User.created_at, User.id)
+    users = await db.execute(keyset.apply(select(User), cursor, limit))
+    return keyset.page(users, limit)
 
 
 async def get_user_by_username(username: str, db: AsyncSession):
@@ -210,6 +267,8 @@ async def delete_user(user_id: uuid.UUID, db: AsyncSession, current_user: User):
     user = await db.execute(stmt)
     user = user.scalar_one_or_none()
     if user.id == current_user.id or current_user.role == Role.admin:
+        await db.execute(uncount_user_ratings(user.id))
+        await db.execute(uncount_user_comments(user.id))
         await db.delete(user)
         await db.commit()
         return user
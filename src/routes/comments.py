@@ -16,6 +16,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from src.database.db import get_db
 from src.models.models import User, Role, Comment
 from src.schemas.comments import CommentSchema, CommentResposeSchema, CommentUpdateSchema
+from src.schemas.pagination import Page
 
 from src.services.auth import auth_service
 from src.services.roles import RoleAccess
@@ -64,25 +65,25 @@ async def create_comment(photo_id: int,
 
 @router.get(
     "/{photo_id}/comments",
-    response_model=List[CommentResposeSchema],
+    response_model=Page[CommentResposeSchema],
     dependencies=[Depends(access_get)],
 )
 async def get_all_comments(limit: int = Query(10, ge=10, le=100),
-                           offset: int = Query(0, ge=0),
+                           cursor: str | None = None,
                            photo_id: int = Path(ge=1),
                            db: AsyncSession = Depends(get_db), ):
     """
-    Function returns a list of comments for the photo with photo_id
+    Function returns a page of comments for the photo with photo_id
 
     :limit: int: Get the limit from the query parameters
-    :offset: int: Get the offset from the query parameters
+    :cursor: str | None: The next_cursor of the previous page
     :param photo_id: int: Get the photo_id from the url
     :param db: Session: Get the database session
-    :return: A list of comments for the photo with photo_id. If the photo with photo_id is not found, an HTTPException is raised.
+    :return: A page of comments for the photo with photo_id. If the photo with photo_id is not found, an HTTPException is raised.
     """
 
-    comments = await repositories_comments.get_all_comment_for_photo(photo_id, db)
-    if not comments:
+    comments = await repositories_comments.get_all_comment_for_photo(photo_id, limit, cursor, db)
+    if not comments["items"]:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=messages.COMMENT_NOT_FOUND)
     return comments
 
@@ -8,6 +8,8 @@ from fastapi import (
     HTTPException,
     Depends,
     Query,
+    Request,
+    Response,
     status,
     UploadFile,
     File,
@@ -18,16 +20,47 @@ from fastapi_limiter.depends import RateLimiter
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from src.schemas.photos import PhotosResponse
+from src.schemas.photos import (
+    BulkUploadResponse,
+    PhotosResponse,
+    SearchCacheMetrics,
+    TopPhotoResponse,
+    TransformJobResponse,
+    UploadSessionResponse,
+)
 from src.database.db import get_db
 from src.models.models import User, Photo
+from src.schemas.pagination import Page
 from src.schemas.user import UserResponse
 from src.services.auth import auth_service
+from src.services.uploads import read_image
+from src.services.chunked_uploads import upload_sessions
+from src.services.search_cache import search_cache, words
+from src.services.jobs import transform_jobs
 from src.conf.config import config
 from src.repository import users as repositories_users
 from src.repository import photos as repositories_photos
-from src.conf.messages import NO_PHOTO_BY_ID, PHOTO_SUCCESSFULLY_DELETED
-from src.conf.constants import CropMode, EffectMode, Effect
+from src.conf.messages import (
+    NO_PHOTO_BY_ID,
+    PHOTO_SUCCESSFULLY_DELETED,
+    PHOTO_NOT_FOUND,
+    JOB_NOT_FOUND,
+    TOO_MANY_FILES,
+    DESCRIPTION_TOO_LONG,
+)
+from src.conf.constants import (
+    BULK_UPLOAD_MAX_FILES,
+    PHOTO_MAX_DESCRIPTION_LENGTH,
+    CropMode,
+    EffectMode,
+    Effect,
+    LEADERBOARD_MAX_SIZE,
+    LeaderboardWindow,
+    PhotoSort,
+    QrFormat,
+    SortOrder,
+    TAG_QUERY_MAX_LENGTH,
+)
 from src.routes.ratings import access_delete
 
 
@@ -36,36 +69,66 @@ router = APIRouter(prefix="/photos", tags=["photos"])
 
 @router.get(
     "/",
+    response_model=Page[PhotosResponse],
     status_code=status.HTTP_200_OK,
     dependencies=[Depends(RateLimiter(times=5, seconds=20))],
 )
 async def get_all_photos(
-    skip_photos: int = 0,
-    photos_per_page: int = 10,
+    cursor: str | None = None,
+    photos_per_page: int = Query(10, ge=1, le=500),
+    sort: PhotoSort = PhotoSort.created_at,
+    order: SortOrder = SortOrder.asc,
     user: User = Depends(auth_service.get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     """
-    The get_all_photos function returns a list of all photos in the database.
-        The function takes three arguments: skip_photos, photos_per_page and user.
-        The skip_photos argument is an integer that specifies how many photos to skip before returning results.
-        The default value for this argument is 0, which means no skipping will occur and the first photo will be returned.
+    The get_all_photos function returns a page of the photos in the database.
+        The function takes three arguments: cursor, photos_per_page and user.
+        The cursor argument is the next_cursor of the previous page; without it the first page is returned.
+        The photos are sorted by sort (created_at, rating or comments) in the order (asc or desc).
 
     The photos_per_page argument is an integer that specifies how many results to return per page (i.e., per request).
     The default value for this argument is 10, which means 10 results will be
 
-    :param skip_photos: int: Skip the first n photos
+    :param cursor: str | None: Cursor of the previous page
     :param photos_per_page: int: Specify how many photos will be displayed on one page
+    :param sort: PhotoSort: Sort by the creation time, the average rating or the number of comments
+    :param order: SortOrder: Ascending or descending
     :param user: User: Get the current user from the database
     :param db: AsyncSession: Get a database connection
-    :return: A list of photos
+    :return: The photos and the cursor of the next page
     """
     all_photos = await repositories_photos.get_all_photos(
-        skip_photos, photos_per_page, db
+        cursor, photos_per_page, db, sort, order
     )
     return all_photos
 
 
+@router.get(
+    "/top",
+    response_model=List[TopPhotoResponse],
+    dependencies=[Depends(RateLimiter(times=5, seconds=20))],
+)
+async def get_top_photos(
+    window: LeaderboardWindow = LeaderboardWindow.all,
+    limit: int = Query(10, ge=1, le=LEADERBOARD_MAX_SIZE),
+    user: User = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The get_top_photos function returns the best rated photos.
+        The photos are ranked by the average of their ratings made in the window
+        (the current day, week or all time), weighted so that a few ratings count less.
+
+    :param window: LeaderboardWindow: day, week or all
+    :param limit: int: Specify how many photos to return
+    :param user: User: Get the current user from the database
+    :param db: AsyncSession: Get a database connection
+    :return: The photos with their scores, the best first
+    """
+    return await repositories_photos.get_top_photos(window, limit, db)
+
+
 @router.post(
     "/",
     status_code=status.HTTP_201_CREATED,
@@ -74,7 +137,9 @@ async def get_all_photos(
 )
 async def post_photo(
     photo_description: str | None = Form(
-        None, description="Add a description to your photo (string)"
+        None,
+        description="Add a description to your photo (string)",
+        max_length=PHOTO_MAX_DESCRIPTION_LENGTH,
     ),
     file: UploadFile = File(),
     tags: list[str] = Form(
@@ -97,28 +162,186 @@ async def post_photo(
     :return: A new_photo object
     """
     list_tags = tags[0].split(",")
+    image = await read_image(file)
 
     new_photo = await repositories_photos.create_photo(
-        file,
+        image,
         photo_description,
         user,
         db,
         list_tags,
     )
-    extention = file.filename.split(".")[-1]
-    size = file.size / 1024 / 1024
-    if size > 5:
-        raise HTTPException(
-            status_code=400, detail="Wrong file size (it need less than 5 Mb)!"
-        )
-    if extention not in ["jpg", "jpeg", "bmp", "gif", "png", "raw", "tiff", "psd"]:
-        raise HTTPException(
-            status_code=400, detail="Wrong file type (only pictures needed)!"
-        )
 
     return new_photo
 
 
+@router.post(
+    "/bulk/",
+    response_model=BulkUploadResponse,
+    status_code=status.HTTP_201_CREATED,
+    description="No more than 1 request per 20 second",
+    dependencies=[Depends(RateLimiter(times=1, seconds=20))],
+)
+async def post_photos(
+    files: list[UploadFile] = File(
+        description=f"Photos to add (no more than {BULK_UPLOAD_MAX_FILES})"
+    ),
+    descriptions: list[str] = Form(
+        None, description="One description per file, in the order of the files"
+    ),
+    tags: list[str] = Form(
+        None, description="One string of tags separated by ',' per file"
+    ),
+    user: User = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The post_photos function adds several photos in one request.
+        Every file is checked on its own, the valid ones are uploaded concurrently
+        and saved in one transaction. The answer has a result for every file.
+        The files are only hashed here, their contents are read again for the upload.
+
+    :param files: list[UploadFile]: The photos
+    :param descriptions: list[str]: Descriptions of the photos by the index of the file
+    :param tags: list[str]: Tags of the photos separated by ',' by the index of the file
+    :param user: User: Get the current user from the database
+    :param db: AsyncSession: Pass the database session to the repository function
+    :return: The number of created and failed photos and the result of every file
+    """
+    if len(files) > BULK_UPLOAD_MAX_FILES:
+        raise HTTPException(status_code=400, detail=TOO_MANY_FILES)
+    descriptions = descriptions or []
+    tags = tags or []
+
+    items = []
+    for index, file in enumerate(files):
+        item = {
+            "filename": file.filename,
+            "description": descriptions[index] if index < len(descriptions) else "",
+            "tags": tags[index].split(",") if index < len(tags) else [],
+            "image": None,
+            "error": None,
+        }
+        if len(item["description"]) > PHOTO_MAX_DESCRIPTION_LENGTH:
+            item["error"] = DESCRIPTION_TOO_LONG
+            items.append(item)
+            continue
+        try:
+            item["image"] = await read_image(file, keep=False)
+        except HTTPException as e:
+            item["error"] = e.detail
+        items.append(item)
+
+    results = await repositories_photos.create_photos(items, user, db)
+    created = sum(1 for result in results if result["photo_id"] is not None)
+    return {
+        "created": created,
+        "failed": len(results) - created,
+        "results": results,
+    }
+
+
+@router.post(
+    "/uploads/",
+    response_model=UploadSessionResponse,
+    status_code=status.HTTP_201_CREATED,
+    description="No more than 1 request per 20 second",
+    dependencies=[Depends(RateLimiter(times=1, seconds=20))],
+)
+async def start_upload(
+    filename: str = Form(description="Name of the file"),
+    size: int = Form(description="Size of the file in bytes"),
+    photo_description: str | None = Form(
+        None,
+        description="Add a description to your photo (string)",
+        max_length=PHOTO_MAX_DESCRIPTION_LENGTH,
+    ),
+    tags: str | None = Form(None, description="Tags of the photo separated by ','"),
+    user: User = Depends(auth_service.get_current_user),
+):
+    """
+    The start_upload function opens a chunked upload of a large photo.
+        The file is then sent in chunks of chunk_size bytes with PUT /photos/uploads/{upload_id}
+        and saved with POST /photos/uploads/{upload_id}/complete.
+
+    :param filename: str: Name of the file
+    :param size: int: Size of the file in bytes
+    :param photo_description: str | None: Describe the photo
+    :param tags: str | None: Tags of the photo separated by ','
+    :param user: User: Get the current user from the database
+    :return: The state of the upload session
+    """
+    list_tags = repositories_photos.normalize_tags((tags or "").split(","))
+    repositories_photos.check_tags_quantity(list_tags)
+    return upload_sessions.create(user.id, filename, size, photo_description, list_tags)
+
+
+@router.get("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def get_upload(
+    upload_id: str,
+    user: User = Depends(auth_service.get_current_user),
+):
+    """
+    The get_upload function returns the received and the missing chunks of an upload,
+        after a dropped connection only the missing chunks have to be sent again.
+
+    :param upload_id: str: Id of the upload session
+    :param user: User: Get the current user from the database
+    :return: The state of the upload session
+    """
+    meta = upload_sessions.get(upload_id, user.id)
+    return upload_sessions.status(upload_id, meta)
+
+
+@router.put("/uploads/{upload_id}", response_model=UploadSessionResponse)
+async def put_upload_chunk(
+    request: Request,
+    upload_id: str,
+    offset: int = Query(ge=0, description="Position of the chunk in the file"),
+    user: User = Depends(auth_service.get_current_user),
+):
+    """
+    The put_upload_chunk function receives one chunk of an upload in the request body.
+        The body is streamed to the staging file, it is never held in memory as a whole.
+
+    :param request: Request: The body of the request is the chunk
+    :param upload_id: str: Id of the upload session
+    :param offset: int: Position of the chunk in the file
+    :param user: User: Get the current user from the database
+    :return: The state of the upload session
+    """
+    return await upload_sessions.write_chunk(
+        upload_id, user.id, offset, request.stream()
+    )
+
+
+@router.post("/uploads/{upload_id}/complete", status_code=status.HTTP_201_CREATED)
+async def complete_upload(
+    upload_id: str,
+    user: User = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The complete_upload function saves the photo when all chunks were received.
+
+    :param upload_id: str: Id of the upload session
+    :param user: User: Get the current user from the database
+    :param db: AsyncSession: Pass the database session to the repository function
+    :return: A dictionary with success message
+    """
+    upload = await upload_sessions.complete(upload_id, user.id)
+    new_photo = await repositories_photos.create_photo_from_file(
+        upload["path"],
+        upload["content_hash"],
+        upload["description"],
+        user,
+        db,
+        upload["tags"],
+    )
+    upload_sessions.discard(upload_id)
+    return new_photo
+
+
 @router.get(
     "/{photo_id}",
     name="get_photo",
@@ -212,12 +435,41 @@ async def edit_photo_record(
     raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=NO_PHOTO_BY_ID)
 
 
+async def submit_transform_job(
+    kind: str, photo_id: int, task, request: Request, response: Response, db: AsyncSession
+) -> dict:
+    """
+    The submit_transform_job function checks that the photo exists and puts
+    the transformation in the background queue.
+
+    :param kind: str: Name of the job type
+    :param photo_id: int: Photo to transform
+    :param task: Coroutine function called by the worker with its own database session
+    :param request: Request: Build the url of the job status
+    :param response: Response: Set the Location header
+    :param db: AsyncSession: Get the database connection
+    :return: The job description
+    """
+    photo = await repositories_photos.get_photo_by_id(photo_id, db)
+    if photo is None:
+        raise HTTPException(status_code=400, detail=PHOTO_NOT_FOUND)
+
+    job = transform_jobs.submit(kind, task)
+    response.headers["Location"] = str(
+        request.url_for("get_transform_job", job_id=job.id)
+    )
+    return job.to_dict()
+
+
 @router.post(
     "/{photo_id}/changes/",
-    status_code=status.HTTP_201_CREATED,
+    response_model=TransformJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
     dependencies=[Depends(RateLimiter(times=1, seconds=20))],
 )
 async def change_photo(
+    request: Request,
+    response: Response,
     photo_id: int,
     width: int | None,
     height: int | None,
@@ -225,12 +477,14 @@ async def change_photo(
         None, description="The cropping mode: fill, thumb, fit, limit, pad, scale"
     ),
     effect: Effect = Form(None, description="The art effects"),
+    qr_format: QrFormat = Form(QrFormat.png, description="The QR code format: png or svg"),
     user: User = Depends(auth_service.get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     """
-    The change_photo function changes the photo.
+    The change_photo function queues a transformation of the photo and answers 202 at once.
         round, high, width, face, cartoonify, vignette, borders
+        The result is available at GET /photos/jobs/{job_id}.
 
     :param photo_id: int: Identify the photo to be changed
     :param width: int | None: Set the width of the image
@@ -243,10 +497,11 @@ async def change_photo(
     :param pad: Add padding to the image
     :param scale: Scale the image
     :param effect: Effect: Apply the effect to the photo
+    :param qr_format: QrFormat: Format of the QR code: png or svg
     :param description: Describe the endpoint
     :param user: User: Get the user who is making the request
     :param db: AsyncSession: Get the database connection
-    :return: A dictionary with the following keys: 'transformed_url', 'QR code'
+    :return: The queued job; its result has the keys 'transformed_url', 'QR code'
     :doc-author: Trelent
     """
     if crop_mode is not None:
@@ -258,29 +513,37 @@ async def change_photo(
     else:
         effect = None
 
-    url_QR = await repositories_photos.change_photo(
-        user,
-        photo_id,
-        db,
-        width,
-        height,
-        crop_mode,
-        effect,
-    )
+    async def task(session: AsyncSession) -> dict:
+        return await repositories_photos.change_photo(
+            user,
+            photo_id,
+            session,
+            width,
+            height,
+            crop_mode,
+            effect,
+            qr_format,
+        )
 
-    return url_QR
+    return await submit_transform_job(
+        "change_photo", photo_id, task, request, response, db
+    )
 
 
 @router.post(
     "/{photo_id}/avatar/",
-    status_code=status.HTTP_201_CREATED,
+    response_model=TransformJobResponse,
+    status_code=status.HTTP_202_ACCEPTED,
     dependencies=[Depends(RateLimiter(times=1, seconds=20))],
 )
 async def make_avatar(
+    request: Request,
+    response: Response,
     photo_id: int,
     effect_mode: EffectMode = Form(
         None, description="The cropping mode: fill, thumb, fit, limit, pad, scale"
     ),
+    qr_format: QrFormat = Form(QrFormat.png, description="The QR code format: png or svg"),
     user: User = Depends(auth_service.get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
@@ -288,6 +551,7 @@ async def make_avatar(
     The make_avatar function is used to create a QR code from the photo_id.
         The effect_mode parameter can be used to specify how the image should be cropped.
         If no effect mode is specified, then it will default to None.
+        The avatar is made in the background, the result is available at GET /photos/jobs/{job_id}.
 
     :param photo_id: int: Get the photo_id from the request
     :param effect_mode: EffectMode: Set the cropping mode of the avatar
@@ -297,9 +561,10 @@ async def make_avatar(
     :param limit: Limit the number of photos returned
     :param pad: Add padding to the image
     :param scale: Resi the image
+    :param qr_format: QrFormat: Format of the QR code: png or svg
     :param user: User: Get the user from the database
     :param db: AsyncSession: Pass the database session to the repository
-    :return: A url
+    :return: The queued job; its result has the keys 'avatar', 'QR code'
     :doc-author: Trelent
     """
     if effect_mode is not None:
@@ -307,14 +572,41 @@ async def make_avatar(
     else:
         effect_mode = None
 
-    url_QR = await repositories_photos.make_avatar_from_photo(
-        user,
-        photo_id,
-        effect_mode,
-        db,
+    async def task(session: AsyncSession) -> dict:
+        return await repositories_photos.make_avatar_from_photo(
+            user,
+            photo_id,
+            effect_mode,
+            session,
+            qr_format,
+        )
+
+    return await submit_transform_job(
+        "make_avatar", photo_id, task, request, response, db
     )
 
-    return url_QR
+
+@router.get(
+    "/jobs/{job_id}",
+    name="get_transform_job",
+    response_model=TransformJobResponse,
+)
+async def get_transform_job(
+    job_id: str,
+    user: User = Depends(auth_service.get_current_user),
+):
+    """
+    The get_transform_job function returns the state of a transformation job.
+        queued, running, done (with the result) or failed (with the error).
+
+    :param job_id: str: Id returned by /changes/ or /avatar/
+    :param user: User: Get the current user
+    :return: The job description
+    """
+    job = transform_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=JOB_NOT_FOUND)
+    return job.to_dict()
 
 
 @router.post(
@@ -329,6 +621,7 @@ async def add_tag(
 ):
     """
     The add_tag function adds a tag to the photo with the given id.
+        Several tags can be given separated by commas.
         If there is no such tag, it will be created.
         If there is already such a tag under this photo, an error message will be displayed.
 
@@ -336,7 +629,7 @@ async def add_tag(
     :param tag: str: Specify the tag that will be added to the photo
     :param user: User: Get the current user
     :param db: AsyncSession: Get the database session
-    :return: A tag, which is added to the photo
+    :return: The tags which were added, were present already or were over the limit
     """
     tag = await repositories_photos.add_tag_to_photo(photo_id, tag, db)
     return tag
@@ -355,6 +648,7 @@ async def delete_tag(
 ):
     """
     The delete_tag function deletes a tag of the photo_id from the database.
+        Several tags can be given separated by commas.
         Args:
             photo_id (int): The id of the photo to delete a tag from.
             tag (str): The name of the tag to be deleted.
@@ -375,45 +669,115 @@ async def delete_tag(
 
 @router.get(
     "/search/",
-    response_model=list[PhotosResponse],
+    response_model=Page[PhotosResponse],
     dependencies=[Depends(RateLimiter(times=1, seconds=20))],
 )
 async def search_photo(
     photos_per_page: int = Query(10, ge=10, le=500),
-    skip_photos: int = Query(0, ge=0),
+    cursor: str | None = None,
     search_keyword: str = Query(),
     rate_min: float = Query(None, ge=0, le=5),
     rate_max: float = Query(None, ge=0, le=5),
+    fuzzy: bool = False,
+    sort: PhotoSort | None = None,
+    order: SortOrder = SortOrder.desc,
     user: User = Depends(auth_service.get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     """
     The search_photo function searches for photos in the database.
-        The search_photo function takes in a keyword, and returns all photos that contain the keyword.
+        The search_photo function takes in keywords, and returns the photos that match all of them
+        in the description or the tags, the best matches first. "A phrase", or and -word are supported.
+        With fuzzy, the keywords may be misspelled and the most similar photos come first.
+        With sort (created_at, rating or comments), the photos are sorted by it in the order instead.
         If no photo is found with the specified parameters, an HTTP 204 No Content error is raised.
 
     :param photos_per_page: int: Specify how many photos should be returned per page
     :param ge: Specify the minimum value of a parameter
     :param le: Specify the maximum value of a parameter
-    :param skip_photos: int: Skip the first n photos in the database
+    :param cursor: str | None: The next_cursor of the previous page
     :param search_keyword: str: Search for photos with the specified keyword
     :param rate_min: float: Specify the minimum rating of a photo
     :param rate_max: float: Filter photos by the maximum rating
+    :param fuzzy: bool: Tolerate typos in the keywords
+    :param sort: PhotoSort | None: Sort key, None for the best matches first
+    :param order: SortOrder: Ascending or descending by the sort key
     :param user: User: Get the user from the database
     :param db: AsyncSession: Get the database session
-    :return: A list of photos
+    :return: The photos and the cursor of the next page
     """
-    if rate_min is None and rate_max is None:
-        photos = await repositories_photos.search_photos(
-            search_keyword, photos_per_page, skip_photos, db, user
-        )
-    else:
-        photos = await repositories_photos.search_photos_by_filter(
-            search_keyword, rate_min, rate_max, photos_per_page, skip_photos, db, user
+    started = time.perf_counter()
+    key = search_cache.key(
+        search_keyword, rate_min, rate_max, photos_per_page, cursor, fuzzy, sort, order
+    )
+    photos = search_cache.get(key)
+    hit = photos is not None
+    if not hit:
+        if rate_min is None and rate_max is None:
+            page = await repositories_photos.search_photos(
+                search_keyword, photos_per_page, cursor, db, user, fuzzy, sort, order
+            )
+        else:
+            page = await repositories_photos.search_photos_by_filter(
+                search_keyword, rate_min, rate_max, photos_per_page, cursor, db, user, fuzzy,
+                sort, order,
+            )
+        photos = Page[PhotosResponse].model_validate(page).model_dump(mode="json")
+        search_cache.set(
+            key,
+            photos,
+            photo_ids=[photo["id"] for photo in photos["items"]],
+            tag_ids=await search_cache.tag_ids(search_keyword, db),
+            words=words(search_keyword),
         )
-    if photos == []:
+    search_cache.observe(hit, time.perf_counter() - started)
+    if photos["items"] == []:
         raise HTTPException(
             status_code=status.HTTP_204_NO_CONTENT,
             detail="Photo with the specified search parameters was not found",
         )
     return photos
+
+
+@router.get(
+    "/search/metrics",
+    response_model=SearchCacheMetrics,
+    dependencies=[Depends(access_delete)],
+)
+async def search_metrics():
+    """
+    The search_metrics function returns the counters of the search result cache
+    in this process: hits, misses, hit ratio, mean latency of the hits and the
+    misses in milliseconds, and the number of entries deleted by invalidation.
+
+    :return: The counters of the cache
+    """
+    return search_cache.metrics()
+
+
+@router.get(
+    "/search/tags/",
+    response_model=Page[PhotosResponse],
+    dependencies=[Depends(RateLimiter(times=5, seconds=20))],
+)
+async def search_photos_by_tags(
+    tags: str = Query(min_length=1, max_length=TAG_QUERY_MAX_LENGTH),
+    photos_per_page: int = Query(10, ge=1, le=500),
+    cursor: str | None = None,
+    user: User = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The search_photos_by_tags function searches for photos by a boolean query of their tags.
+        Tag names are joined with AND, OR and NOT, and grouped with parentheses;
+        adjacent names mean AND and a name with spaces is quoted, e.g.
+        sunset AND beach NOT night or (sea OR ocean) "new york".
+
+    :param tags: str: The query of tags
+    :param photos_per_page: int: Specify how many photos should be returned per page
+    :param cursor: str | None: The next_cursor of the previous page
+    :param user: User: Get the user from the database
+    :param db: AsyncSession: Get the database session
+    :return: The photos and the cursor of the next page
+    """
+    return await repositories_photos.search_photos_by_tags(tags, photos_per_page, cursor, db)
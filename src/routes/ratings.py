@@ -43,6 +43,8 @@ async def create_rating(photo_id: int,
     # print(f'{rate=}')
     """
     Function creates a rating for a photo with photo_id.
+    The rating is created by one statement; only when it creates nothing the photo
+    is read to tell why.
     If photo with photo_id does not exist, function raises HTTPException.
     If user already set rating for photo, function raises HTTPException.
 
@@ -57,6 +59,10 @@ async def create_rating(photo_id: int,
     :raises HTTPException: If user is not authorized to access the operation.
     """
 
+    new_rating = await repositories_ratings.create_rating(rate, photo_id, user.id, db)
+    if new_rating is not None:
+        return new_rating
+
     photo_exists: Photo | None = await repositories_photos.get_photo_by_id(photo_id, db)
 
     if photo_exists is None:
@@ -68,15 +74,10 @@ async def create_rating(photo_id: int,
             detail=messages.RATING_OWN_PHOTO,
         )
 
-    is_rating = await repositories_ratings.get_user_rating_for_photo(photo_id, user.id, db)
-    if is_rating:
-        raise HTTPException(
-            status_code=status.HTTP_423_LOCKED,
-            detail=messages.RATING_ALREADY_SET,
-        )
-
-    new_rating = await repositories_ratings.create_rating(rate, photo_id, user.id, db)
-    return new_rating
+    raise HTTPException(
+        status_code=status.HTTP_423_LOCKED,
+        detail=messages.RATING_ALREADY_SET,
+    )
 
 
 @router.get(
@@ -0,0 +1,38 @@
+"""
+Tag API Routes
+Provides API routes for discovering tags
+"""
+
+from typing import List
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.constants import TAG_MAX_LENGTH, TAG_SUGGEST_LIMIT, TAG_SUGGEST_MAX_LIMIT
+from src.database.db import get_db
+from src.models.models import User
+from src.repository import tags as repositories_tags
+from src.schemas.tags import TagSuggestion
+from src.services.auth import auth_service
+
+router = APIRouter(prefix="/tags", tags=["tags"])
+
+
+@router.get("/suggest", response_model=List[TagSuggestion])
+async def suggest_tags(
+    prefix: str = Query("", max_length=TAG_MAX_LENGTH),
+    limit: int = Query(TAG_SUGGEST_LIMIT, ge=1, le=TAG_SUGGEST_MAX_LIMIT),
+    user: User = Depends(auth_service.get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    The suggest_tags function completes a tag name: it returns the most used
+    tags starting with the prefix.
+
+    :param prefix: str: Beginning of the tag name
+    :param limit: int: Maximal number of tags
+    :param user: User: Get the current user
+    :param db: AsyncSession: Get the database session
+    :return: Names of the tags with the numbers of their photos
+    """
+    return await repositories_tags.suggest_tags(prefix, limit, db)
@@ -1,21 +1,22 @@
 import pickle
 import uuid
 
-import cloudinary
-import cloudinary.uploader
 from fastapi import APIRouter, HTTPException, Depends, Query, status, UploadFile, File, Path
 from fastapi_limiter.depends import RateLimiter
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.db import get_db
 from src.models.models import User, Role
+from src.schemas.pagination import Page
 from src.schemas.user import UserChangeRoleResponse, UserChangeRole, UserResponse, AboutUser, UserUpdateSchema, UserResponseAvatar
 from src.services.auth import auth_service
 from src.conf import messages
 from src.conf.config import config
 from src.services.roles import RoleAccess
 from src.repository import users as repositories_users
-from src.repository.photos import init_cloudinary
+from src.services.rendering import rendering
+from src.services.storage import storage
+from src.services.uploads import read_image
 
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -24,30 +25,30 @@ access_to_route_all = RoleAccess([Role.admin, Role.moderator])
 
 
 @router.get(
-    "/", response_model=list[UserResponse], dependencies=[Depends(access_to_route_all)]
+    "/", response_model=Page[UserResponse], dependencies=[Depends(access_to_route_all)]
 )
 async def get_all_users(
     limit: int = Query(10, ge=10, le=500),
-    offset: int = Query(0, ge=0),
+    cursor: str | None = None,
     db: AsyncSession = Depends(get_db),
     user: User = Depends(auth_service.get_current_user),
 ):
    
     """
-    The get_all_users function returns a list of all users in the database.
-        The limit and offset parameters are used to paginate the results.
+    The get_all_users function returns a page of the users in the database.
+        The limit and cursor parameters are used to paginate the results.
         
     
     :param limit: int: Limit the number of users returned
     :param ge: Set a minimum value for the limit parameter
     :param le: Set the maximum value of the limit parameter
-    :param offset: int: Specify the number of records to skip
+    :param cursor: str | None: The next_cursor of the previous page
     :param db: AsyncSession: Pass the database connection to the function
     :param user: User: Get the current user
-    :return: A list of users
+    :return: The users and the cursor of the next page
     :doc-author: Trelent
     """
-    users = await repositories_users.get_all_users(limit, offset, db)
+    users = await repositories_users.get_all_users(limit, cursor, db)
     return users
 
 @router.patch(
@@ -62,8 +63,8 @@ async def update_avatar_url(
 ):
     """
     The update_avatar_url function takes a file and user as input,
-        uploads the file to cloudinary, updates the avatar_url in the database
-        and returns a UserResponse object.
+        renders a 250x250 avatar from it, uploads only the avatar, updates the avatar_url
+        in the database and returns a UserResponse object.
 
     :param file: UploadFile: Upload the file to cloudinary
     :param user: User: Get the current user
@@ -71,12 +72,11 @@ async def update_avatar_url(
     :return: The user object with the updated avatar_url
     :doc-author: Trelent
     """
-    init_cloudinary()
+    image = await read_image(file)
+    avatar = await rendering.thumbnail(image.data, 250, 250, crop="fill")
     public_id = f"Imagine/{user.email}"
-    res = cloudinary.uploader.upload(file.file, public_id=public_id, overwrite=True)
-    res_url = cloudinary.CloudinaryImage(public_id).build_url(
-        width=250, height=250, crop="fill", version=res.get("version")
-    )
+    res = await storage.upload(avatar, public_id=public_id, overwrite=True)
+    res_url = storage.build_url(res["public_id"], version=res.get("version"))
     user = await repositories_users.update_avatar_url(user.email, res_url, db)
     auth_service.cache.set(user.email, pickle.dumps(user))
     auth_service.cache.expire(user.email, 300)
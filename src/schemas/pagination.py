@@ -0,0 +1,11 @@
+from typing import Generic, List, Optional, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    items: List[T]
+    # pass it as the cursor parameter to get the next page, None on the last page
+    next_cursor: Optional[str] = None
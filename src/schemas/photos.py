@@ -4,7 +4,7 @@ from datetime import datetime, date
 from pydantic import BaseModel, EmailStr, Field, ConfigDict, validator
 from typing import Optional, List
 
-from src.conf.constants import RATING_MIN_VALUE, RATING_MAX_VALUE
+from src.conf.constants import RATING_MIN_VALUE, RATING_MAX_VALUE, JobStatus
 from src.conf.messages import RATING_VALUE_INCORRECT
 
 
@@ -42,6 +42,36 @@ class PhotosSchema(BaseModel):
     user_id: uuid.UUID
     updated_at: Optional[datetime] = Field(None)
     
+class TransformJobResponse(BaseModel):
+    job_id: str
+    kind: str
+    status: JobStatus
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class BulkUploadResult(BaseModel):
+    filename: Optional[str]
+    photo_id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class BulkUploadResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkUploadResult]
+
+
+class UploadSessionResponse(BaseModel):
+    upload_id: str
+    size: int
+    chunk_size: int
+    received: List[int]
+    missing: List[int]
+
+
 class PhotosResponse(BaseModel):
     id: int = 1
     path: str
@@ -52,3 +82,17 @@ class PhotosResponse(BaseModel):
     updated_at: Optional[datetime]
     
     model_config = ConfigDict(from_attributes=True)  # noqa
+
+
+class TopPhotoResponse(BaseModel):
+    photo: PhotosResponse
+    score: float
+
+
+class SearchCacheMetrics(BaseModel):
+    hits: int
+    misses: int
+    hit_ratio: Optional[float] = None
+    hit_latency_ms: Optional[float] = None
+    miss_latency_ms: Optional[float] = None
+    invalidated: int
@@ -1 +1,6 @@
-deleted
+from pydantic import BaseModel
+
+
+class TagSuggestion(BaseModel):
+    name: str
+    count: int
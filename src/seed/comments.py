@@ -6,6 +6,7 @@ from sqlalchemy.future import select
 from src.database.db import get_db
 from src.models.models import Photo, User, Comment
 from src.conf.constants import COMMENT_MIN_LENGTH, COMMENT_MAX_LENGTH
+from src.repository.comments import count_comment
 
 import random
 
@@ -48,5 +49,6 @@ async def seed_comments(count: int = 100, db: AsyncSession = Depends(get_db)):
         )
 
         db.add(new_comment)
+        await db.execute(count_comment(new_comment.photo_id))
         await db.commit()
         await db.refresh(new_comment)
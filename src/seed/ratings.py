@@ -4,7 +4,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from src.database.db import get_db
-from src.models.models import Photo, User, Rating
+from src.models.models import Photo, User
+from src.repository.ratings import create_rating
 from src.conf.constants import COMMENT_MIN_LENGTH, COMMENT_MAX_LENGTH
 
 import random
@@ -38,12 +39,10 @@ async def seed_ratings(db: AsyncSession = Depends(get_db)):
     count = len(users_id) * len(photos_id) // 2
     # print(f"+++++++++++ {count = }")
     for _ in range(count):
-        new_rating = Rating(
-            rating=random.randint(1, 5),
-            user_id=users_id[random.randint(0, len(users_id) - 1)],
-            photo_id=photos_id[random.randint(0, len(photos_id) - 1)],
+        # the repeated and the own photo ratings are skipped
+        await create_rating(
+            random.randint(1, 5),
+            photos_id[random.randint(0, len(photos_id) - 1)],
+            users_id[random.randint(0, len(users_id) - 1)],
+            db,
         )
-
-        db.add(new_rating)
-        await db.commit()
-        await db.refresh(new_rating)
@@ -0,0 +1,191 @@
+"""
+Sets of photo ids for the boolean tag queries, chunked the way roaring
+bitmaps are.
+
+An id is split into its high and low 16 bits, and a chunk holds the low bits
+of the ids with the same high bits. A chunk of at most SPARSE_MAX ids is a
+sorted array of them, 2 bytes per id; a fuller one is an int with the bit of
+every id, 8 KB. So a set takes memory by the number of its ids, not by the
+largest id: a tag of a few photos is a few bytes however many photos there
+are. The operations go chunk by chunk over the chunks of the operands, on two
+int chunks they run in C over machine words.
+"""
+
+from array import array
+from bisect import bisect_right
+
+CHUNK_BITS = 16
+LOW_MASK = (1 << CHUNK_BITS) - 1
+# a chunk with more ids is an int, at this size both take 8 KB
+SPARSE_MAX = 4096
+
+
+def _bits(lows) -> int:
+    data = bytearray((LOW_MASK + 1) // 8)
+    for low in lows:
+        data[low >> 3] |= 1 << (low & 7)
+    return int.from_bytes(data, "little")
+
+
+def _lows(bits: int) -> array:
+    lows = array("H")
+    for index, byte in enumerate(bits.to_bytes((LOW_MASK + 1) // 8, "little")):
+        while byte:
+            lowest = byte & -byte
+            lows.append(index * 8 + lowest.bit_length() - 1)
+            byte ^= lowest
+    return lows
+
+
+def _pack(chunk):
+    """
+    The _pack function returns the chunk in its smaller form, or None if it is empty.
+    """
+    if isinstance(chunk, int):
+        if chunk.bit_count() > SPARSE_MAX:
+            return chunk
+        chunk = _lows(chunk)
+    elif len(chunk) > SPARSE_MAX:
+        return _bits(chunk)
+    return chunk if len(chunk) else None
+
+
+def _and(first, second):
+    if isinstance(first, int) and isinstance(second, int):
+        return _pack(first & second)
+    if isinstance(first, int):
+        first, second = second, first
+    if isinstance(second, int):
+        return _pack(array("H", (low for low in first if second >> low & 1)))
+    other = set(second)
+    return _pack(array("H", (low for low in first if low in other)))
+
+
+def _or(first, second):
+    if isinstance(first, int) or isinstance(second, int):
+        first = first if isinstance(first, int) else _bits(first)
+        second = second if isinstance(second, int) else _bits(second)
+        return first | second
+    return _pack(array("H", sorted(set(first) | set(second))))
+
+
+def _sub(first, second):
+    if isinstance(first, int):
+        second = second if isinstance(second, int) else _bits(second)
+        return _pack(first & ~second)
+    if isinstance(second, int):
+        return _pack(array("H", (low for low in first if not second >> low & 1)))
+    other = set(second)
+    return _pack(array("H", (low for low in first if low not in other)))
+
+
+class Bitset:
+    __slots__ = ("_chunks",)
+
+    def __init__(self, ids=()):
+        self._chunks: dict[int, array | int] = {}
+        grouped: dict[int, set[int]] = {}
+        for photo_id in ids:
+            grouped.setdefault(photo_id >> CHUNK_BITS, set()).add(photo_id & LOW_MASK)
+        for high, lows in grouped.items():
+            self._chunks[high] = _pack(array("H", sorted(lows)))
+
+    @classmethod
+    def _of(cls, chunks: dict) -> "Bitset":
+        bits = cls()
+        bits._chunks = {high: chunk for high, chunk in chunks.items() if chunk is not None}
+        return bits
+
+    def __and__(self, other: "Bitset") -> "Bitset":
+        return self._of(
+            {
+                high: _and(chunk, other._chunks[high])
+                for high, chunk in self._chunks.items()
+                if high in other._chunks
+            }
+        )
+
+    def __or__(self, other: "Bitset") -> "Bitset":
+        chunks = dict(self._chunks)
+        for high, chunk in other._chunks.items():
+            chunks[high] = _or(chunks[high], chunk) if high in chunks else chunk
+        return self._of(chunks)
+
+    def __sub__(self, other: "Bitset") -> "Bitset":
+        return self._of(
+            {
+                high: _sub(chunk, other._chunks[high]) if high in other._chunks else chunk
+                for high, chunk in self._chunks.items()
+            }
+        )
+
+    def __contains__(self, photo_id: int) -> bool:
+        chunk = self._chunks.get(photo_id >> CHUNK_BITS)
+        if chunk is None:
+            return False
+        low = photo_id & LOW_MASK
+        if isinstance(chunk, int):
+            return bool(chunk >> low & 1)
+        index = bisect_right(chunk, low)
+        return index > 0 and chunk[index - 1] == low
+
+    def __iter__(self):
+        return iter(self.first(None, len(self)))
+
+    def __len__(self) -> int:
+        return sum(
+            chunk.bit_count() if isinstance(chunk, int) else len(chunk)
+            for chunk in self._chunks.values()
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self._chunks)
+
+    def add(self, photo_id: int):
+        high, low = photo_id >> CHUNK_BITS, photo_id & LOW_MASK
+        chunk = self._chunks.get(high)
+        if chunk is None:
+            self._chunks[high] = array("H", [low])
+        elif isinstance(chunk, int):
+            self._chunks[high] = chunk | 1 << low
+        elif photo_id not in self:
+            chunk.insert(bisect_right(chunk, low), low)
+            self._chunks[high] = _pack(chunk)
+
+    def discard(self, photo_id: int):
+        high, low = photo_id >> CHUNK_BITS, photo_id & LOW_MASK
+        chunk = self._chunks.get(high)
+        if chunk is None or photo_id not in self:
+            return
+        if isinstance(chunk, int):
+            chunk = _pack(chunk & ~(1 << low))
+        else:
+            del chunk[bisect_right(chunk, low) - 1]
+            chunk = _pack(chunk)
+        if chunk is None:
+            del self._chunks[high]
+        else:
+            self._chunks[high] = chunk
+
+    def first(self, after: int | None, limit: int) -> list[int]:
+        """
+        The first function returns the lowest ids of the set, greater than after.
+        """
+        start = -1 if after is None else after
+        ids = []
+        for high in sorted(high for high in self._chunks if high >= start >> CHUNK_BITS):
+            chunk, base = self._chunks[high], high << CHUNK_BITS
+            # the low bits of this chunk up to skip are not after start
+            skip = start - base
+            if isinstance(chunk, int):
+                bits = chunk >> (skip + 1) << (skip + 1) if skip >= 0 else chunk
+                while bits and len(ids) < limit:
+                    lowest = bits & -bits
+                    ids.append(base + lowest.bit_length() - 1)
+                    bits ^= lowest
+            else:
+                index = bisect_right(chunk, skip) if skip >= 0 else 0
+                ids.extend(base + low for low in chunk[index : index + limit - len(ids)])
+            if len(ids) >= limit:
+                break
+        return ids
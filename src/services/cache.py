@@ -0,0 +1,41 @@
+"""
+Small in-process caches.
+"""
+
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class LRUCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+
+    def get(self, key: Hashable) -> Any | None:
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def discard(self, predicate) -> list[tuple[Hashable, Any]]:
+        """
+        Remove the keys for which predicate(key) is true.
+
+        :return: The removed keys with their values
+        """
+        removed = [(key, value) for key, value in self._items.items() if predicate(key)]
+        for key, _ in removed:
+            del self._items[key]
+        return removed
+
+    def clear(self):
+        self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
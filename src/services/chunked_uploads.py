@@ -0,0 +1,281 @@
+"""
+Chunked, resumable uploads of large photos.
+
+A session is opened with the size of the file; the client then sends the
+chunks in any order with their offsets and completes the session. Every
+chunk is streamed straight to its place in a staging file, so the memory per
+upload stays bounded by the read buffer. The received chunks are tracked in
+Redis, so after a dropped connection the client asks for the missing chunks
+and resends only them. The staging files of abandoned sessions are removed in
+the background once their session expired or they were not written for ttl.
+"""
+
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import AsyncIterator
+
+from fastapi import HTTPException, status
+from redis import RedisError
+from starlette.concurrency import run_in_threadpool
+
+from src.conf import messages
+from src.conf.config import config
+from src.conf.constants import (
+    ALLOWED_PHOTO_EXTENSIONS,
+    CHUNKED_PHOTO_MAX_SIZE,
+    UPLOAD_SESSION_CHUNK_SIZE,
+    UPLOAD_SESSION_TTL,
+)
+from src.services.auth import auth_service
+from src.services.uploads import guess_extension, wrong_size, wrong_type
+
+
+def _text(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class UploadSessions:
+    def __init__(self, root: str, chunk_size: int, ttl: int, interval: float = 600.0):
+        self.root = Path(root)
+        self.chunk_size = chunk_size
+        self.ttl = ttl
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    @property
+    def cache(self):
+        return auth_service.cache
+
+    def _path(self, upload_id: str) -> Path:
+        return self.root / f"{upload_id}.part"
+
+    def _keys(self, upload_id: str) -> tuple[str, str]:
+        return f"upload:{upload_id}", f"upload:{upload_id}:chunks"
+
+    def _touch(self, upload_id: str):
+        for key in self._keys(upload_id):
+            self.cache.expire(key, self.ttl)
+
+    def create(
+        self,
+        user_id: str,
+        filename: str,
+        size: int,
+        description: str | None,
+        tags: list[str],
+    ) -> dict:
+        """
+        The create function opens an upload session and reserves its staging file.
+
+        :param user_id: str: Owner of the session
+        :param filename: str: Name of the file, its extension is checked
+        :param size: int: Size of the whole file in bytes
+        :param description: str | None: Description of the photo
+        :param tags: list[str]: Tags of the photo
+        :return: The state of the session
+        :raises HTTPException: 400 if the file is too big or is not a picture
+        """
+        if size <= 0 or size > CHUNKED_PHOTO_MAX_SIZE:
+            raise wrong_size()
+        if filename.rsplit(".", 1)[-1].lower() not in ALLOWED_PHOTO_EXTENSIONS:
+            raise wrong_type()
+
+        upload_id = uuid.uuid4().hex
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self._path(upload_id), "wb") as staging:
+            staging.truncate(size)
+
+        meta = {
+            "user_id": str(user_id),
+            "filename": filename,
+            "size": size,
+            "chunk_size": self.chunk_size,
+            "description": description or "",
+            "tags": ",".join(tags),
+        }
+        key, _ = self._keys(upload_id)
+        self.cache.hset(key, mapping=meta)
+        self._touch(upload_id)
+        return self.status(upload_id, meta)
+
+    def get(self, upload_id: str, user_id: str) -> dict:
+        """
+        The get function returns the metadata of a session of the user.
+
+        :param upload_id: str: Id of the session
+        :param user_id: str: The current user
+        :return: The metadata of the session
+        :raises HTTPException: 404 if there is no such session of the user
+        """
+        key, _ = self._keys(upload_id)
+        meta = {_text(k): _text(v) for k, v in self.cache.hgetall(key).items()}
+        if not meta or meta["user_id"] != str(user_id):
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail=messages.UPLOAD_NOT_FOUND
+            )
+        meta["size"] = int(meta["size"])
+        meta["chunk_size"] = int(meta["chunk_size"])
+        meta["tags"] = [tag for tag in meta["tags"].split(",") if tag]
+        return meta
+
+    def status(self, upload_id: str, meta: dict) -> dict:
+        _, chunks_key = self._keys(upload_id)
+        received = sorted(int(index) for index in self.cache.smembers(chunks_key))
+        total = -(-int(meta["size"]) // int(meta["chunk_size"]))
+        return {
+            "upload_id": upload_id,
+            "size": int(meta["size"]),
+            "chunk_size": int(meta["chunk_size"]),
+            "received": received,
+            "missing": sorted(set(range(total)) - set(received)),
+        }
+
+    def _write(self, upload_id: str, offset: int, data: bytes):
+        with open(self._path(upload_id), "r+b") as staging:
+            staging.seek(offset)
+            staging.write(data)
+
+    async def write_chunk(
+        self, upload_id: str, user_id: str, offset: int, stream: AsyncIterator[bytes]
+    ) -> dict:
+        """
+        The write_chunk function streams one chunk to its offset in the staging file.
+        A chunk starts on a multiple of chunk_size and has chunk_size bytes, only the
+        last one may be shorter. A chunk is recorded only when all its bytes arrived.
+
+        :param upload_id: str: Id of the session
+        :param user_id: str: The current user
+        :param offset: int: Position of the chunk in the file
+        :param stream: AsyncIterator[bytes]: Body of the request
+        :return: The state of the session
+        :raises HTTPException: 400 if the chunk does not match the session
+        """
+        meta = self.get(upload_id, user_id)
+        size, chunk_size = meta["size"], meta["chunk_size"]
+        if offset % chunk_size or offset >= size:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=messages.WRONG_CHUNK
+            )
+        expected = min(chunk_size, size - offset)
+
+        received = 0
+        async for data in stream:
+            if not data:
+                continue
+            if received + len(data) > expected:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=messages.WRONG_CHUNK,
+                )
+            await run_in_threadpool(self._write, upload_id, offset + received, data)
+            received += len(data)
+        if received != expected:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=messages.WRONG_CHUNK
+            )
+
+        _, chunks_key = self._keys(upload_id)
+        self.cache.sadd(chunks_key, offset // chunk_size)
+        self._touch(upload_id)
+        return self.status(upload_id, meta)
+
+    def _inspect(self, upload_id: str) -> tuple[str, str]:
+        digest = hashlib.sha256()
+        with open(self._path(upload_id), "rb") as staging:
+            head = staging.read(16)
+            digest.update(head)
+            while data := staging.read(1024 * 1024):
+                digest.update(data)
+        return guess_extension(head), digest.hexdigest()
+
+    async def complete(self, upload_id: str, user_id: str) -> dict:
+        """
+        The complete function checks that all chunks arrived and that the file is a picture.
+
+        :param upload_id: str: Id of the session
+        :param user_id: str: The current user
+        :return: The metadata of the session with the path and content_hash of the file
+        :raises HTTPException: 409 if chunks are missing, 400 if the file is not a picture
+        """
+        meta = self.get(upload_id, user_id)
+        state = self.status(upload_id, meta)
+        if state["missing"]:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT, detail=messages.UPLOAD_INCOMPLETE
+            )
+        extension, content_hash = await run_in_threadpool(self._inspect, upload_id)
+        if not extension:
+            self.discard(upload_id)
+            raise wrong_type()
+        meta["path"] = str(self._path(upload_id))
+        meta["content_hash"] = content_hash
+        return meta
+
+    def discard(self, upload_id: str):
+        self.cache.delete(*self._keys(upload_id))
+        try:
+            os.unlink(self._path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def reap(self, grace: float = 60.0) -> int:
+        """
+        The reap function removes the staging files of abandoned sessions: the
+        files not written for longer than the ttl, and the files older than grace
+        whose session is gone from Redis. Without Redis only the age is checked.
+
+        :param grace: float: Seconds a new file may exist before its session is written
+        :return: The number of removed files
+        """
+        if not self.root.is_dir():
+            return 0
+        now = time.time()
+        removed = 0
+        for path in self.root.glob("*.part"):
+            try:
+                age = now - path.stat().st_mtime
+                if age <= grace:
+                    continue
+                if age <= self.ttl:
+                    key, _ = self._keys(path.stem)
+                    try:
+                        if self.cache.exists(key):
+                            continue
+                    except RedisError as e:
+                        print(e)
+                        continue
+                path.unlink()
+            except FileNotFoundError:
+                continue
+            removed += 1
+        return removed
+
+    async def run(self):
+        while True:
+            try:
+                await run_in_threadpool(self.reap)
+            except Exception as e:
+                print(e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+upload_sessions = UploadSessions(
+    config.UPLOAD_STAGING_ROOT,
+    UPLOAD_SESSION_CHUNK_SIZE,
+    UPLOAD_SESSION_TTL,
+    config.UPLOAD_REAPER_INTERVAL,
+)
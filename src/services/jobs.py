@@ -0,0 +1,135 @@
+"""
+Background jobs for photo transformations.
+
+A request only enqueues a job and answers 202 with the job id; a fixed pool
+of worker tasks runs the jobs, each with its own database session, so the
+number of transformations in progress is bounded by the pool size.
+Job states are kept in memory of the process that accepted the job.
+"""
+
+import asyncio
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf import messages
+from src.conf.config import config
+from src.conf.constants import JobStatus
+from src.database.db import sessionmanager
+
+
+class Job:
+    def __init__(self, kind: str, task: Callable[[AsyncSession], Awaitable[dict]]):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.task = task
+        self.status = JobStatus.queued
+        self.result: dict | None = None
+        self.error: str | None = None
+        self.created_at = datetime.now()
+        self.finished_at: datetime | None = None
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers: int, max_size: int, keep_finished: int = 1000):
+        self.workers = workers
+        self.keep_finished = keep_finished
+        self._queue: asyncio.Queue | None = None
+        self._max_size = max_size
+        self._tasks: list[asyncio.Task] = []
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+
+    def start(self):
+        """
+        Start the worker tasks in the running event loop. Safe to call twice.
+        """
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self._max_size)
+        self._tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, kind: str, task: Callable[[AsyncSession], Awaitable[dict]]) -> Job:
+        """
+        The submit function puts a job in the queue and returns at once.
+
+        :param kind: str: Name of the job type
+        :param task: Callable: Coroutine function called with a database session
+        :return: The queued job
+        :raises HTTPException: 503 if the queue is full
+        """
+        self.start()
+        job = Job(kind, task)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=messages.JOB_QUEUE_FULL,
+            )
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def _forget_old(self):
+        finished = [
+            job.id
+            for job in self._jobs.values()
+            if job.status in (JobStatus.done, JobStatus.failed)
+        ]
+        for job_id in finished[: max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    async def _run(self, job: Job):
+        job.status = JobStatus.running
+        async with sessionmanager.session() as db:
+            try:
+                job.result = await job.task(db)
+                job.status = JobStatus.done
+            except HTTPException as e:
+                job.error = e.detail
+                job.status = JobStatus.failed
+            except Exception as e:
+                await db.rollback()
+                print(e)
+                job.error = messages.SOMETHING_WRONG
+                job.status = JobStatus.failed
+        job.finished_at = datetime.now()
+        job.task = None
+        self._forget_old()
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+
+transform_jobs = JobQueue(config.TRANSFORM_WORKERS, config.TRANSFORM_QUEUE_SIZE)
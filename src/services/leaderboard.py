@@ -0,0 +1,234 @@
+"""
+Leaderboards of the best rated photos in Redis sorted sets.
+
+There is a board for the current day, the current week (from Monday) and all
+time. A board is three sorted sets of photos: the sum and the number of their
+ratings made in the window, and the score, an average pulled towards a prior
+by LEADERBOARD_PRIOR_VOTES ratings of LEADERBOARD_PRIOR_MEAN:
+
+    score = (prior votes * prior mean + sum) / (prior votes + count)
+
+so a photo with two 5-star ratings ranks below one with fifty averaging 4.5.
+A created or deleted rating is recorded in the session and added to the
+boards after the commit. The ratings removed with their users and photos,
+and a score overwritten by a concurrent rating of the photo, are corrected
+by the reconciliation which rebuilds the boards from the database every
+LEADERBOARD_INTERVAL seconds.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from redis import RedisError
+from sqlalchemy import Select, desc, event, func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from src.conf.config import config
+from src.conf.constants import (
+    LEADERBOARD_PRIOR_MEAN,
+    LEADERBOARD_PRIOR_VOTES,
+    LeaderboardWindow,
+)
+from src.database.db import sessionmanager
+from src.models.models import Rating
+from src.services.auth import auth_service
+
+CHANGES_KEY = "leaderboard_changes"
+DAY = 24 * 60 * 60
+
+
+def bayesian_score(rating_sum: float, rating_count: float) -> float:
+    return (LEADERBOARD_PRIOR_VOTES * LEADERBOARD_PRIOR_MEAN + rating_sum) / (
+        LEADERBOARD_PRIOR_VOTES + rating_count
+    )
+
+
+def window_start(window: LeaderboardWindow, moment: datetime) -> datetime | None:
+    day = moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == LeaderboardWindow.day:
+        return day
+    if window == LeaderboardWindow.week:
+        return day - timedelta(days=day.weekday())
+    return None
+
+
+def scores(window: LeaderboardWindow, moment: datetime) -> Select:
+    """
+    The scores function selects the sum, the number and the score of the
+    ratings of every photo rated in the window.
+    """
+    rating_sum, rating_count = func.sum(Rating.rating), func.count(Rating.id)
+    stmt = select(
+        Rating.photo_id,
+        rating_sum,
+        rating_count,
+        (
+            (literal(LEADERBOARD_PRIOR_VOTES * LEADERBOARD_PRIOR_MEAN) + rating_sum)
+            / (LEADERBOARD_PRIOR_VOTES + rating_count)
+        ).label("score"),
+    ).group_by(Rating.photo_id)
+    start = window_start(window, moment)
+    if start is not None:
+        stmt = stmt.filter(Rating.created_at >= start)
+    return stmt
+
+
+class Leaderboard:
+    def __init__(self, interval: float, prefix: str = "top"):
+        self.interval = interval
+        self.prefix = prefix
+        self._task: asyncio.Task | None = None
+
+    @property
+    def client(self):
+        return auth_service.cache
+
+    def key(self, window: LeaderboardWindow, moment: datetime) -> str:
+        start = window_start(window, moment)
+        if start is None:
+            return f"{self.prefix}:{window.value}"
+        return f"{self.prefix}:{window.value}:{start:%Y-%m-%d}"
+
+    def ttl(self, window: LeaderboardWindow) -> int | None:
+        # a board outlives its window a little, the next one is built meanwhile
+        return {LeaderboardWindow.day: 2 * DAY, LeaderboardWindow.week: 8 * DAY}.get(window)
+
+    def apply(self, changes) -> None:
+        """
+        The apply function adds rating changes to the boards of the current
+        windows; a rating made in a past window is not on their boards.
+
+        :param changes: Tuples (photo_id, rating, created_at, count), count is 1 or -1
+        """
+        now = datetime.now()
+        updates = []
+        pipe = self.client.pipeline(transaction=False)
+        for photo_id, rating, created_at, count in changes:
+            for window in LeaderboardWindow:
+                key = self.key(window, now)
+                if key != self.key(window, created_at or now):
+                    continue
+                pipe.zincrby(f"{key}:sum", rating * count, photo_id)
+                pipe.zincrby(f"{key}:count", count, photo_id)
+                updates.append((window, key, photo_id))
+        if not updates:
+            return
+        results = pipe.execute()
+
+        pipe = self.client.pipeline(transaction=False)
+        for (window, key, photo_id), rating_sum, rating_count in zip(
+            updates, results[::2], results[1::2]
+        ):
+            if rating_count > 0:
+                pipe.zadd(f"{key}:score", {photo_id: bayesian_score(rating_sum, rating_count)})
+            else:
+                for name in ("sum", "count", "score"):
+                    pipe.zrem(f"{key}:{name}", photo_id)
+            if self.ttl(window):
+                for name in ("sum", "count", "score"):
+                    pipe.expire(f"{key}:{name}", self.ttl(window))
+        pipe.execute()
+
+    async def top(
+        self, window: LeaderboardWindow, limit: int, db: AsyncSession
+    ) -> list[tuple[int, float]]:
+        """
+        The top function returns the best photos of the window from its board,
+        or from the database when Redis is not available.
+
+        :param window: LeaderboardWindow: The window of the board
+        :param limit: int: The number of photos
+        :param db: AsyncSession: The database session for the fallback
+        :return: Ids of the photos with their scores, the best first
+        """
+        key = self.key(window, datetime.now())
+        try:
+            board = self.client.zrevrange(f"{key}:score", 0, limit - 1, withscores=True)
+            return [(int(photo_id), score) for photo_id, score in board]
+        except RedisError as e:
+            print(e)
+        stmt = scores(window, datetime.now()).subquery()
+        result = await db.execute(
+            select(stmt.c.photo_id, stmt.c.score)
+            .order_by(desc(stmt.c.score), stmt.c.photo_id)
+            .limit(limit)
+        )
+        return [(photo_id, score) for photo_id, score in result.all()]
+
+    async def rebuild(self, db: AsyncSession) -> int:
+        """
+        The rebuild function replaces the boards of the current windows with
+        the aggregates of the ratings in the database; a board is replaced in
+        one transaction, so the readers never see it half built.
+
+        :param db: AsyncSession: Pass the database session to the function
+        :return: The number of photos on the boards
+        """
+        now = datetime.now()
+        boards = {}
+        for window in LeaderboardWindow:
+            result = await db.execute(scores(window, now))
+            boards[window] = result.all()
+
+        pipe = self.client.pipeline()
+        for window, rows in boards.items():
+            key = self.key(window, now)
+            names = [f"{key}:{name}" for name in ("sum", "count", "score")]
+            pipe.delete(*names)
+            if not rows:
+                continue
+            for name, column in zip(names, (1, 2, 3)):
+                pipe.zadd(name, {row[0]: float(row[column]) for row in rows})
+                if self.ttl(window):
+                    pipe.expire(name, self.ttl(window))
+        pipe.execute()
+        return sum(len(rows) for rows in boards.values())
+
+    async def run(self):
+        while True:
+            try:
+                async with sessionmanager.session() as db:
+                    await self.rebuild(db)
+            except Exception as e:
+                print(e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+leaderboard = Leaderboard(config.LEADERBOARD_INTERVAL)
+
+
+def record_rating(db: AsyncSession, photo_id: int, rating: int, created_at: datetime | None,
+                  count: int = 1):
+    """
+    The record_rating function remembers a rating created (count 1) or
+    deleted (count -1) in the session; the boards are updated when it commits.
+    """
+    db.info.setdefault(CHANGES_KEY, []).append((photo_id, rating, created_at, count))
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_rating_changes(session):
+    changes = session.info.pop(CHANGES_KEY, None)
+    if not changes:
+        return
+    # the transaction is committed already, the reconciliation fixes a failure
+    try:
+        leaderboard.apply(changes)
+    except Exception as e:
+        print(e)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_rating_changes(session):
+    session.info.pop(CHANGES_KEY, None)
@@ -0,0 +1,179 @@
+"""
+Deletion of stored assets through an outbox.
+
+Deleting a photo only writes its assets to the asset_deletions table in the
+same transaction as the row delete, so the request returns as soon as the
+database commits. The reaper drains the table in the background in batches,
+one bulk storage call per batch, and retries the failed assets later with an
+exponential backoff. An asset that a photo references again by the time its
+batch is drained (a re-post of the same file) is taken from the outbox instead
+of being deleted.
+
+The QR codes and avatars built from a photo are written to photo_assets by
+the process that builds them, so deleting the photo queues them whichever
+worker built them, and a live photo that still uses one keeps it out of the
+reaper.
+"""
+
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, exists, insert, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.conf.config import config
+from src.conf.constants import OUTBOX_BATCH_SIZE, OUTBOX_MAX_BACKOFF, QrFormat
+from src.database.db import insert_ignore, sessionmanager
+from src.models.models import AssetDeletion, Photo, PhotoAsset
+from src.services.qr_code import qr_public_id, uploaded_qr_codes
+from src.services.storage import storage
+
+
+def enqueue_deletions(db: AsyncSession, public_ids) -> None:
+    """
+    The enqueue_deletions function adds assets to the outbox of the session;
+    they are written with the rest of the transaction.
+
+    :param db: AsyncSession: The session of the transaction
+    :param public_ids: Names of the assets in the storage
+    """
+    public_ids = list(dict.fromkeys(public_ids))
+    db.add_all(AssetDeletion(public_id=public_id) for public_id in public_ids)
+    uploaded_qr_codes.discard(lambda public_id: public_id in public_ids)
+
+
+async def cancel_deletions(db: AsyncSession, public_ids) -> None:
+    """
+    The cancel_deletions function takes assets that are used again out of the
+    outbox; the change is written with the rest of the transaction.
+
+    :param db: AsyncSession: The session of the transaction
+    :param public_ids: Names of the assets in the storage
+    """
+    await db.execute(delete(AssetDeletion).filter(AssetDeletion.public_id.in_(list(public_ids))))
+
+
+async def record_assets(db: AsyncSession, photo_id: int, public_ids) -> None:
+    """
+    The record_assets function writes the assets built from a photo; they are
+    written with the rest of the transaction, and not at all if the photo is gone.
+
+    :param db: AsyncSession: The session of the transaction
+    :param photo_id: int: The photo the assets are built from
+    :param public_ids: Names of the assets in the storage
+    """
+    for public_id in dict.fromkeys(public_ids):
+        stmt = insert_ignore(db, PhotoAsset)
+        if stmt is None:
+            stmt = insert(PhotoAsset)
+        recorded = exists().where(
+            PhotoAsset.photo_id == photo_id, PhotoAsset.public_id == public_id
+        )
+        await db.execute(
+            stmt.from_select(
+                ["photo_id", "public_id"],
+                select(Photo.id, literal(public_id, PhotoAsset.public_id.type)).filter(
+                    Photo.id == photo_id, ~recorded
+                ),
+            )
+        )
+
+
+async def referenced_assets(db: AsyncSession, public_ids) -> set[str]:
+    """
+    The referenced_assets function returns the assets that photos use: their
+    originals, the QR codes of their transformed photos and the assets built from them.
+
+    :param db: AsyncSession: Pass the database session to the function
+    :param public_ids: Names of the assets in the storage
+    :return: The names of the referenced assets
+    """
+    result = await db.execute(
+        select(Photo.public_photo_id, Photo.path_transform).filter(
+            Photo.public_photo_id.in_(public_ids)
+        )
+    )
+    referenced = set()
+    for public_photo_id, path_transform in result:
+        referenced.add(public_photo_id)
+        if path_transform:
+            referenced.update(qr_public_id(path_transform, f) for f in QrFormat)
+    result = await db.execute(
+        select(PhotoAsset.public_id).filter(PhotoAsset.public_id.in_(public_ids))
+    )
+    referenced.update(result.scalars())
+    return referenced & set(public_ids)
+
+
+class AssetReaper:
+    def __init__(self, interval: float, batch_size: int = OUTBOX_BATCH_SIZE):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._task: asyncio.Task | None = None
+
+    def backoff(self, attempts: int) -> timedelta:
+        return timedelta(seconds=min(OUTBOX_MAX_BACKOFF, self.interval * 2**attempts))
+
+    async def drain(self, db: AsyncSession) -> int:
+        """
+        The drain function deletes one batch of due assets from the storage.
+
+        :param db: AsyncSession: Pass the database session to the function
+        :return: The number of assets taken from the outbox
+        """
+        now = datetime.now()
+        result = await db.execute(
+            select(AssetDeletion)
+            .filter(AssetDeletion.next_attempt_at <= now)
+            .order_by(AssetDeletion.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        batch = result.scalars().all()
+        if not batch:
+            return 0
+
+        # a photo can use the asset again since it was queued
+        referenced = await referenced_assets(db, [item.public_id for item in batch])
+        doomed = [item.public_id for item in batch if item.public_id not in referenced]
+        error = None
+        try:
+            done = await storage.destroy_many(doomed) if doomed else set()
+        except Exception as e:
+            done, error = set(), str(e) or e.__class__.__name__
+        uploaded_qr_codes.discard(lambda public_id: public_id in done)
+
+        gone = [item.id for item in batch if item.public_id in done | referenced]
+        if gone:
+            await db.execute(delete(AssetDeletion).filter(AssetDeletion.id.in_(gone)))
+        for item in batch:
+            if item.public_id not in done | referenced:
+                item.attempts += 1
+                item.last_error = (error or "not deleted")[:250]
+                item.next_attempt_at = now + self.backoff(item.attempts)
+        await db.commit()
+        return len(batch)
+
+    async def run(self):
+        while True:
+            taken = 0
+            try:
+                async with sessionmanager.session() as db:
+                    taken = await self.drain(db)
+            except Exception as e:
+                print(e)
+            if taken < self.batch_size:
+                await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+asset_reaper = AssetReaper(config.OUTBOX_INTERVAL)
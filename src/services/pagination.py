@@ -0,0 +1,103 @@
+"""
+Keyset pagination of the list endpoints.
+
+A page is read with WHERE (sort key, id) > (values of the last row) instead
+of OFFSET, so with an index on (sort key, id) any page costs as much as the
+first one, and rows inserted meanwhile do not shift the pages. The client gets
+the position as an opaque cursor and sends it back for the next page.
+"""
+
+import base64
+import binascii
+import json
+import uuid
+from datetime import date, datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import Select, tuple_
+from sqlalchemy.engine import Result
+
+from src.conf import messages
+
+
+def _dump(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _load(value, column):
+    try:
+        python_type = column.type.python_type
+    except NotImplementedError:
+        return value
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+def invalid_cursor() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail=messages.INVALID_CURSOR
+    )
+
+
+class Keyset:
+    def __init__(self, *columns, descending: bool = False):
+        """
+        :param columns: The sort key of the list, the last one must be unique (the id)
+        :param descending: bool: Order of all columns
+        """
+        self.columns = columns
+        self.descending = descending
+
+    def encode(self, values) -> str:
+        data = json.dumps([_dump(value) for value in values], separators=(",", ":"))
+        return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+    def decode(self, cursor: str) -> tuple:
+        """
+        :raises HTTPException: 400 if the cursor was not made for this list
+        """
+        try:
+            data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            values = json.loads(data)
+            if not isinstance(values, list) or len(values) != len(self.columns):
+                raise ValueError(cursor)
+            return tuple(
+                _load(value, column) for value, column in zip(values, self.columns)
+            )
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+            raise invalid_cursor()
+
+    def apply(self, stmt: Select, cursor: str | None, limit: int) -> Select:
+        """
+        The apply function orders the statement by the sort key, starts it after
+        the cursor and reads one row more than the page to know if there is a next one.
+
+        :param stmt: Select: Statement of the list, without order, offset and limit
+        :param cursor: str | None: Cursor of the previous page, None for the first page
+        :param limit: int: Size of the page
+        :return: The statement of the page
+        """
+        if cursor:
+            key, values = tuple_(*self.columns), tuple_(*self.decode(cursor))
+            stmt = stmt.where(key < values if self.descending else key > values)
+        order = [column.desc() if self.descending else column for column in self.columns]
+        return stmt.add_columns(*self.columns).order_by(*order).limit(limit + 1)
+
+    def page(self, result: Result, limit: int) -> dict:
+        """
+        :param result: Result: The result of the statement made by apply
+        :param limit: int: Size of the page
+        :return: The items of the page and the cursor of the next page (None on the last page)
+        """
+        rows = result.all()
+        next_cursor = None
+        if len(rows) > limit:
+            next_cursor = self.encode(rows[limit - 1][1:])
+        return {"items": [row[0] for row in rows[:limit]], "next_cursor": next_cursor}
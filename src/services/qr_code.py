@@ -0,0 +1,87 @@
+"""
+QR codes for photo links.
+
+The image is rendered in memory (PNG or SVG), never through a file on disk,
+and the rendering runs in a worker thread. Rendered images are kept in an LRU
+keyed by the encoded data and the render options, and the url of an uploaded
+QR code is kept in an LRU too, so the same link is neither rendered nor
+uploaded twice.
+"""
+
+import asyncio
+import hashlib
+import io
+from functools import lru_cache
+
+import qrcode
+import qrcode.image.pure
+import qrcode.image.svg
+
+from src.conf.constants import QR_CACHE_SIZE, QrFormat
+from src.services.cache import LRUCache
+
+IMAGE_FACTORIES = {
+    QrFormat.png: qrcode.image.pure.PyPNGImage,
+    QrFormat.svg: qrcode.image.svg.SvgPathImage,
+}
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr_code(
+    data: str,
+    qr_format: QrFormat = QrFormat.png,
+    box_size: int = 10,
+    border: int = 4,
+) -> bytes:
+    """
+    The render_qr_code function renders a QR code to bytes.
+
+    :param data: str: Text encoded in the QR code
+    :param qr_format: QrFormat: png or svg
+    :param box_size: int: Size of one box in pixels
+    :param border: int: Width of the border in boxes
+    :return: The image bytes
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=box_size,
+        border=border,
+        image_factory=IMAGE_FACTORIES[QrFormat(qr_format)],
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    buffer = io.BytesIO()
+    qr.make_image().save(buffer)
+    return buffer.getvalue()
+
+
+async def make_qr_code(data: str, qr_format: QrFormat = QrFormat.png, **options) -> bytes:
+    """
+    The make_qr_code function renders a QR code without blocking the event loop.
+
+    :param data: str: Text encoded in the QR code
+    :param qr_format: QrFormat: png or svg
+    :param options: box_size and border of render_qr_code
+    :return: The image bytes
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        None, lambda: render_qr_code(data, QrFormat(qr_format), **options)
+    )
+
+
+def qr_public_id(data: str, qr_format: QrFormat = QrFormat.png) -> str:
+    """
+    The qr_public_id function gives the same public id for the same data,
+    so a QR code of an already encoded link points to the existing asset.
+
+    :param data: str: Text encoded in the QR code
+    :param qr_format: QrFormat: png or svg
+    :return: The public id of the QR code in the storage
+    """
+    digest = hashlib.sha256(f"{QrFormat(qr_format).value}:{data}".encode()).hexdigest()
+    return f"Qr_Code/{digest[:32]}"
+
+
+uploaded_qr_codes = LRUCache(QR_CACHE_SIZE)
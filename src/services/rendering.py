@@ -0,0 +1,200 @@
+"""
+Local rendering of thumbnails and avatars with Pillow.
+
+Decoding and resizing are CPU bound, so the work runs in a process pool and
+the event loop only awaits the result. One call decodes the source once and
+renders any number of sizes from it; the results are encoded in memory.
+
+A render spec is a dict with the keys:
+
+- ``width``, ``height``: size of the result;
+- ``crop``: a CropMode value (fill by default);
+- ``effect``: an EffectMode name (sepia, vignette, pixelate, cartoonify);
+- ``circle``: cut a circle out of the result (avatars);
+- ``format``: PNG, JPEG or WEBP (JPEG, or PNG if the result has transparency).
+"""
+
+import asyncio
+import io
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException, status
+from PIL import Image, ImageDraw, ImageFilter, ImageOps
+
+from src.conf import messages
+from src.conf.config import config
+
+JPEG_QUALITY = 85
+
+
+def _resize(image: Image.Image, width: int, height: int, crop: str) -> Image.Image:
+    size = (width, height)
+    if crop in (None, "fill", "thumb"):
+        return ImageOps.fit(image, size, Image.LANCZOS)
+    if crop == "pad":
+        return ImageOps.pad(image, size, Image.LANCZOS)
+    if crop == "scale":
+        return image.resize(size, Image.LANCZOS)
+    if crop == "fit":
+        return ImageOps.contain(image, size, Image.LANCZOS)
+    if crop == "limit":
+        image = image.copy()
+        image.thumbnail(size, Image.LANCZOS)
+        return image
+    raise ValueError(f"Unknown crop mode {crop}")
+
+
+def _sepia(image: Image.Image) -> Image.Image:
+    gray = ImageOps.grayscale(image)
+    return ImageOps.colorize(gray, black="#2e1c0c", white="#f3e3c3", mid="#a07850")
+
+
+def _vignette(image: Image.Image) -> Image.Image:
+    # radial_gradient is 0 in the center and 255 on the edge of the circle
+    mask = Image.radial_gradient("L").resize(image.size, Image.BILINEAR)
+    mask = mask.point(lambda value: max(0, value - 96) * 255 // 159)
+    return Image.composite(Image.new("RGB", image.size), image, mask)
+
+
+def _pixelate(image: Image.Image) -> Image.Image:
+    block = max(1, min(image.size) // 32)
+    small = image.resize(
+        (max(1, image.width // block), max(1, image.height // block)), Image.BOX
+    )
+    return small.resize(image.size, Image.NEAREST)
+
+
+def _cartoonify(image: Image.Image) -> Image.Image:
+    smooth = image.filter(ImageFilter.SMOOTH_MORE)
+    return ImageOps.posterize(smooth, 3).filter(ImageFilter.EDGE_ENHANCE_MORE)
+
+
+EFFECTS = {
+    "sepia": _sepia,
+    "vignette": _vignette,
+    "pixelate": _pixelate,
+    "cartoonify": _cartoonify,
+}
+
+
+def _circle(image: Image.Image) -> Image.Image:
+    mask = Image.new("L", image.size)
+    ImageDraw.Draw(mask).ellipse((0, 0, image.width - 1, image.height - 1), fill=255)
+    image = image.convert("RGBA")
+    image.putalpha(mask)
+    return image
+
+
+def _encode(image: Image.Image, image_format: str | None) -> bytes:
+    if image_format is None:
+        image_format = "PNG" if image.mode in ("RGBA", "LA", "P") else "JPEG"
+    image_format = image_format.upper()
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    if image_format in ("JPEG", "WEBP"):
+        image.save(buffer, image_format, quality=JPEG_QUALITY, optimize=True)
+    else:
+        image.save(buffer, image_format, optimize=True)
+    return buffer.getvalue()
+
+
+def render_images(data: bytes, specs: list[dict]) -> list[bytes]:
+    """
+    The render_images function decodes an image once and renders every spec from it.
+    It runs in a worker process, so it must stay a plain module level function.
+
+    :param data: bytes: The source image
+    :param specs: list[dict]: What to render (see the module docstring)
+    :return: The encoded images in the order of the specs
+    """
+    image = Image.open(io.BytesIO(data))
+    largest = (
+        max(spec["width"] for spec in specs),
+        max(spec["height"] for spec in specs),
+    )
+    # lets the JPEG decoder scale down while decoding
+    image.draft("RGB", largest)
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+    results = []
+    for spec in specs:
+        result = _resize(image, spec["width"], spec["height"], spec.get("crop"))
+        effect = spec.get("effect")
+        if effect:
+            alpha = result.getchannel("A") if result.mode == "RGBA" else None
+            result = EFFECTS[effect](result.convert("RGB"))
+            if alpha is not None:
+                result.putalpha(alpha)
+        if spec.get("circle"):
+            result = _circle(result)
+        results.append(_encode(result, spec.get("format")))
+    return results
+
+
+class RenderingEngine:
+    def __init__(self, max_workers: int, timeout: float):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor: ProcessPoolExecutor | None = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self._executor
+
+    async def render(self, data: bytes, specs: list[dict]) -> list[bytes]:
+        """
+        Render the specs from one source image in the process pool.
+
+        :param data: bytes: The source image
+        :param specs: list[dict]: What to render
+        :return: The encoded images in the order of the specs
+        :raises HTTPException: 400 if the image can not be decoded, 504 on timeout
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_executor(), render_images, data, specs)
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail=messages.RENDERING_TIMEOUT,
+            )
+        except (OSError, ValueError, KeyError):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=messages.WRONG_FILE_TYPE,
+            )
+
+    async def thumbnail(
+        self,
+        data: bytes,
+        width: int,
+        height: int,
+        crop: str = "fill",
+        effect: str | None = None,
+    ) -> bytes:
+        spec = {"width": width, "height": height, "crop": crop, "effect": effect}
+        return (await self.render(data, [spec]))[0]
+
+    async def avatar(self, data: bytes, size: int = 200, effect: str | None = None) -> bytes:
+        spec = {
+            "width": size,
+            "height": size,
+            "crop": "fill",
+            "effect": effect,
+            "circle": True,
+            "format": "PNG",
+        }
+        return (await self.render(data, [spec]))[0]
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+rendering = RenderingEngine(config.RENDER_WORKERS, config.RENDER_TIMEOUT)
@@ -0,0 +1,23 @@
+"""
+Transformed renditions of photos.
+
+A rendition is a delivery url with the transformation in it, built from the
+public id of the original without any network call. The urls (with their QR
+codes) are kept in an LRU keyed by the photo and the transformation
+parameters, so a repeated request is answered from memory.
+"""
+
+from src.conf.constants import RENDITION_CACHE_SIZE
+from src.services.cache import LRUCache
+
+renditions = LRUCache(RENDITION_CACHE_SIZE)
+
+
+def forget_photo(photo_id: int) -> list[tuple[tuple, dict]]:
+    """
+    The forget_photo function drops the cached renditions of a deleted photo.
+
+    :param photo_id: int: Id of the photo
+    :return: The dropped cache keys with their renditions
+    """
+    return renditions.discard(lambda key: key[1] == photo_id)
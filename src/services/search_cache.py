@@ -0,0 +1,226 @@
+"""
+Cache of the photo search results in Redis.
+
+A page of results is cached under the normalized parameters of the search
+for SEARCH_CACHE_TTL seconds. The entry is registered in dependency sets:
+one for every photo of the page, every searched word and the tag of every
+searched word. A transaction which changes photos, their descriptions, tags
+ratings or comments records what it touched in the session, and after the commit
+only the entries of those sets are deleted.
+
+A photo which newly matches a cached fuzzy or rated search without sharing
+a searched word with it is seen when the entry expires.
+"""
+
+import hashlib
+import json
+import re
+
+from redis import RedisError
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from src.conf.constants import SEARCH_CACHE_TTL
+from src.models.models import Comment, Photo, Rating, Tag
+from src.services.auth import auth_service
+from src.services.tag_dictionary import tag_dictionary
+
+CHANGES_KEY = "search_changes"
+WORD = re.compile(r"\w+")
+
+
+def words(text: str | None) -> set[str]:
+    return set(WORD.findall(text.lower())) if text else set()
+
+
+def _changes(info: dict) -> dict:
+    return info.setdefault(CHANGES_KEY, {"photo": set(), "tag": set(), "word": set()})
+
+
+class SearchCache:
+    def __init__(self, ttl: int = SEARCH_CACHE_TTL, prefix: str = "search"):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self._seconds = {True: 0.0, False: 0.0}
+
+    @property
+    def client(self):
+        return auth_service.cache
+
+    def key(self, search_keyword: str, rate_min, rate_max, photos_per_page: int,
+            cursor: str | None, fuzzy: bool, sort=None, order=None) -> str:
+        # the sort applies only with a sort key, the order alone does not change the results
+        params = [
+            " ".join(search_keyword.lower().split()),
+            rate_min if rate_min is None else float(rate_min),
+            rate_max if rate_max is None else float(rate_max),
+            photos_per_page,
+            cursor,
+            fuzzy,
+            None if sort is None else [sort.value, order.value],
+        ]
+        digest = hashlib.sha1(json.dumps(params).encode()).hexdigest()
+        return f"{self.prefix}:entry:{digest}"
+
+    async def tag_ids(self, search_keyword: str, db: AsyncSession) -> set[int]:
+        """
+        The tag_ids function returns the ids of the tags named by the words.
+        """
+        names = words(search_keyword)
+        ids = {tag_dictionary.get(name) for name in names} - {None}
+        if len(ids) < len(names) and not tag_dictionary.active:
+            result = await db.execute(select(Tag.id).filter(Tag.name.in_(names)))
+            ids.update(result.scalars().all())
+        return ids
+
+    def _dependency(self, kind: str, value) -> str:
+        return f"{self.prefix}:{kind}:{value}"
+
+    def get(self, key: str) -> dict | None:
+        try:
+            value = self.client.get(key)
+        except RedisError as e:
+            print(e)
+            return None
+        return None if value is None else json.loads(value)
+
+    def set(self, key: str, page: dict, photo_ids=(), tag_ids=(), words=()):
+        """
+        The set function caches a page and registers it in its dependency sets;
+        the sets live as long as their newest entry.
+
+        :param key: str: Key made by the key function
+        :param page: dict: The page, serializable to JSON
+        :param photo_ids: Ids of the photos of the page
+        :param tag_ids: Ids of the searched tags
+        :param words: The searched words
+        """
+        dependencies = [
+            *(self._dependency("photo", photo_id) for photo_id in photo_ids),
+            *(self._dependency("tag", tag_id) for tag_id in tag_ids),
+            *(self._dependency("word", word) for word in words),
+        ]
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.set(key, json.dumps(page), ex=self.ttl)
+            for dependency in dependencies:
+                pipe.sadd(dependency, key)
+                pipe.expire(dependency, self.ttl)
+            pipe.execute()
+        except RedisError as e:
+            print(e)
+
+    def invalidate(self, photo_ids=(), tag_ids=(), words=()) -> int:
+        """
+        The invalidate function deletes the entries depending on any of the
+        photos, tags or words.
+
+        :return: The number of deleted entries
+        """
+        dependencies = [
+            *(self._dependency("photo", photo_id) for photo_id in photo_ids),
+            *(self._dependency("tag", tag_id) for tag_id in tag_ids),
+            *(self._dependency("word", word) for word in words),
+        ]
+        if not dependencies:
+            return 0
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            for dependency in dependencies:
+                pipe.smembers(dependency)
+            keys = set().union(*pipe.execute())
+            deleted = self.client.delete(*keys) if keys else 0
+            self.client.delete(*dependencies)
+        except RedisError as e:
+            print(e)
+            return 0
+        self.invalidated += deleted
+        return deleted
+
+    def observe(self, hit: bool, seconds: float):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self._seconds[hit] += seconds
+
+    def metrics(self) -> dict:
+        """
+        The metrics function returns the counters of this process: hit ratio,
+        mean latency of the hits and of the misses in milliseconds, and the
+        number of entries deleted by invalidation.
+        """
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else None,
+            "hit_latency_ms": 1000 * self._seconds[True] / self.hits if self.hits else None,
+            "miss_latency_ms": 1000 * self._seconds[False] / self.misses if self.misses else None,
+            "invalidated": self.invalidated,
+        }
+
+
+search_cache = SearchCache()
+
+
+def record_search_changes(db: AsyncSession, photo_ids=(), tag_ids=(), words=()):
+    """
+    The record_search_changes function remembers the photos, tags and words
+    changed by Core statements of the session; the cached results depending on
+    them are deleted when it commits. The ORM changes are found by the flush.
+
+    :param db: AsyncSession: The session of the transaction
+    :param photo_ids: Ids of the changed photos
+    :param tag_ids: Ids of the tags added to or removed from the photos
+    :param words: Words added to or removed from the photos, as tag names or in descriptions
+    """
+    changes = _changes(db.info)
+    changes["photo"].update(photo_ids)
+    changes["tag"].update(tag_ids)
+    changes["word"].update(words)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flushed_photos(session, flush_context):
+    photo_ids, tag_ids, changed_words = set(), set(), set()
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, (Rating, Comment)):
+            photo_ids.add(obj.photo_id)
+        if not isinstance(obj, Photo):
+            continue
+        photo_ids.add(obj.id)
+        state = inspect(obj)
+        description = state.attrs.description.history
+        for text in (*description.added, *description.deleted):
+            changed_words.update(words(text))
+        tags = state.attrs.tags.history
+        for tag in (*tags.added, *tags.deleted):
+            tag_ids.add(tag.id)
+            changed_words.add(tag.name)
+    if photo_ids:
+        changes = _changes(session.info)
+        changes["photo"].update(photo_ids)
+        changes["tag"].update(tag_ids)
+        changes["word"].update(changed_words)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_search_results(session):
+    changes = session.info.pop(CHANGES_KEY, None)
+    if not changes:
+        return
+    # the transaction is committed already, a failure must not fail the request
+    try:
+        search_cache.invalidate(changes["photo"], changes["tag"], changes["word"])
+    except Exception as e:
+        print(e)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_search_changes(session):
+    session.info.pop(CHANGES_KEY, None)
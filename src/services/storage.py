@@ -0,0 +1,317 @@
+"""
+Async storage layer for photos, avatars and QR codes.
+
+The backend is chosen by STORAGE_BACKEND:
+
+- ``cloudinary`` keeps the assets in Cloudinary;
+- ``local`` writes them to a content-addressed directory tree under
+  STORAGE_LOCAL_ROOT, served by StaticFiles at STORAGE_LOCAL_URL.
+
+Both SDK calls and disk writes are blocking, so every call is pushed to a
+bounded thread pool and awaited with a timeout. The event loop keeps serving
+other requests while an upload is in flight.
+"""
+
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+import io
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import cloudinary
+import cloudinary.api
+import cloudinary.uploader
+import requests
+from fastapi import HTTPException, status
+
+from src.conf import messages
+from src.conf.config import config
+from src.conf.constants import UPLOAD_SESSION_CHUNK_SIZE
+from src.services.uploads import guess_extension
+
+
+class Storage(ABC):
+    # whether build_url applies transformation options
+    transforms = False
+
+    def __init__(self, max_workers: int, timeout: float):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="storage"
+        )
+
+    def _configure(self):
+        pass
+
+    async def _run(self, func, *args, **kwargs):
+        """
+        Run a blocking call in the storage executor.
+
+        :param func: Blocking callable to run
+        :return: Whatever the callable returns
+        :raises HTTPException: 504 if the call does not finish in time
+        """
+        return await self._run_for(self.timeout, func, *args, **kwargs)
+
+    async def _run_for(self, timeout: float, func, /, *args, **kwargs):
+        self._configure()
+        loop = asyncio.get_running_loop()
+        call = partial(func, *args, **kwargs)
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._executor, call), timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail=messages.STORAGE_TIMEOUT,
+            )
+
+    @abstractmethod
+    async def upload(self, file, public_id: str, **options) -> dict:
+        """
+        Store a file object, bytes, a path or a url.
+
+        :param file: Source of the image
+        :param public_id: str: Requested name of the asset
+        :return: The upload result (url, secure_url, public_id, version, ...).
+            Callers must keep the returned public_id, a backend may rename the asset.
+        """
+
+    async def upload_large(self, path: str, public_id: str, **options) -> dict:
+        """
+        Store a big file from a path. A backend may send it in parts.
+
+        :param path: str: Path of the file
+        :param public_id: str: Requested name of the asset
+        :return: The upload result, as for upload
+        """
+        return await self.upload(path, public_id, **options)
+
+    @abstractmethod
+    async def destroy(self, public_id: str) -> dict:
+        """
+        Delete the asset stored under public_id.
+
+        :param public_id: str: Name of the asset in the storage
+        :return: The deletion result
+        """
+
+    async def destroy_many(self, public_ids: list[str]) -> set[str]:
+        """
+        Delete many assets, in bulk where the backend allows it.
+
+        :param public_ids: list[str]: Names of the assets in the storage
+        :return: The public ids that are gone (deleted or not found)
+        """
+        done = set()
+        for public_id in public_ids:
+            try:
+                result = await self.destroy(public_id)
+            except Exception as e:
+                print(e)
+                continue
+            if result.get("result") in ("ok", "not found"):
+                done.add(public_id)
+        return done
+
+    @abstractmethod
+    async def read(self, public_id: str) -> bytes:
+        """
+        Read the content of an asset.
+
+        :param public_id: str: Name of the asset in the storage
+        :return: The content of the asset
+        """
+
+    @abstractmethod
+    def build_url(self, public_id: str, **options) -> str:
+        """
+        Build the delivery url of an asset. Pure string work, no I/O.
+
+        :param public_id: str: Name of the asset in the storage
+        :return: The url of the asset
+        """
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class CloudinaryStorage(Storage):
+    transforms = True
+
+    def __init__(self, max_workers: int, timeout: float):
+        super().__init__(max_workers, timeout)
+        self._configured = False
+
+    def _configure(self):
+        if not self._configured:
+            cloudinary.config(
+                cloud_name=config.CLOUDINARY_NAME,
+                api_key=config.CLOUDINARY_API_KEY,
+                api_secret=config.CLOUDINARY_API_SECRET,
+                secure=True,
+            )
+            self._configured = True
+
+    async def upload(self, file, public_id: str, **options) -> dict:
+        options.setdefault("timeout", self.timeout)
+        return await self._run(
+            cloudinary.uploader.upload, file, public_id=public_id, **options
+        )
+
+    async def upload_large(self, path: str, public_id: str, **options) -> dict:
+        options.setdefault("timeout", self.timeout)
+        options.setdefault("chunk_size", UPLOAD_SESSION_CHUNK_SIZE)
+        # the timeout is per part, the whole upload gets one timeout per part
+        parts = max(1, -(-os.path.getsize(path) // options["chunk_size"]))
+        return await self._run_for(
+            self.timeout * parts,
+            cloudinary.uploader.upload_large,
+            path,
+            public_id=public_id,
+            **options,
+        )
+
+    async def destroy(self, public_id: str) -> dict:
+        return await self._run(
+            cloudinary.uploader.destroy, public_id, timeout=self.timeout
+        )
+
+    async def destroy_many(self, public_ids: list[str]) -> set[str]:
+        # one Admin API call deletes up to 100 assets
+        result = await self._run(
+            cloudinary.api.delete_resources, public_ids, timeout=self.timeout
+        )
+        return {
+            public_id
+            for public_id, state in result.get("deleted", {}).items()
+            if state in ("deleted", "not_found")
+        }
+
+    def _download(self, url: str) -> bytes:
+        response = requests.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        return response.content
+
+    async def read(self, public_id: str) -> bytes:
+        # the original is downloaded from its delivery url
+        return await self._run(self._download, self.build_url(public_id))
+
+    def build_url(self, public_id: str, **options) -> str:
+        self._configure()
+        return cloudinary.CloudinaryImage(public_id).build_url(**options)
+
+
+class LocalStorage(Storage):
+    """
+    Content-addressed storage on the local disk.
+
+    A file is stored once under ``ab/cd/<sha256><ext>`` whatever public_id was
+    requested, and the relative path becomes its public_id. The extension is
+    the format option if given, else guessed from the content. Transformation
+    options are ignored, the original is always served; renditions are made
+    by the rendering engine and stored as files of their own.
+    """
+
+    chunk_size = 1024 * 1024
+
+    def __init__(self, root: str, base_url: str, max_workers: int, timeout: float):
+        super().__init__(max_workers, timeout)
+        self.root = Path(root).resolve()
+        self.base_url = base_url.rstrip("/")
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, public_id: str) -> Path:
+        path = (self.root / public_id).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"{public_id} is outside of the storage")
+        return path
+
+    def _open(self, file):
+        if isinstance(file, bytes):
+            return io.BytesIO(file), False
+        if isinstance(file, (str, Path)):
+            file = str(file)
+            if file.startswith(f"{self.base_url}/"):
+                return open(self._path(file[len(self.base_url) + 1 :]), "rb"), True
+            if "://" in file:
+                raise ValueError("Local storage can not fetch remote files")
+            return open(file, "rb"), True
+        return file, False
+
+    def _write(self, file, extension: str | None = None) -> str:
+        source, close = self._open(file)
+        digest = hashlib.sha256()
+        head = b""
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while chunk := source.read(self.chunk_size):
+                    head = head or chunk[:16]
+                    digest.update(chunk)
+                    out.write(chunk)
+            name = digest.hexdigest() + (extension or guess_extension(head))
+            public_id = f"{name[:2]}/{name[2:4]}/{name}"
+            target = self.root / public_id
+            if target.exists():
+                os.unlink(tmp)
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(tmp, target)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        finally:
+            if close:
+                source.close()
+        return public_id
+
+    def _read(self, public_id: str) -> bytes:
+        return self._path(public_id).read_bytes()
+
+    def _remove(self, public_id: str) -> dict:
+        try:
+            os.unlink(self._path(public_id))
+        except FileNotFoundError:
+            return {"result": "not found"}
+        return {"result": "ok"}
+
+    async def upload(self, file, public_id: str, **options) -> dict:
+        extension = f".{options['format']}" if options.get("format") else None
+        stored_id = await self._run(self._write, file, extension)
+        url = self.build_url(stored_id)
+        return {"url": url, "secure_url": url, "public_id": stored_id, "version": 1}
+
+    async def read(self, public_id: str) -> bytes:
+        return await self._run(self._read, public_id)
+
+    async def destroy(self, public_id: str) -> dict:
+        return await self._run(self._remove, public_id)
+
+    def build_url(self, public_id: str, **options) -> str:
+        return f"{self.base_url}/{public_id}"
+
+
+def get_storage() -> Storage:
+    """
+    Create the storage backend selected by STORAGE_BACKEND.
+
+    :return: A Storage instance
+    """
+    if config.STORAGE_BACKEND == "local":
+        return LocalStorage(
+            config.STORAGE_LOCAL_ROOT,
+            config.STORAGE_LOCAL_URL,
+            config.STORAGE_MAX_WORKERS,
+            config.STORAGE_TIMEOUT,
+        )
+    return CloudinaryStorage(config.STORAGE_MAX_WORKERS, config.STORAGE_TIMEOUT)
+
+
+storage = get_storage()
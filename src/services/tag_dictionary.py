@@ -0,0 +1,381 @@
+"""
+Process-local dictionary of the tags.
+
+The tags table is small and changes rarely, so every process keeps the name
+to id map in memory and resolves the names of uploads, tag changes and
+searches without a database round trip. A process which creates or deletes
+tags publishes the change on a Redis channel after the commit, and every
+process applies it to its dictionary.
+
+The dictionary also keeps the names in a sorted array with the number of
+photos of every tag, so the most used tags for a prefix are found with two
+bisections. Attaching and detaching tags publishes the usage deltas the same
+way.
+
+The names are indexed by their trigrams as well, for the fuzzy search on
+databases without pg_trgm. While the dictionary is not in use the index is
+built from the tags table and kept until this process creates or deletes a
+tag, or for FUZZY_INDEX_TTL seconds for the tags of the other processes.
+
+For the boolean tag queries every tag has the set of its photos as a Bitset,
+chunked so that it takes memory by the number of the photos and not by the
+largest photo id (see src/services/bitsets.py), and the Bitset of all photos
+is the universe of NOT. The links added and removed and the photos created
+and deleted are published the same way. A deleted photo stays in the Bitsets
+of its tags, it is masked out by the universe.
+
+The dictionary is used only while the process is subscribed to the channel;
+it is reloaded after every (re)subscription, so no change is missed. A name
+which is not in the dictionary is looked up in the database as before.
+"""
+
+import asyncio
+import heapq
+import json
+import operator
+import time
+import uuid
+from bisect import bisect_left, insort
+from collections import Counter
+
+from redis import RedisError
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from src.conf.constants import FUZZY_INDEX_TTL, TAGS_CHANNEL, TAGS_RESUBSCRIBE_DELAY
+from src.database.db import sessionmanager
+from src.models.models import Photo, Tag, photo_m2m_tag
+from src.services.auth import auth_service
+from src.services.bitsets import Bitset
+from src.services.tag_query import fold
+from src.services.trigrams import TrigramIndex
+
+CHANGES_KEY = "tag_changes"
+# sorts after any character of a tag name
+PREFIX_END = "\U0010ffff"
+
+
+def _changes(info: dict) -> dict:
+    return info.setdefault(
+        CHANGES_KEY,
+        {
+            "created": {},
+            "deleted": [],
+            "used": Counter(),
+            "linked": [],
+            "unlinked": [],
+            "photos": [],
+            "photos_deleted": [],
+        },
+    )
+
+
+class TagDictionary:
+    def __init__(self, channel: str = TAGS_CHANNEL):
+        self.channel = channel
+        # messages of this process are applied before they are published
+        self.origin = uuid.uuid4().hex
+        self.active = False
+        self._ids: dict[str, int] = {}
+        self._names: list[str] = []
+        self._counts: dict[str, int] = {}
+        self._trigrams = TrigramIndex()
+        self._photos: dict[int, Bitset] = {}
+        self._all = Bitset()
+        self._fallback: TrigramIndex | None = None
+        self._fallback_built = 0.0
+        self._task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def get(self, name: str) -> int | None:
+        return self._ids.get(name) if self.active else None
+
+    def tag(self, name: str) -> Tag | None:
+        """
+        The tag function returns a detached Tag of a known name, which
+        session.merge(tag, load=False) attaches to a session without a query.
+
+        :param name: str: Normalized name of the tag
+        :return: The tag or None if the name is not known
+        """
+        tag_id = self.get(name)
+        if tag_id is None:
+            return None
+        tag = Tag(id=tag_id, name=name)
+        make_transient_to_detached(tag)
+        return tag
+
+    def suggest(self, prefix: str, limit: int) -> list[tuple[str, int]] | None:
+        """
+        The suggest function finds the most used tags starting with the prefix.
+
+        :param prefix: str: Normalized beginning of the names
+        :param limit: int: Maximal number of tags
+        :return: Names with the numbers of photos, the most used first,
+            or None if the dictionary is not in use
+        """
+        if not self.active:
+            return None
+        start = bisect_left(self._names, prefix)
+        end = bisect_left(self._names, prefix + PREFIX_END, start)
+        names = heapq.nsmallest(
+            limit,
+            (self._names[i] for i in range(start, end)),
+            key=lambda name: (-self._counts.get(name, 0), name),
+        )
+        return [(name, self._counts.get(name, 0)) for name in names]
+
+    def similar(self, word: str, threshold: float, limit: int) -> list[tuple[str, float]] | None:
+        """
+        The similar function finds the tag names similar to a word.
+
+        :return: Names with their similarity, the most similar first,
+            or None if the dictionary is not in use
+        """
+        if not self.active:
+            return None
+        return self._trigrams.similar(word, threshold, limit)
+
+    async def trigram_index(self, db: AsyncSession) -> TrigramIndex:
+        """
+        The trigram_index function returns the trigram index of the tag names,
+        the one of the dictionary or, if it is not in use, the one of the tags table.
+
+        :param db: AsyncSession: Pass the database session to the function
+        :return: The index of all tag names
+        """
+        if self.active:
+            return self._trigrams
+        if self._fallback is None or time.monotonic() - self._fallback_built > FUZZY_INDEX_TTL:
+            names = await db.execute(select(Tag.name))
+            self._fallback = TrigramIndex(names.scalars().all())
+            self._fallback_built = time.monotonic()
+        return self._fallback
+
+    def photos(self, query: tuple) -> Bitset | None:
+        """
+        The photos function evaluates a boolean query of tags on the Bitsets.
+
+        :param query: tuple: The tree made by parse_tag_query
+        :return: The Bitset of the photos matching the query,
+            or None if the dictionary is not in use
+        """
+        if not self.active:
+            return None
+        bits = fold(
+            query,
+            tag=lambda name: self._photos.get(self._ids.get(name), Bitset()),
+            and_=operator.and_,
+            or_=operator.or_,
+            not_=lambda bits: self._all - bits,
+        )
+        return bits & self._all
+
+    def _add(self, name: str, tag_id: int):
+        if name not in self._ids:
+            insort(self._names, name)
+            self._trigrams.add(name)
+        self._ids[name] = tag_id
+
+    def remember(self, tags: dict[str, int]):
+        """
+        Add tags read from the database, they exist for every process already.
+        """
+        if self.active:
+            for name, tag_id in tags.items():
+                self._add(name, tag_id)
+
+    def apply(self, changes: dict):
+        for name, tag_id in changes.get("created", {}).items():
+            self._add(name, tag_id)
+        for name in changes.get("deleted", []):
+            tag_id = self._ids.pop(name, None)
+            if tag_id is not None:
+                del self._names[bisect_left(self._names, name)]
+                self._trigrams.discard(name)
+                self._photos.pop(tag_id, None)
+            self._counts.pop(name, None)
+        for photo_id in changes.get("photos", []):
+            self._all.add(photo_id)
+        for photo_id in changes.get("photos_deleted", []):
+            self._all.discard(photo_id)
+        for photo_id, tag_id in changes.get("linked", []):
+            self._photos.setdefault(tag_id, Bitset()).add(photo_id)
+        for photo_id, tag_id in changes.get("unlinked", []):
+            if tag_id in self._photos:
+                self._photos[tag_id].discard(photo_id)
+        for name, delta in changes.get("used", {}).items():
+            self._counts[name] = max(0, self._counts.get(name, 0) + delta)
+
+    def publish(self, changes: dict):
+        if changes.get("created") or changes.get("deleted"):
+            self._fallback = None
+        if not self.active:
+            return
+        self.apply(changes)
+        try:
+            auth_service.cache.publish(
+                self.channel, json.dumps({**changes, "origin": self.origin})
+            )
+        except RedisError as e:
+            print(e)
+
+    async def load(self, db: AsyncSession):
+        used = func.count(photo_m2m_tag.c.tag_id)
+        result = await db.execute(
+            select(Tag.name, Tag.id, used)
+            .outerjoin(photo_m2m_tag, photo_m2m_tag.c.tag_id == Tag.id)
+            .group_by(Tag.id, Tag.name)
+        )
+        rows = result.all()
+        self._ids = {name: tag_id for name, tag_id, _ in rows}
+        self._counts = {name: count for name, _, count in rows}
+        self._names = sorted(self._ids)
+        self._trigrams = TrigramIndex(self._names)
+        result = await db.execute(select(Photo.id))
+        self._all = Bitset(result.scalars())
+        result = await db.execute(
+            select(photo_m2m_tag.c.tag_id, photo_m2m_tag.c.photo_id).order_by(
+                photo_m2m_tag.c.tag_id
+            )
+        )
+        photos: dict[int, list[int]] = {}
+        for tag_id, photo_id in result:
+            photos.setdefault(tag_id, []).append(photo_id)
+        self._photos = {tag_id: Bitset(ids) for tag_id, ids in photos.items()}
+
+    async def listen(self, client):
+        """
+        Keep the dictionary in sync with the channel; the dictionary is not used
+        while the subscription is broken.
+
+        :param client: An asyncio Redis client
+        """
+        while True:
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async with sessionmanager.session() as db:
+                        await self.load(db)
+                    self.active = True
+                    async for message in pubsub.listen():
+                        if message["type"] != "message":
+                            continue
+                        changes = json.loads(message["data"])
+                        if changes.get("origin") != self.origin:
+                            self.apply(changes)
+            except Exception as e:
+                print(e)
+            self.active = False
+            await asyncio.sleep(TAGS_RESUBSCRIBE_DELAY)
+
+    def start(self, client):
+        if self._task is None:
+            self._task = asyncio.create_task(self.listen(client))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.active = False
+        self._ids, self._names, self._counts = {}, [], {}
+        self._trigrams = TrigramIndex()
+        self._photos, self._all = {}, Bitset()
+        self._fallback = None
+
+
+tag_dictionary = TagDictionary()
+
+
+def record_created_tags(db: AsyncSession, tags: dict[str, int]):
+    """
+    The record_created_tags function remembers the tags inserted in the
+    transaction of the session; they are published when it commits.
+
+    :param db: AsyncSession: The session of the transaction
+    :param tags: dict[str, int]: Ids of the new tags by name
+    """
+    if tags:
+        _changes(db.info)["created"].update(tags)
+
+
+def record_tag_usage(db: AsyncSession, used: dict[str, int]):
+    """
+    The record_tag_usage function remembers the photos added to (positive) or
+    removed from (negative) the tags by Core statements of the session; the
+    links written through Photo.tags are counted by the flush.
+
+    :param db: AsyncSession: The session of the transaction
+    :param used: dict[str, int]: Change of the number of photos by tag name
+    """
+    if tag_dictionary.active:
+        _changes(db.info)["used"].update(used)
+
+
+def record_tag_links(db: AsyncSession, photo_id: int, linked=(), unlinked=()):
+    """
+    The record_tag_links function remembers the tags added to or removed from
+    the photo by Core statements of the session, for the bitsets of the tags.
+
+    :param db: AsyncSession: The session of the transaction
+    :param photo_id: int: Id of the photo
+    :param linked: Ids of the added tags
+    :param unlinked: Ids of the removed tags
+    """
+    if tag_dictionary.active:
+        changes = _changes(db.info)
+        changes["linked"].extend([photo_id, tag_id] for tag_id in linked)
+        changes["unlinked"].extend([photo_id, tag_id] for tag_id in unlinked)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_flushed_tags(session, flush_context):
+    created = {obj.name: obj.id for obj in session.new if isinstance(obj, Tag)}
+    deleted = [obj.name for obj in session.deleted if isinstance(obj, Tag)]
+    if created or deleted:
+        changes = _changes(session.info)
+        changes["created"].update(created)
+        changes["deleted"].extend(deleted)
+    if not tag_dictionary.active:
+        # only the trigram index of the tags table has to know
+        return
+    used = Counter()
+    photos, photos_deleted, linked, unlinked = [], [], [], []
+    for obj in session.deleted:
+        if isinstance(obj, Photo):
+            history = inspect(obj).attrs.tags.history
+            used.subtract(tag.name for tag in (*history.unchanged, *history.deleted))
+            photos_deleted.append(obj.id)
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Photo):
+            history = inspect(obj).attrs.tags.history
+            used.update(tag.name for tag in history.added)
+            used.subtract(tag.name for tag in history.deleted)
+            linked.extend([obj.id, tag.id] for tag in history.added)
+            unlinked.extend([obj.id, tag.id] for tag in history.deleted)
+            if obj in session.new:
+                photos.append(obj.id)
+    if used or photos or photos_deleted or linked or unlinked:
+        changes = _changes(session.info)
+        changes["used"].update(used)
+        changes["photos"].extend(photos)
+        changes["photos_deleted"].extend(photos_deleted)
+        changes["linked"].extend(linked)
+        changes["unlinked"].extend(unlinked)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_tag_changes(session):
+    changes = session.info.pop(CHANGES_KEY, None)
+    if changes:
+        changes["used"] = {name: delta for name, delta in changes["used"].items() if delta}
+        tag_dictionary.publish(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_tag_changes(session):
+    session.info.pop(CHANGES_KEY, None)
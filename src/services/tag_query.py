@@ -0,0 +1,124 @@
+"""
+Boolean queries over the tags of photos.
+
+    sunset AND beach NOT night
+    (sea OR ocean) "new york"
+
+Adjacent terms are joined with AND, NOT binds tighter than AND and AND
+tighter than OR. The names are normalized like the tags of the photos; a name
+with spaces is quoted. The parsed query is a tree of tuples which fold
+evaluates with the operations of a bitset or of a SQL filter.
+"""
+
+import re
+
+from fastapi import HTTPException, status
+
+from src.conf import messages
+
+TOKEN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+OPERATORS = ("AND", "OR", "NOT")
+
+
+def invalid_query() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail=messages.INVALID_TAG_QUERY
+    )
+
+
+def _tokens(text: str) -> list[tuple[str, str]]:
+    tokens, position = [], 0
+    text = text.rstrip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if match is None:
+            raise invalid_query()
+        position = match.end()
+        opening, closing, quoted, word = match.groups()
+        if opening or closing:
+            tokens.append(("(" if opening else ")", ""))
+        elif word in OPERATORS:
+            tokens.append((word, ""))
+        else:
+            name = (quoted if quoted is not None else word).strip().lower()
+            if not name:
+                raise invalid_query()
+            tokens.append(("tag", name))
+    return tokens
+
+
+class _Parser:
+    def __init__(self, tokens: list[tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> str | None:
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self, kind: str) -> str:
+        if self.peek() != kind:
+            raise invalid_query()
+        self.position += 1
+        return self.tokens[self.position - 1][1]
+
+    def any(self):
+        node = self.all()
+        while self.peek() == "OR":
+            self.take("OR")
+            node = ("or", node, self.all())
+        return node
+
+    def all(self):
+        node = self.term()
+        while self.peek() in ("AND", "NOT", "tag", "("):
+            if self.peek() == "AND":
+                self.take("AND")
+            node = ("and", node, self.term())
+        return node
+
+    def term(self):
+        kind = self.peek()
+        if kind == "NOT":
+            self.take("NOT")
+            return ("not", self.term())
+        if kind == "(":
+            self.take("(")
+            node = self.any()
+            self.take(")")
+            return node
+        return ("tag", self.take("tag"))
+
+
+def parse_tag_query(text: str) -> tuple:
+    """
+    The parse_tag_query function parses a boolean query of tags.
+
+    :param text: str: The query
+    :return: The tree of the query
+    :raises HTTPException: 400 if the query is not valid
+    """
+    parser = _Parser(_tokens(text))
+    node = parser.any()
+    if parser.peek() is not None:
+        raise invalid_query()
+    return node
+
+
+def fold(node: tuple, tag, and_, or_, not_):
+    """
+    The fold function evaluates the tree of a query bottom up.
+
+    :param node: tuple: The tree made by parse_tag_query
+    :param tag: The value of a tag name
+    :param and_: The conjunction of two values
+    :param or_: The disjunction of two values
+    :param not_: The negation of a value
+    :return: The value of the query
+    """
+    kind = node[0]
+    if kind == "tag":
+        return tag(node[1])
+    if kind == "not":
+        return not_(fold(node[1], tag, and_, or_, not_))
+    left, right = (fold(child, tag, and_, or_, not_) for child in node[1:])
+    return and_(left, right) if kind == "and" else or_(left, right)
@@ -0,0 +1,83 @@
+"""
+Trigram similarity of words, computed the way pg_trgm does it.
+
+PostgreSQL finds the similar tags and descriptions with the pg_trgm GIN
+indexes; the index of this module serves the same fuzzy search on the other
+databases. It maps every trigram to the terms containing it, so the terms
+similar to a word are found from the postings of its few trigrams instead
+of comparing the word with every term.
+"""
+
+import re
+from collections import Counter, defaultdict
+
+WORD = re.compile(r"\w+")
+
+
+def trigrams(text: str) -> set[str]:
+    """
+    The trigrams function returns the trigrams of the words of the text; every
+    word is lowercased and padded with two spaces before and one after it.
+    """
+    result = set()
+    for word in WORD.findall(text.lower()):
+        padded = f"  {word} "
+        result.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    The similarity function returns the number of the shared trigrams of the
+    texts divided by the number of all their trigrams, from 0 to 1.
+    """
+    first, second = trigrams(a), trigrams(b)
+    if not first or not second:
+        return 0.0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+
+class TrigramIndex:
+    def __init__(self, terms=()):
+        self._terms: dict[str, set[str]] = {}
+        self._postings: dict[str, set[str]] = defaultdict(set)
+        for term in terms:
+            self.add(term)
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def add(self, term: str):
+        if term in self._terms:
+            return
+        self._terms[term] = trigrams(term)
+        for trigram in self._terms[term]:
+            self._postings[trigram].add(term)
+
+    def discard(self, term: str):
+        for trigram in self._terms.pop(term, ()):
+            self._postings[trigram].discard(term)
+            if not self._postings[trigram]:
+                del self._postings[trigram]
+
+    def similar(self, word: str, threshold: float, limit: int) -> list[tuple[str, float]]:
+        """
+        The similar function finds the terms similar to the word.
+
+        :param word: str: The searched word
+        :param threshold: float: Minimal similarity of a term
+        :param limit: int: Maximal number of terms
+        :return: Terms with their similarity, the most similar first
+        """
+        wanted = trigrams(word)
+        shared = Counter()
+        for trigram in wanted:
+            shared.update(self._postings.get(trigram, ()))
+        found = []
+        for term, count in shared.items():
+            score = count / (len(wanted) + len(self._terms[term]) - count)
+            if score >= threshold:
+                found.append((term, score))
+        found.sort(key=lambda item: (-item[1], item[0]))
+        return found[:limit]
@@ -0,0 +1,184 @@
+"""
+Validation of uploaded images before they are sent to the storage.
+
+The upload is read in chunks: reading stops as soon as the size limit is
+exceeded, and the type is checked by the magic bytes of the first chunk, so
+a bad file is rejected before any storage call or database write. The chunks
+are hashed while they are read, the hash finds re-posts of the same file.
+An image read with keep=False holds only its hash, its content is read again
+from the upload (spooled to disk by Starlette) when it is stored.
+
+Starlette receives a multipart body in full before the route runs, so the
+size of the whole request is bounded earlier by UploadSizeLimit: a body
+declaring a bigger Content-Length is refused before it is read, and a body
+sent without one is stopped as soon as it grows over the limit.
+"""
+
+import hashlib
+
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+
+from src.conf import messages
+from src.conf.constants import (
+    ALLOWED_PHOTO_EXTENSIONS,
+    PHOTO_MAX_SIZE,
+    UPLOAD_CHUNK_SIZE,
+)
+
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": ".jpg",
+    b"\x89PNG\r\n\x1a\n": ".png",
+    b"GIF87a": ".gif",
+    b"GIF89a": ".gif",
+    b"BM": ".bmp",
+    b"II*\x00": ".tiff",
+    b"MM\x00*": ".tiff",
+    b"8BPS": ".psd",
+}
+
+
+class UploadedImage:
+    def __init__(
+        self,
+        data: bytes,
+        extension: str,
+        filename: str | None = None,
+        content_hash: str | None = None,
+        file: UploadFile | None = None,
+        size: int | None = None,
+    ):
+        self.data = data
+        self.extension = extension
+        self.filename = filename
+        self.file = file
+        self.content_hash = content_hash or hashlib.sha256(data).hexdigest()
+        self._size = len(data) if data is not None else size
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def read(self) -> bytes:
+        if self.data is not None:
+            return self.data
+        await self.file.seek(0)
+        return await self.file.read()
+
+
+def guess_extension(head: bytes) -> str:
+    """
+    Guess the file extension from the first bytes of an image.
+
+    :param head: bytes: The first bytes of the file
+    :return: The extension with a leading dot or an empty string
+    """
+    for signature, extension in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return extension
+    return ""
+
+
+def wrong_size() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail=messages.WRONG_FILE_SIZE
+    )
+
+
+def wrong_type() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail=messages.WRONG_FILE_TYPE
+    )
+
+
+async def read_image(
+    file: UploadFile, max_size: int = PHOTO_MAX_SIZE, keep: bool = True
+) -> UploadedImage:
+    """
+    The read_image function reads an uploaded file and checks that it is a picture
+    no bigger than max_size. The declared size and extension are checked before reading,
+    the magic bytes are checked on the first chunk and the size is checked on every chunk.
+    The sha256 of the content is computed on the same pass.
+
+    :param file: UploadFile: The uploaded file
+    :param max_size: int: The maximum size of the file in bytes
+    :param keep: bool: Keep the content in memory, otherwise it is read again by UploadedImage.read
+    :return: The validated image
+    :raises HTTPException: 400 if the file is too big or is not a picture
+    """
+    if file.size is not None and file.size > max_size:
+        raise wrong_size()
+    if file.filename:
+        declared = file.filename.rsplit(".", 1)[-1].lower()
+        if declared not in ALLOWED_PHOTO_EXTENSIONS:
+            raise wrong_type()
+
+    chunks = []
+    received = 0
+    extension = ""
+    digest = hashlib.sha256()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        if not received:
+            extension = guess_extension(chunk)
+            if not extension:
+                raise wrong_type()
+        received += len(chunk)
+        if received > max_size:
+            raise wrong_size()
+        if keep:
+            chunks.append(chunk)
+        digest.update(chunk)
+
+    if not received:
+        raise wrong_type()
+    if not keep:
+        return UploadedImage(
+            None, extension, file.filename, digest.hexdigest(), file=file, size=received
+        )
+    return UploadedImage(
+        b"".join(chunks), extension, file.filename, digest.hexdigest()
+    )
+
+
+class UploadSizeLimit:
+    """
+    ASGI middleware which bounds the request bodies of the upload routes.
+
+    :param app: The wrapped application
+    :param limits: The maximum body size in bytes by (method, path) of a route
+    """
+
+    def __init__(self, app, limits: dict[tuple[str, str], int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = None
+        if scope["type"] == "http":
+            limit = self.limits.get((scope["method"], scope["path"]))
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            response = JSONResponse(
+                {"detail": messages.WRONG_FILE_SIZE},
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                # raised in the body parsing of the route, FastAPI answers it
+                if received > limit:
+                    raise wrong_size()
+            return message
+
+        await self.app(scope, limited_receive, send)
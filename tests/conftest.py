@@ -0,0 +1,143 @@
+"""
+Fakes and fixtures shared by the unit tests: an in-memory Redis for
+auth_service.cache and a test case with an in-memory SQLite database.
+"""
+
+import unittest
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.models.models import Base, Photo, User
+from src.services.auth import auth_service
+
+
+def _key(key):
+    return key.decode() if isinstance(key, bytes) else key
+
+
+def _bytes(value) -> bytes:
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class FakeRedis:
+    """
+    The commands of the sync Redis client used by the services, on dicts.
+    """
+
+    def __init__(self):
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        return self.data.get(_key(key))
+
+    def set(self, key, value, ex=None):
+        self.data[_key(key)] = _bytes(value)
+
+    def expire(self, key, ttl):
+        pass
+
+    def exists(self, *keys):
+        return sum(_key(key) in self.data for key in keys)
+
+    def delete(self, *keys):
+        return sum(self.data.pop(_key(key), None) is not None for key in keys)
+
+    def hset(self, key, mapping):
+        self.data.setdefault(_key(key), {}).update(
+            {_bytes(k): _bytes(v) for k, v in mapping.items()}
+        )
+
+    def hgetall(self, key):
+        return self.data.get(_key(key), {})
+
+    def sadd(self, key, *values):
+        self.data.setdefault(_key(key), set()).update(_bytes(value) for value in values)
+
+    def smembers(self, key):
+        return set(self.data.get(_key(key), set()))
+
+    def zincrby(self, key, amount, member):
+        board = self.data.setdefault(_key(key), {})
+        board[str(member)] = board.get(str(member), 0.0) + amount
+        return board[str(member)]
+
+    def zadd(self, key, mapping):
+        self.data.setdefault(_key(key), {}).update(
+            {str(member): float(score) for member, score in mapping.items()}
+        )
+
+    def zrem(self, key, *members):
+        board = self.data.get(_key(key), {})
+        for member in members:
+            board.pop(str(member), None)
+
+    def zrevrange(self, key, start, end, withscores=False):
+        board = sorted(self.data.get(_key(key), {}).items(), key=lambda item: -item[1])
+        return [(member.encode(), score) for member, score in board[start : end + 1]]
+
+
+class FakePipeline:
+    def __init__(self, client):
+        self.client = client
+        self.calls = []
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    def execute(self):
+        return [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.calls]
+
+
+@pytest.fixture()
+def fake_redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(auth_service, "cache", redis)
+    return redis
+
+
+class DatabaseTestCase(unittest.IsolatedAsyncioTestCase):
+    """
+    A test case with a new in-memory SQLite database with all tables in
+    self.session, and with a FakeRedis in self.redis and auth_service.cache
+    if fake_redis is set.
+    """
+
+    fake_redis = False
+
+    async def asyncSetUp(self):
+        if self.fake_redis:
+            self.redis = FakeRedis()
+            patcher = patch.object(auth_service, "cache", self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.engine = create_async_engine("sqlite+aiosqlite:///:memory:")
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def add_users(self, count: int = 1) -> list[User]:
+        users = [
+            User(username=f"user{i}", email=f"user{i}@test.com", password="qwerty")
+            for i in range(count)
+        ]
+        self.session.add_all(users)
+        await self.session.flush()
+        return users
+
+    async def add_photos(self, user: User, *descriptions: str) -> list[Photo]:
+        photos = [
+            Photo(path="p", public_photo_id="p", description=description, user_id=user.id)
+            for description in descriptions
+        ]
+        self.session.add_all(photos)
+        await self.session.flush()
+        return photos
@@ -0,0 +1,142 @@
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi import HTTPException
+
+from src.conf import messages
+from src.services.auth import auth_service
+from src.services.chunked_uploads import UploadSessions, upload_sessions
+from tests.conftest import FakeRedis
+
+PICTURE = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+
+
+async def stream(*parts: bytes):
+    for part in parts:
+        yield part
+
+
+class TestUploadSessions(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.sessions = UploadSessions(self.tmp.name, chunk_size=256, ttl=60)
+        self.patcher = patch.object(auth_service, "cache", FakeRedis())
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.tmp.cleanup()
+
+    async def send_all(self, upload_id, order):
+        for index in order:
+            offset = index * 256
+            await self.sessions.write_chunk(
+                upload_id, "user", offset, stream(PICTURE[offset : offset + 100], PICTURE[offset + 100 : offset + 256])
+            )
+
+    async def test_chunks_in_any_order(self):
+        state = self.sessions.create("user", "big.png", len(PICTURE), "photo", ["tag"])
+        self.assertEqual(state["missing"], [0, 1, 2, 3, 4])
+        await self.send_all(state["upload_id"], [4, 2, 0])
+        meta = self.sessions.get(state["upload_id"], "user")
+        self.assertEqual(self.sessions.status(state["upload_id"], meta)["missing"], [1, 3])
+
+        with self.assertRaises(HTTPException) as error:
+            await self.sessions.complete(state["upload_id"], "user")
+        self.assertEqual(error.exception.status_code, 409)
+
+        await self.send_all(state["upload_id"], [3, 1])
+        upload = await self.sessions.complete(state["upload_id"], "user")
+        with open(upload["path"], "rb") as staging:
+            self.assertEqual(staging.read(), PICTURE)
+        self.assertEqual(upload["tags"], ["tag"])
+        self.sessions.discard(state["upload_id"])
+
+    async def test_wrong_chunk(self):
+        state = self.sessions.create("user", "big.png", len(PICTURE), None, [])
+        for offset, body in ((10, b"x" * 256), (0, b"x" * 300), (0, b"x" * 10)):
+            with self.assertRaises(HTTPException) as error:
+                await self.sessions.write_chunk(state["upload_id"], "user", offset, stream(body))
+            self.assertEqual(error.exception.detail, messages.WRONG_CHUNK)
+        self.assertEqual(self.sessions.get(state["upload_id"], "user")["size"], len(PICTURE))
+
+    async def test_other_user(self):
+        state = self.sessions.create("user", "big.png", len(PICTURE), None, [])
+        with self.assertRaises(HTTPException) as error:
+            self.sessions.get(state["upload_id"], "other")
+        self.assertEqual(error.exception.status_code, 404)
+
+    def test_create_wrong_file(self):
+        with self.assertRaises(HTTPException):
+            self.sessions.create("user", "big.exe", 100, None, [])
+        with self.assertRaises(HTTPException):
+            self.sessions.create("user", "big.png", 0, None, [])
+
+    def test_reap_abandoned_staging_files(self):
+        live = self.sessions.create("user", "live.png", len(PICTURE), "photo", [])
+        idle = self.sessions.create("user", "idle.png", len(PICTURE), "photo", [])
+        (self.sessions.root / "fresh.part").write_bytes(b"")
+        (self.sessions.root / "orphan.part").write_bytes(b"")
+        past = time.time() - 30
+        os.utime(self.sessions.root / "orphan.part", (past, past))
+        os.utime(self.sessions._path(live["upload_id"]), (past, past))
+        past = time.time() - 120
+        os.utime(self.sessions._path(idle["upload_id"]), (past, past))
+
+        self.assertEqual(self.sessions.reap(grace=10), 2)
+        self.assertEqual(
+            sorted(path.stem for path in self.sessions.root.glob("*.part")),
+            sorted(["fresh", live["upload_id"]]),
+        )
+
+    async def test_not_a_picture(self):
+        state = self.sessions.create("user", "big.png", 256, None, [])
+        await self.sessions.write_chunk(state["upload_id"], "user", 0, stream(b"x" * 256))
+        with self.assertRaises(HTTPException) as error:
+            await self.sessions.complete(state["upload_id"], "user")
+        self.assertEqual(error.exception.detail, messages.WRONG_FILE_TYPE)
+
+
+def test_chunked_upload(client, get_token, monkeypatch, tmp_path, fake_redis):
+    monkeypatch.setattr(upload_sessions, "chunk_size", 512)
+    monkeypatch.setattr(upload_sessions, "root", tmp_path)
+    monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
+    monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
+    monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+    headers = {"Authorization": f"Bearer {get_token}"}
+    with patch("src.repository.photos.storage.upload_large") as upload_large:
+        upload_large.return_value = {"url": "http://test.com/big", "public_id": "test/big"}
+        response = client.post(
+            "/api/photos/uploads/",
+            headers=headers,
+            data={"filename": "big.png", "size": len(PICTURE), "tags": "big_tag"},
+        )
+        assert response.status_code == 201, response.text
+        upload_id = response.json()["upload_id"]
+        assert response.json()["missing"] == [0, 1, 2]
+
+        for offset in (1024, 0):
+            response = client.put(
+                f"/api/photos/uploads/{upload_id}",
+                params={"offset": offset},
+                headers=headers,
+                content=PICTURE[offset : offset + 512],
+            )
+            assert response.status_code == 200, response.text
+        response = client.get(f"/api/photos/uploads/{upload_id}", headers=headers)
+        assert response.json()["missing"] == [1]
+
+        response = client.put(
+            f"/api/photos/uploads/{upload_id}",
+            params={"offset": 512},
+            headers=headers,
+            content=PICTURE[512:1024],
+        )
+        response = client.post(f"/api/photos/uploads/{upload_id}/complete", headers=headers)
+        assert response.status_code == 201, response.text
+        assert response.json()["success message"] == messages.PHOTO_SUCCESSFULLY_ADDED
+        upload_large.assert_called_once()
+        assert not list(tmp_path.iterdir())
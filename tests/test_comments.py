@@ -66,11 +66,11 @@ class TestAsyncComment(unittest.IsolatedAsyncioTestCase):
             CommentSchema(opinion="Test comment one"),
             CommentSchema(opinion="Test comment two"),
         ]
-        comments = MagicMock()
-        comments.scalars.return_value.all.return_value = comments
-        self.session.execute.return_value = comments
-        result = await get_all_comment_for_photo(self.photo_id, self.session)
-        self.assertEqual(result, comments)
+        mocked_comments = MagicMock()
+        mocked_comments.all.return_value = [(comment, None, None) for comment in comments]
+        self.session.execute.return_value = mocked_comments
+        result = await get_all_comment_for_photo(self.photo_id, 10, None, self.session)
+        self.assertEqual(result, {"items": comments, "next_cursor": None})
 
     async def test_edit_comment(self):
         body = CommentUpdateSchema(opinion="Test comment")
@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from fastapi import HTTPException
+
+from src.conf import messages
+from src.conf.constants import JobStatus
+from src.services.auth import auth_service
+from src.services.jobs import JobQueue
+
+
+@asynccontextmanager
+async def fake_session():
+    yield AsyncMock()
+
+
+class TestJobQueue(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.patcher = patch("src.services.jobs.sessionmanager")
+        self.sessionmanager = self.patcher.start()
+        self.sessionmanager.session = MagicMock(side_effect=fake_session)
+        self.queue = JobQueue(workers=2, max_size=2)
+
+    async def asyncTearDown(self):
+        await self.queue.stop()
+        self.patcher.stop()
+
+    async def wait(self, job):
+        for _ in range(100):
+            if job.status in (JobStatus.done, JobStatus.failed):
+                return
+            await asyncio.sleep(0.01)
+
+    async def test_job_done(self):
+        job = self.queue.submit("change_photo", AsyncMock(return_value={"url": "x"}))
+        self.assertEqual(job.status, JobStatus.queued)
+        await self.wait(job)
+        self.assertEqual(job.status, JobStatus.done)
+        self.assertEqual(job.result, {"url": "x"})
+        self.assertIsNotNone(job.finished_at)
+        self.assertIs(self.queue.get(job.id), job)
+
+    async def test_job_failed_with_http_error(self):
+        task = AsyncMock(side_effect=HTTPException(400, detail=messages.PHOTO_NOT_FOUND))
+        job = self.queue.submit("make_avatar", task)
+        await self.wait(job)
+        self.assertEqual(job.status, JobStatus.failed)
+        self.assertEqual(job.error, messages.PHOTO_NOT_FOUND)
+
+    async def test_job_failed_with_unexpected_error(self):
+        job = self.queue.submit("make_avatar", AsyncMock(side_effect=RuntimeError))
+        await self.wait(job)
+        self.assertEqual(job.status, JobStatus.failed)
+        self.assertEqual(job.error, messages.SOMETHING_WRONG)
+
+    async def test_queue_full(self):
+        blocker = asyncio.Event()
+
+        async def task(db):
+            await blocker.wait()
+            return {}
+
+        for _ in range(2):
+            self.queue.submit("change_photo", task)
+        await asyncio.sleep(0.01)
+        for _ in range(2):
+            self.queue.submit("change_photo", task)
+        with self.assertRaises(HTTPException) as error:
+            self.queue.submit("change_photo", task)
+        self.assertEqual(error.exception.status_code, 503)
+        blocker.set()
+
+    def test_get_unknown_job(self):
+        self.assertIsNone(self.queue.get("unknown"))
+
+
+def test_get_unknown_transform_job(client, get_token, monkeypatch):
+    with patch.object(auth_service, "cache") as redis_mock:
+        redis_mock.get.return_value = None
+        headers = {"Authorization": f"Bearer {get_token}"}
+        response = client.get("/api/photos/jobs/unknown", headers=headers)
+        assert response.status_code == 404, response.text
+        assert response.json()["detail"] == messages.JOB_NOT_FOUND
@@ -0,0 +1,111 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from redis import RedisError
+from sqlalchemy import select, update
+
+from src.conf.constants import LeaderboardWindow
+from src.models.models import Photo, Rating
+from src.repository.photos import get_top_photos
+from src.repository.ratings import create_rating, delete_rating
+from src.services.leaderboard import bayesian_score, leaderboard, record_rating, window_start
+from tests.conftest import DatabaseTestCase
+
+
+class TestBayesianScore(unittest.TestCase):
+    def test_few_ratings_are_pulled_to_the_prior(self):
+        self.assertLess(bayesian_score(2 * 5, 2), bayesian_score(50 * 4.5, 50))
+        self.assertEqual(bayesian_score(0, 0), 3.0)
+
+    def test_window_start(self):
+        moment = datetime(2026, 10, 18, 15, 30)  # a Sunday
+        self.assertEqual(window_start(LeaderboardWindow.day, moment), datetime(2026, 10, 18))
+        self.assertEqual(window_start(LeaderboardWindow.week, moment), datetime(2026, 10, 12))
+        self.assertIsNone(window_start(LeaderboardWindow.all, moment))
+
+
+class TestLeaderboard(DatabaseTestCase):
+    fake_redis = True
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.users = await self.add_users(3)
+        self.photos = await self.add_photos(self.users[0], "d", "d", "d")
+        await self.session.commit()
+
+    async def top(self, window=LeaderboardWindow.all):
+        board = await leaderboard.top(window, 10, self.session)
+        return [(self.ids.index(photo_id), round(score, 3)) for photo_id, score in board]
+
+    @property
+    def ids(self):
+        return [photo.id for photo in self.photos]
+
+    async def rate(self, photo, user, value):
+        return await create_rating(value, self.photos[photo].id, self.users[user].id, self.session)
+
+    async def test_ratings_update_the_boards(self):
+        await self.rate(0, 1, 5)
+        await self.rate(0, 2, 5)
+        first = await self.rate(1, 1, 4)
+        expected = [(0, round(bayesian_score(10, 2), 3)), (1, round(bayesian_score(4, 1), 3))]
+        for window in LeaderboardWindow:
+            self.assertEqual(await self.top(window), expected)
+
+        await delete_rating(first.id, self.session)
+        self.assertEqual(await self.top(), expected[:1])
+        self.assertEqual(self.redis.data[f"{leaderboard.key(LeaderboardWindow.all, datetime.now())}:count"],
+                         {str(self.photos[0].id): 2.0})
+
+    async def test_deleted_old_rating_is_only_on_the_board_of_all_time(self):
+        rating = await self.rate(2, 1, 2)
+        await self.session.execute(
+            update(Rating).filter_by(id=rating.id).values(created_at=datetime.now() - timedelta(days=30))
+        )
+        await self.session.commit()
+        await leaderboard.rebuild(self.session)
+        self.assertEqual(await self.top(LeaderboardWindow.day), [])
+        self.assertEqual(await self.top(), [(2, round(bayesian_score(2, 1), 3))])
+
+        await delete_rating(rating.id, self.session)
+        self.assertEqual(await self.top(), [])
+        self.assertEqual(await self.top(LeaderboardWindow.day), [])
+        day = leaderboard.key(LeaderboardWindow.day, datetime.now())
+        self.assertNotIn(f"{day}:count", self.redis.data)
+
+    async def test_rebuild_matches_the_incremental_boards(self):
+        await self.rate(0, 1, 3)
+        await self.rate(1, 1, 5)
+        await self.rate(1, 2, 1)
+        incremental = {key: dict(board) for key, board in self.redis.data.items()}
+        self.redis.data.clear()
+        self.assertEqual(await leaderboard.rebuild(self.session), 6)
+        self.assertEqual(self.redis.data.keys(), incremental.keys())
+        for key, board in incremental.items():
+            for member, score in board.items():
+                self.assertAlmostEqual(self.redis.data[key][member], score)
+
+    async def test_rollback_is_not_counted(self):
+        await self.session.execute(select(Photo.id))
+        record_rating(self.session, self.photos[1].id, 5, None)
+        await self.session.rollback()
+        await self.session.commit()
+        self.assertEqual(self.redis.data, {})
+
+    async def test_top_falls_back_to_the_database(self):
+        await self.rate(0, 1, 2)
+        await self.rate(1, 1, 4)
+        with patch.object(self.redis, "zrevrange", side_effect=RedisError("down")):
+            self.assertEqual(
+                await self.top(),
+                [(1, round(bayesian_score(4, 1), 3)), (0, round(bayesian_score(2, 1), 3))],
+            )
+
+    async def test_get_top_photos_skips_deleted_photos(self):
+        await self.rate(0, 1, 2)
+        await self.rate(1, 1, 4)
+        await self.session.delete(self.photos[1])
+        await self.session.commit()
+        top = await get_top_photos(LeaderboardWindow.week, 10, self.session)
+        self.assertEqual([item["photo"].id for item in top], [self.photos[0].id])
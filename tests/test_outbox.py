@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import select
+
+from src.conf.constants import QrFormat
+from src.models.models import AssetDeletion, Photo, PhotoAsset
+from src.repository.photos import delete_photo
+from src.services.outbox import (
+    AssetReaper,
+    cancel_deletions,
+    enqueue_deletions,
+    record_assets,
+    referenced_assets,
+)
+from src.services.qr_code import qr_public_id, uploaded_qr_codes
+from tests.conftest import DatabaseTestCase
+
+
+class TestAssetReaper(DatabaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.reaper = AssetReaper(interval=10, batch_size=2)
+
+    async def outbox(self):
+        result = await self.session.execute(select(AssetDeletion).order_by(AssetDeletion.id))
+        return result.scalars().all()
+
+    async def test_drain_in_batches(self):
+        enqueue_deletions(self.session, ["photo/1", "Qr_Code/1", "photo/1", "photo/2"])
+        await self.session.commit()
+        self.assertEqual(len(await self.outbox()), 3)
+
+        with patch("src.services.outbox.storage") as storage:
+            storage.destroy_many = AsyncMock(side_effect=lambda ids: set(ids))
+            self.assertEqual(await self.reaper.drain(self.session), 2)
+            self.assertEqual(await self.reaper.drain(self.session), 1)
+            self.assertEqual(await self.reaper.drain(self.session), 0)
+        self.assertEqual(storage.destroy_many.await_args_list[0].args[0], ["photo/1", "Qr_Code/1"])
+        self.assertEqual(await self.outbox(), [])
+
+    async def test_retry_later(self):
+        enqueue_deletions(self.session, ["photo/1", "photo/2"])
+        await self.session.commit()
+
+        with patch("src.services.outbox.storage") as storage:
+            storage.destroy_many = AsyncMock(return_value={"photo/2"})
+            await self.reaper.drain(self.session)
+            left = await self.outbox()
+            self.assertEqual([item.public_id for item in left], ["photo/1"])
+            self.assertEqual(left[0].attempts, 1)
+            self.assertGreater(left[0].next_attempt_at, datetime.now() + timedelta(seconds=10))
+            # not due yet
+            self.assertEqual(await self.reaper.drain(self.session), 0)
+
+            storage.destroy_many = AsyncMock(side_effect=ConnectionError("down"))
+            left[0].next_attempt_at = datetime.now()
+            await self.session.commit()
+            await self.reaper.drain(self.session)
+        left = await self.outbox()
+        self.assertEqual(left[0].attempts, 2)
+        self.assertEqual(left[0].last_error, "down")
+
+    async def test_referenced_again_is_not_deleted(self):
+        qr_code = qr_public_id("http://test.com/photo/1/w_100", QrFormat.svg)
+        uploaded_qr_codes.set(qr_code, "http://test.com/qr")
+        enqueue_deletions(self.session, ["photo/1", qr_code, "photo/2"])
+        await self.session.commit()
+        self.assertIsNone(uploaded_qr_codes.get(qr_code))
+        # a re-post of the same file uses photo/1 again
+        [user] = await self.add_users()
+        self.session.add(
+            Photo(path="p", public_photo_id="photo/1", description="d", user_id=user.id,
+                  path_transform="http://test.com/photo/1/w_100")
+        )
+        await self.session.commit()
+
+        self.reaper.batch_size = 10
+        with patch("src.services.outbox.storage") as storage:
+            storage.destroy_many = AsyncMock(side_effect=lambda ids: set(ids))
+            self.assertEqual(await self.reaper.drain(self.session), 3)
+        storage.destroy_many.assert_awaited_once_with(["photo/2"])
+        self.assertEqual(await self.outbox(), [])
+
+    async def test_cancel_deletions(self):
+        enqueue_deletions(self.session, ["Qr_Code/1", "photo/1"])
+        await self.session.commit()
+        await cancel_deletions(self.session, ["Qr_Code/1"])
+        await self.session.commit()
+        self.assertEqual([item.public_id for item in await self.outbox()], ["photo/1"])
+
+    async def test_assets_of_a_deleted_photo(self):
+        [user] = await self.add_users()
+        photo, other = await self.add_photos(user, "d", "e")
+        photo.public_photo_id, other.public_photo_id = "photo/1", "photo/2"
+        # built by other workers, none of them is in the cache of this one
+        await record_assets(self.session, photo.id, ["Qr_Code/1", "Avatars/photo/1", "Qr_Code/1"])
+        await record_assets(self.session, other.id, ["Qr_Code/2"])
+        await record_assets(self.session, 1000, ["Qr_Code/3"])
+        await self.session.commit()
+        result = await self.session.execute(select(PhotoAsset.public_id).order_by(PhotoAsset.id))
+        self.assertEqual(result.scalars().all(), ["Qr_Code/1", "Avatars/photo/1", "Qr_Code/2"])
+
+        self.assertTrue(await delete_photo(photo.id, user, self.session))
+        self.assertEqual(
+            [item.public_id for item in await self.outbox()],
+            ["photo/1", "Qr_Code/1", "Avatars/photo/1"],
+        )
+        self.assertEqual(
+            await referenced_assets(self.session, ["Qr_Code/1", "Qr_Code/2"]), {"Qr_Code/2"}
+        )
+
+    def test_backoff_is_capped(self):
+        self.assertEqual(self.reaper.backoff(1), timedelta(seconds=20))
+        self.assertEqual(self.reaper.backoff(30), timedelta(hours=6))
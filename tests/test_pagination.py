@@ -0,0 +1,75 @@
+import unittest
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from src.models.models import User
+from src.services.pagination import Keyset
+from tests.conftest import DatabaseTestCase
+
+
+class TestKeyset(DatabaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.created_at = datetime(2024, 1, 1)
+        # two users share the time, the id decides their order
+        self.users = [
+            User(
+                username=f"user{i}",
+                email=f"user{i}@test.com",
+                password="qwerty",
+                created_at=self.created_at + timedelta(minutes=i // 2),
+            )
+            for i in range(5)
+        ]
+        self.session.add_all(self.users)
+        await self.session.commit()
+        self.keyset = Keyset(User.created_at, User.id)
+        self.ordered = [
+            user.username for user in sorted(self.users, key=lambda u: (u.created_at, str(u.id)))
+        ]
+
+    async def read(self, cursor, limit=2):
+        result = await self.session.execute(
+            self.keyset.apply(select(User), cursor, limit)
+        )
+        return self.keyset.page(result, limit)
+
+    async def test_pages_follow_the_cursor(self):
+        names, cursor = [], None
+        while True:
+            page = await self.read(cursor)
+            names.append([user.username for user in page["items"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(names, [self.ordered[0:2], self.ordered[2:4], self.ordered[4:]])
+
+    async def test_inserted_rows_do_not_shift_the_pages(self):
+        page = await self.read(None)
+        self.session.add(
+            User(username="early", email="early@test.com", password="qwerty",
+                 created_at=self.created_at - timedelta(days=1))
+        )
+        await self.session.commit()
+        page = await self.read(page["next_cursor"])
+        self.assertEqual([user.username for user in page["items"]], self.ordered[2:4])
+
+    async def test_descending(self):
+        keyset = Keyset(User.created_at, User.id, descending=True)
+        result = await self.session.execute(keyset.apply(select(User), None, 3))
+        page = keyset.page(result, 3)
+        result = await self.session.execute(keyset.apply(select(User), page["next_cursor"], 3))
+        names = [user.username for user in (*page["items"], *keyset.page(result, 3)["items"])]
+        self.assertEqual(names, self.ordered[::-1])
+
+    def test_invalid_cursor(self):
+        for cursor in ["not a cursor", self.keyset.encode([1]), Keyset(User.id).encode(["x"])]:
+            with self.assertRaises(HTTPException) as e:
+                self.keyset.decode(cursor)
+            self.assertEqual(e.exception.status_code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,10 +3,11 @@ from pathlib import Path
 from unittest.mock import AsyncMock, Mock, MagicMock, patch
 
 import pytest
+from fastapi import HTTPException
 from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.models.models import User, Photo
+from src.models.models import User, Photo, Tag
 from src.schemas.photos import PhotosSchema, PhotosResponse, RatingSchema
 from src.conf.messages import (
     PHOTO_SUCCESSFULLY_ADDED,
@@ -30,6 +31,8 @@ from src.repository.photos import (
     search_photos,
     search_photos_by_filter,
 )
+from src.conf.constants import QrFormat
+from src.services.renditions import forget_photo, renditions
 
 
 class TestPhotos(unittest.IsolatedAsyncioTestCase):
@@ -48,16 +51,17 @@ class TestPhotos(unittest.IsolatedAsyncioTestCase):
             path="tests/test.jpg",
             description="test",
             user_id=User.id,
+            public_photo_id="test/1",
             # tags=["test", "test2"],
         )
 
     async def test_get_all_photos(self):
         photos = [Photo(), Photo(), Photo()]
         mocked_photos = MagicMock()
-        mocked_photos.scalars.return_value.all.return_value = photos
+        mocked_photos.all.return_value = [(photo, None, None) for photo in photos]
         self.session.execute.return_value = mocked_photos
-        result = await get_all_photos(0, 10, self.session)
-        self.assertEqual(result, photos)
+        result = await get_all_photos(None, 10, self.session)
+        self.assertEqual(result, {"items": photos, "next_cursor": None})
 
     async def test_get_or_create_tag(self):
         tag = "test"
@@ -83,14 +87,22 @@ class TestPhotos(unittest.IsolatedAsyncioTestCase):
         result = await assembling_tags(tags, self.session)
         self.assertTrue(result)
 
-    async def test_get_QR_code(self):
-        photo_id = 1
-        mocked_photo = MagicMock()
-        mocked_path = MagicMock()
-        mocked_photo.first.return_value = self.photo
-        self.session.execute.return_value = mocked_photo
-        result = await get_QR_code(mocked_path, photo_id, self.session)
+    @patch("cloudinary.uploader.upload")
+    async def test_get_QR_code(self, patch):
+        patch.return_value = {
+            "url": "http://test.com/qr",
+            "secure_url": "https://test.com/qr",
+            "public_id": "Qr_Code/qr",
+        }
+        path = "https://test.com/photos/test_get_QR_code"
+        result = await get_QR_code(path, self.session)
         self.assertEqual(type(result), type(str()))
+        self.assertEqual(await get_QR_code(path, self.session), result)
+        patch.assert_called_once()
+        self.assertEqual(patch.call_args.kwargs["format"], "png")
+        # the caller commits the cancelled deletion with its own transaction
+        self.session.execute.assert_called_once()
+        self.session.commit.assert_not_called()
 
     async def test_get_photo_by_id(self):
         photo_id = 1
@@ -105,24 +117,40 @@ class TestPhotos(unittest.IsolatedAsyncioTestCase):
         tags = ["tag1", "tag2"]
         mocked_user = MagicMock()
         mocked_user.username = self.user.username
-        mocked_user.first.return_value = self.user
+        mocked_user.first.return_value = None
         mocked_photo = MagicMock()
         self.session.execute.return_value = mocked_user
         result = await create_photo(
             mocked_photo, self.photo.description, mocked_user.id, self.session, tags
         )
         self.assertEqual(result["success message"], PHOTO_SUCCESSFULLY_ADDED)
+        patch.assert_called_once()
+
+    @patch("cloudinary.uploader.upload")
+    async def test_create_photo_same_content(self, patch):
+        mocked_result = MagicMock()
+        mocked_result.first.return_value = ("https://test.com/1", "test/1")
+        self.session.execute.return_value = mocked_result
+        result = await create_photo(
+            MagicMock(), self.photo.description, self.user, self.session, ["tag1"]
+        )
+        self.assertEqual(result["success message"], PHOTO_SUCCESSFULLY_ADDED)
+        patch.assert_not_called()
+        new_photo = self.session.add.call_args.args[0]
+        self.assertEqual(new_photo.path, "https://test.com/1")
+        self.assertEqual(new_photo.public_photo_id, "test/1")
 
     # failed
     async def test_add_tag_to_photo(self):
         tag = "tag5"
-        mocked_photo = MagicMock()
-        mocked_photo.id = 1
-        mocked_photo.tags = ["tag1", "tag2"]
-        mocked_photo.first.return_value = self.photo
-        self.session.execute.return_value = mocked_photo
-        result = await add_tag_to_photo(mocked_photo.id, tag, self.session)
+        mocked_tags = MagicMock()
+        mocked_tags.scalars.return_value = [Tag(id=5, name=tag)]
+        mocked_links = MagicMock()
+        mocked_links.scalars.return_value.all.return_value = [5]
+        self.session.execute.side_effect = [mocked_tags, mocked_links]
+        result = await add_tag_to_photo(self.photo.id, tag, self.session)
         self.assertEqual(result["success message"], TAG_SUCCESSFULLY_ADDED)
+        self.assertEqual(result["added"], [tag])
 
     async def test_edit_photo_description(self):
         description = "test_test"
@@ -145,51 +173,143 @@ class TestPhotos(unittest.IsolatedAsyncioTestCase):
 
     async def test_del_photo_tag(self):
         tag_for_del = "test"
-        mocked_photo = MagicMock()
-        mocked_photo.first.return_value = self.photo
-        self.session.execute.return_value = mocked_photo
+        mocked_links = MagicMock()
+        mocked_links.all.return_value = [(1, tag_for_del)]
+        self.session.execute.return_value = mocked_links
         result = await del_photo_tag(self.photo.id, tag_for_del, self.session)
-        self.assertTrue(result)
+        self.assertEqual(result["removed"], [tag_for_del])
 
     @patch("cloudinary.uploader.upload")
     async def test_change_photo(self, patch):
+        patch.return_value = {
+            "url": "http://test.com/1",
+            "secure_url": "https://test.com/1",
+            "public_id": "test/1",
+        }
         mocked_photo = MagicMock()
         mocked_photo.id = 1
         mocked_photo.first.return_value = self.photo
+        mocked_photo.scalar_one_or_none.return_value = self.photo
         self.session.execute.return_value = mocked_photo
         result = await change_photo(
             self.user, mocked_photo.id, self.session, 100, 150, "fill", "art"
         )
         self.assertTrue(result)
 
+    @patch("cloudinary.uploader.upload")
+    async def test_change_photo_derived_url_cached(self, patch):
+        patch.return_value = {
+            "url": "http://test.com/qr",
+            "secure_url": "https://test.com/qr",
+            "public_id": "test/qr",
+        }
+        mocked_photo = MagicMock()
+        mocked_photo.scalar_one_or_none.return_value = self.photo
+        self.session.execute.return_value = mocked_photo
+        first = await change_photo(
+            self.user, 101, self.session, 100, 150, "fill", "sepia"
+        )
+        self.assertIn("test/1", first["transformed_url"])
+        self.assertIn("w_100", first["transformed_url"])
+        calls = self.session.execute.await_count
+        commits = self.session.commit.await_count
+        # the photo already has the cached rendition
+        mocked_photo.first.return_value = MagicMock(path_transform=first["transformed_url"])
+        second = await change_photo(
+            self.user, 101, self.session, 100, 150, "fill", "sepia"
+        )
+        self.assertEqual(first, second)
+        # only the path_transform is read, nothing is written
+        self.assertEqual(self.session.execute.await_count, calls + 1)
+        self.assertEqual(self.session.commit.await_count, commits)
+        # the photo has another rendition, it is set back to this one
+        mocked_photo.first.return_value = MagicMock(path_transform="https://test.com/other")
+        await change_photo(self.user, 101, self.session, 100, 150, "fill", "sepia")
+        self.assertEqual(self.session.execute.await_count, calls + 3)
+        self.assertEqual(self.session.commit.await_count, commits + 1)
+        # only the QR code was uploaded
+        patch.assert_called_once()
+        forget_photo(101)
+        self.assertIsNone(
+            renditions.get(("change", 101, 100, 150, "fill", "sepia", QrFormat.png))
+        )
+
+    @patch("cloudinary.uploader.upload")
+    async def test_change_photo_deleted_elsewhere(self, patch):
+        patch.return_value = {
+            "url": "http://test.com/qr",
+            "secure_url": "https://test.com/qr",
+            "public_id": "test/qr",
+        }
+        mocked_photo = MagicMock()
+        mocked_photo.scalar_one_or_none.return_value = self.photo
+        self.session.execute.return_value = mocked_photo
+        await change_photo(self.user, 102, self.session, 120, 180, "fill", "sepia")
+        key = ("change", 102, 120, 180, "fill", "sepia", QrFormat.png)
+        self.assertIsNotNone(renditions.get(key))
+        # the rendition is cached, but the photo is not found
+        mocked_photo.first.return_value = None
+        with self.assertRaises(HTTPException) as error:
+            await change_photo(self.user, 102, self.session, 120, 180, "fill", "sepia")
+        self.assertEqual(error.exception.status_code, 404)
+        self.assertIsNone(renditions.get(key))
+
     @patch("cloudinary.uploader.upload")
     async def test_make_avatar_from_photo(self, patch):
+        patch.return_value = {
+            "url": "http://test.com/1",
+            "secure_url": "https://test.com/1",
+            "public_id": "test/1",
+        }
         mocked_photo = MagicMock()
         mocked_photo.first.return_value = self.photo
+        mocked_photo.scalar_one_or_none.return_value = self.photo
         self.session.execute.return_value = mocked_photo
         result = await make_avatar_from_photo(
             self.user, self.photo.id, "art", self.session
         )
         self.assertTrue(result)
 
+    @patch("cloudinary.uploader.upload")
+    async def test_make_avatar_deleted_elsewhere(self, patch):
+        patch.return_value = {
+            "url": "http://test.com/1",
+            "secure_url": "https://test.com/1",
+            "public_id": "test/1",
+        }
+        mocked_photo = MagicMock()
+        mocked_photo.scalar_one_or_none.return_value = self.photo
+        self.session.execute.return_value = mocked_photo
+        first = await make_avatar_from_photo(self.user, 103, "art", self.session)
+        key = ("avatar", 103, "art", QrFormat.png)
+        self.assertIsNotNone(renditions.get(key))
+        self.assertEqual(
+            await make_avatar_from_photo(self.user, 103, "art", self.session), first
+        )
+        # the rendition is cached, but the photo is not found
+        self.session.scalar.return_value = None
+        with self.assertRaises(HTTPException) as error:
+            await make_avatar_from_photo(self.user, 103, "art", self.session)
+        self.assertEqual(error.exception.status_code, 404)
+        self.assertIsNone(renditions.get(key))
+
     async def test_search_photos(self):
         photos = [Photo(), Photo(), Photo()]
         mocked_photos = MagicMock()
-        mocked_photos.scalars.return_value.all.return_value = photos
+        mocked_photos.all.return_value = [(photo, None) for photo in photos]
         self.session.execute.return_value = mocked_photos
-        result = await search_photos("test", 10, 0, self.session, self.user)
-        self.assertTrue(result)
-        self.assertEqual(type(result), type(list()))
+        result = await search_photos("test", 10, None, self.session, self.user)
+        self.assertEqual(result["items"], photos)
 
     async def test_search_photos_by_filter(self):
         photos = [Photo(), Photo(), Photo()]
         mocked_photos = MagicMock()
-        mocked_photos.scalars.return_value.all.return_value = photos
+        mocked_photos.all.return_value = [(photo, None) for photo in photos]
         self.session.execute.return_value = mocked_photos
         result = await search_photos_by_filter(
-            "test", 0, 5, 10, 0, self.session, self.user
+            "test", 0, 5, 10, None, self.session, self.user
         )
-        self.assertTrue(result)
+        self.assertEqual(result["items"], photos)
 
     def test_check_tags_quantity_error(self):
         tags = ["test", "test2", "test3", "test4", "test5", "test6"]
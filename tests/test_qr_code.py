@@ -0,0 +1,40 @@
+import unittest
+
+from src.conf.constants import QrFormat
+from src.services.cache import LRUCache
+from src.services.qr_code import make_qr_code, qr_public_id, render_qr_code
+
+
+class TestQrCode(unittest.IsolatedAsyncioTestCase):
+    async def test_make_png(self):
+        image = await make_qr_code("https://test.com/1")
+        self.assertTrue(image.startswith(b"\x89PNG"))
+
+    async def test_make_svg(self):
+        image = await make_qr_code("https://test.com/1", QrFormat.svg)
+        self.assertIn(b"<svg", image)
+
+    def test_render_is_cached(self):
+        render_qr_code.cache_clear()
+        first = render_qr_code("https://test.com/2")
+        second = render_qr_code("https://test.com/2")
+        self.assertIs(first, second)
+        self.assertEqual(render_qr_code.cache_info().hits, 1)
+        render_qr_code("https://test.com/2", box_size=5)
+        self.assertEqual(render_qr_code.cache_info().misses, 2)
+
+    def test_public_id(self):
+        self.assertEqual(qr_public_id("a"), qr_public_id("a"))
+        self.assertNotEqual(qr_public_id("a"), qr_public_id("b"))
+        self.assertNotEqual(qr_public_id("a"), qr_public_id("a", QrFormat.svg))
+        self.assertTrue(qr_public_id("a").startswith("Qr_Code/"))
+
+    def test_lru_cache(self):
+        urls = LRUCache(max_size=2)
+        urls.set("a", "url_a")
+        urls.set("b", "url_b")
+        urls.get("a")
+        urls.set("c", "url_c")
+        self.assertEqual(urls.get("a"), "url_a")
+        self.assertIsNone(urls.get("b"))
+        self.assertEqual(urls.get("c"), "url_c")
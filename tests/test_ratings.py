@@ -6,8 +6,14 @@ from unittest.mock import patch, MagicMock
 from src.schemas.photos import RatingSchema, RatingResponseSchema, RatingAVGResponseSchema
 from src.repository.ratings import create_rating, get_user_rating_for_photo, get_avg_rating, get_rating, delete_rating
 
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.models.models import Photo, Rating, Role, User
+from src.repository.users import delete_user
+from tests.conftest import DatabaseTestCase
+
 
 class TestAsyncRating(unittest.IsolatedAsyncioTestCase):
     def setUp(self):
@@ -20,34 +26,32 @@ class TestAsyncRating(unittest.IsolatedAsyncioTestCase):
         self.avgrating: float = 4.56
 
     async def test_create_rating(self):
-        with patch(
-                'src.repository.ratings.create_rating') as mocked_create_rating:
-            result = await create_rating(self.rating, self.photo_id, self.user_id, self.session)
-
-        # mocked_create_rating.assert_called_once_with(self.rating, self.photo_id, self.user_id, self.session)
-
-        # self.assertIsInstance(result, RatingResponseSchema)
-        # self.assertEquals(result.rating, self.rating)
-        # self.assertEquals(result.user_id, self.user_id)
-        # self.assertEquals(result.id, self.id)
-        self.session.commit.assert_called()
-        self.session.refresh.assert_called()
+        self.session.get_bind = MagicMock()
+        self.session.get_bind.return_value.dialect.name = "postgresql"
+        created = MagicMock()
+        self.session.scalars.return_value.one_or_none = MagicMock(return_value=created)
+        result = await create_rating(self.rating, self.photo_id, self.user_id, self.session)
+
+        self.assertEqual(result, created)
+        stmt = str(self.session.scalars.call_args.args[0].compile(dialect=postgresql.dialect()))
+        self.assertIn("INSERT INTO ratings (rating, photo_id, user_id", stmt)
+        self.assertIn("photos.user_id != ", stmt)
+        self.assertIn("ON CONFLICT DO NOTHING RETURNING", stmt)
+        self.session.execute.assert_called_once()
         self.session.commit.assert_called_once()
-        self.session.refresh.assert_called_once()
+        self.session.refresh.assert_called_once_with(created)
 
     async def test_create_rating_alternative(self):
         body = RatingSchema(rating=4)
-        photo_id = 1
-        user_id = "a9b6a9b6-a9b6-a9b6-a9b6-a9b6a9b6a9b6"
-        session = MagicMock(spec=AsyncSession)
-
-        with patch('src.repository.ratings.Rating', return_value=MagicMock()) as mock_rating:
-            result = await create_rating(body.rating, photo_id, user_id, session)
+        self.session.get_bind = MagicMock()
+        self.session.get_bind.return_value.dialect.name = "postgresql"
+        self.session.scalars.return_value.one_or_none = MagicMock(return_value=None)
+        result = await create_rating(body.rating, self.photo_id, self.user_id, self.session)
 
-            mock_rating.assert_called_once_with(rating=body.rating, photo_id=photo_id, user_id=user_id)
-            session.add.assert_called_once_with(mock_rating.return_value)
-            session.commit.assert_called_once()
-            session.refresh.assert_called_once_with(mock_rating.return_value)
+        # the photo does not exist, is the user's own or is rated by the user already
+        self.assertIsNone(result)
+        self.session.execute.assert_not_called()
+        self.session.commit.assert_not_called()
 
     async def test_get_user_rating_for_photo(self):
         expected_rating = RatingResponseSchema(id=self.id, photo_id=self.photo_id, user_id=self.user_id, rating=4)
@@ -79,8 +83,8 @@ class TestAsyncRating(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result, expected_rating)
 
     async def test_delete_rating(self):
-        expected_rating = RatingResponseSchema(id=self.id, photo_id=self.photo_id, user_id=self.user_id,
-                                               rating=self.rating)
+        expected_rating = Rating(id=self.id, photo_id=self.photo_id, user_id=self.user_id,
+                                 rating=self.rating)
         mocked_rating = MagicMock()
         mocked_rating.scalar_one_or_none.return_value = expected_rating
         self.session.execute.return_value = mocked_rating
@@ -113,3 +117,50 @@ class TestAsyncRating(unittest.IsolatedAsyncioTestCase):
         self.session.execute.return_value.scalar_one_or_none.return_value = None
         result = await get_avg_rating(100, self.session)
         self.assertIsNone(result)
+
+
+class TestRatingAggregates(DatabaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.users = await self.add_users(3)
+        [self.photo] = await self.add_photos(self.users[2], "d")
+        await self.session.commit()
+
+    async def aggregates(self):
+        result = await self.session.execute(
+            select(Photo.rating_sum, Photo.rating_count).filter_by(id=self.photo.id)
+        )
+        return tuple(result.one())
+
+    async def test_create_and_delete_rating(self):
+        self.assertIsNone(await get_avg_rating(self.photo.id, self.session))
+        first = await create_rating(5, self.photo.id, self.users[0].id, self.session)
+        await create_rating(2, self.photo.id, self.users[1].id, self.session)
+        self.assertEqual(await self.aggregates(), (7, 2))
+        self.assertEqual(await get_avg_rating(self.photo.id, self.session), 3.5)
+
+        await delete_rating(first.id, self.session)
+        self.assertEqual(await self.aggregates(), (2, 1))
+        self.assertEqual(await get_avg_rating(self.photo.id, self.session), 2)
+        self.assertIsNone(await delete_rating(first.id, self.session))
+        self.assertEqual(await self.aggregates(), (2, 1))
+
+    async def test_rating_is_created_once(self):
+        self.assertIsNotNone(await create_rating(5, self.photo.id, self.users[0].id, self.session))
+        self.assertIsNone(await create_rating(1, self.photo.id, self.users[0].id, self.session))
+        # the own photo and a missing one
+        self.assertIsNone(await create_rating(5, self.photo.id, self.users[2].id, self.session))
+        self.assertIsNone(await create_rating(5, self.photo.id + 1, self.users[1].id, self.session))
+        self.assertEqual(await self.aggregates(), (5, 1))
+        ratings = await self.session.execute(select(Rating.user_id, Rating.rating))
+        self.assertEqual(ratings.all(), [(self.users[0].id, 5)])
+
+    async def test_deleted_user_is_uncounted(self):
+        await create_rating(5, self.photo.id, self.users[0].id, self.session)
+        await create_rating(2, self.photo.id, self.users[1].id, self.session)
+        admin = User(username="admin", email="admin@test.com", password="qwerty", role=Role.admin)
+        await delete_user(self.users[1].id, self.session, admin)
+        self.assertEqual(await self.aggregates(), (5, 1))
+        self.assertEqual(await get_avg_rating(self.photo.id, self.session), 5)
+        ratings = await self.session.execute(select(Rating.rating))
+        self.assertEqual(ratings.scalars().all(), [5])
@@ -0,0 +1,102 @@
+import io
+import tempfile
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fastapi import HTTPException
+from PIL import Image
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.services.rendering import RenderingEngine, render_images
+from src.services.storage import LocalStorage
+
+
+def make_picture(width: int = 320, height: int = 240, image_format: str = "JPEG") -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(buffer, image_format)
+    return buffer.getvalue()
+
+
+def open_picture(data: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(data))
+
+
+class TestRenderImages(unittest.TestCase):
+    def test_batch_of_sizes(self):
+        specs = [
+            {"width": 100, "height": 100},
+            {"width": 64, "height": 32, "crop": "scale"},
+            {"width": 160, "height": 160, "crop": "fit"},
+        ]
+        results = render_images(make_picture(), specs)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(open_picture(results[0]).size, (100, 100))
+        self.assertEqual(open_picture(results[1]).size, (64, 32))
+        self.assertEqual(open_picture(results[2]).size, (160, 120))
+        self.assertEqual(open_picture(results[0]).format, "JPEG")
+
+    def test_limit_does_not_upscale(self):
+        result = render_images(make_picture(80, 60), [{"width": 400, "height": 400, "crop": "limit"}])
+        self.assertEqual(open_picture(result[0]).size, (80, 60))
+
+    def test_circle_avatar(self):
+        spec = {"width": 50, "height": 50, "circle": True, "format": "PNG"}
+        avatar = open_picture(render_images(make_picture(), [spec])[0])
+        self.assertEqual(avatar.format, "PNG")
+        self.assertEqual(avatar.mode, "RGBA")
+        self.assertEqual(avatar.getpixel((0, 0))[3], 0)
+        self.assertEqual(avatar.getpixel((25, 25))[3], 255)
+
+    def test_effects(self):
+        source = make_picture()
+        for effect in ("sepia", "vignette", "pixelate", "cartoonify"):
+            with self.subTest(effect=effect):
+                spec = {"width": 64, "height": 64, "effect": effect, "format": "PNG"}
+                image = open_picture(render_images(source, [spec])[0])
+                self.assertEqual(image.size, (64, 64))
+        vignette = open_picture(
+            render_images(source, [{"width": 64, "height": 64, "effect": "vignette", "format": "PNG"}])[0]
+        )
+        self.assertLess(sum(vignette.getpixel((0, 0))), sum(vignette.getpixel((32, 32))))
+
+
+class TestRenderingEngine(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.engine = RenderingEngine(max_workers=1, timeout=30)
+
+    def tearDown(self):
+        self.engine.shutdown()
+
+    async def test_avatar_in_process_pool(self):
+        avatar = open_picture(await self.engine.avatar(make_picture(), size=40, effect="sepia"))
+        self.assertEqual(avatar.size, (40, 40))
+        self.assertEqual(avatar.mode, "RGBA")
+
+    async def test_not_a_picture(self):
+        with self.assertRaises(HTTPException) as error:
+            await self.engine.thumbnail(b"not a picture", 10, 10)
+        self.assertEqual(error.exception.status_code, 400)
+
+
+class TestLocalAvatar(unittest.IsolatedAsyncioTestCase):
+    async def test_make_avatar_with_local_storage(self):
+        from src.models.models import Photo
+        from src.repository.photos import make_avatar_from_photo
+        from src.services.renditions import forget_photo
+
+        with tempfile.TemporaryDirectory() as root:
+            local = LocalStorage(root, "/media", max_workers=1, timeout=5)
+            stored = await local.upload(make_picture(), public_id="test")
+            photo = Photo(id=7001, path=stored["url"], public_photo_id=stored["public_id"])
+            session = AsyncMock(spec=AsyncSession)
+            session.execute.return_value.scalar_one_or_none = lambda: photo
+            with patch("src.repository.photos.storage", local), patch(
+                "src.repository.photos.rendering", RenderingEngine(1, 30)
+            ) as engine:
+                result = await make_avatar_from_photo(None, photo.id, "sepia", session)
+                engine.shutdown()
+            forget_photo(photo.id)
+            self.assertTrue(result["avatar"].startswith("/media/"))
+            avatar = await local.read(result["avatar"][len("/media/"):])
+            self.assertEqual(open_picture(avatar).size, (200, 200))
+            local.shutdown()
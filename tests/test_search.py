@@ -0,0 +1,193 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, MagicMock
+
+from fastapi import HTTPException
+from sqlalchemy.dialects import postgresql
+
+from src.conf.constants import PhotoSort, SortOrder
+from src.models.models import Photo, Tag, User
+from src.repository.comments import create_comment, delete_comment
+from src.repository.photos import (
+    fuzzy_search,
+    get_all_photos,
+    keyword_search,
+    search_photos,
+    search_photos_by_filter,
+)
+from src.repository.ratings import create_rating
+from src.repository.users import delete_user
+from src.schemas.comments import CommentSchema
+from src.services.trigrams import TrigramIndex, similarity
+from tests.conftest import DatabaseTestCase
+
+
+class TestKeywordSearch(DatabaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        [self.user] = await self.add_users()
+        sunset, sea = Tag(name="sunset"), Tag(name="sea")
+        self.photos = [
+            Photo(description="Red sky over the harbour", tags=[sunset]),
+            Photo(description="Boats at the sea", tags=[sea]),
+            Photo(description="Sea shore at sunset", tags=[]),
+        ]
+        for i, photo in enumerate(self.photos):
+            photo.path = photo.public_photo_id = "p"
+            photo.user_id = self.user.id
+            photo.created_at = datetime(2024, 1, 1) + timedelta(days=i)
+        self.session.add_all(self.photos)
+        await self.session.commit()
+
+    async def search(self, keywords, fuzzy=False, sort=None, order=SortOrder.desc):
+        page = await search_photos(
+            keywords, 10, None, self.session, self.user, fuzzy, sort, order
+        )
+        return [self.photos.index(photo) for photo in page["items"]]
+
+    async def comment(self, counts):
+        comments = []
+        for index, count in counts.items():
+            for _ in range(count):
+                comments.append(await create_comment(
+                    CommentSchema(opinion="Nice photo"), self.photos[index].id, self.user.id, self.session
+                ))
+        return comments
+
+    async def list_all(self, sort, order):
+        found, cursor = [], None
+        while True:
+            page = await get_all_photos(cursor, 2, self.session, sort, order)
+            found += [self.photos.index(photo) for photo in page["items"]]
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return found
+
+    async def rate(self, ratings):
+        # every user rates a photo once
+        raters = [
+            User(username=f"rater{i}", email=f"rater{i}@test.com", password="qwerty")
+            for i in range(max(map(len, ratings.values())))
+        ]
+        self.session.add_all(raters)
+        await self.session.commit()
+        for index, values in ratings.items():
+            for rater, value in zip(raters, values):
+                await create_rating(value, self.photos[index].id, rater.id, self.session)
+
+    async def search_rated(self, keywords, rate_min, rate_max, limit=10, cursor=None):
+        page = await search_photos_by_filter(
+            keywords, rate_min, rate_max, limit, cursor, self.session, self.user
+        )
+        return [self.photos.index(photo) for photo in page["items"]], page["next_cursor"]
+
+    async def test_one_word_in_description_or_tags(self):
+        self.assertEqual(await self.search("sunset"), [0, 2])
+        self.assertEqual(await self.search("SEA"), [1, 2])
+
+    async def test_all_words_must_match(self):
+        self.assertEqual(await self.search("sea sunset"), [2])
+        self.assertEqual(await self.search("harbour boats"), [])
+
+    async def test_rating_range_includes_both_ends(self):
+        await self.rate({0: [5, 5], 1: [5], 2: [4, 3]})
+        self.assertEqual(await self.search_rated("sunset", 3.5, 5), ([0, 2], None))
+        self.assertEqual(await self.search_rated("sunset", None, 3.5), ([2], None))
+        self.assertEqual(await self.search_rated("sea", 5, None), ([1], None))
+
+    async def test_rated_search_paginates_once(self):
+        await self.rate({0: [5], 1: [5], 2: [5]})
+        self.assertEqual(await self.search_rated("sea sunset", 1, 5), ([2], None))
+        first, cursor = await self.search_rated("sunset", 1, 5, limit=1)
+        self.assertEqual(first, [0])
+        self.assertEqual(await self.search_rated("sunset", 1, 5, limit=1, cursor=cursor), ([2], None))
+
+    async def test_list_sorted_by_rating(self):
+        await self.rate({0: [2], 2: [5]})
+        # the photo without ratings has 0
+        self.assertEqual(await self.list_all(PhotoSort.rating, SortOrder.desc), [2, 0, 1])
+        self.assertEqual(await self.list_all(PhotoSort.rating, SortOrder.asc), [1, 0, 2])
+
+    async def test_list_sorted_by_comments(self):
+        await self.comment({1: 3, 2: 1})
+        self.assertEqual(await self.list_all(PhotoSort.comments, SortOrder.desc), [1, 2, 0])
+        self.assertEqual(await self.list_all(PhotoSort.comments, SortOrder.asc), [0, 2, 1])
+
+    async def test_list_sorted_by_created_at(self):
+        self.assertEqual(await self.list_all(PhotoSort.created_at, SortOrder.asc), [0, 1, 2])
+        self.assertEqual(await self.list_all(PhotoSort.created_at, SortOrder.desc), [2, 1, 0])
+
+    async def test_search_sorted(self):
+        await self.rate({0: [1], 2: [4]})
+        await self.comment({0: 2})
+        self.assertEqual(await self.search("sunset", sort=PhotoSort.rating), [2, 0])
+        self.assertEqual(await self.search("sunset", sort=PhotoSort.comments), [0, 2])
+        self.assertEqual(
+            await self.search("sunset", sort=PhotoSort.comments, order=SortOrder.asc), [2, 0]
+        )
+
+    async def test_comment_count(self):
+        other = User(username="other", email="other@test.com", password="qwerty")
+        self.session.add(other)
+        await self.session.commit()
+        first, _ = await self.comment({0: 2})
+        await create_comment(CommentSchema(opinion="Nice photo"), self.photos[0].id, other.id, self.session)
+        await delete_comment(first.id, self.session)
+        await self.session.refresh(self.photos[0])
+        self.assertEqual(self.photos[0].comment_count, 2)
+
+        await delete_user(other.id, self.session, other)
+        await self.session.refresh(self.photos[0])
+        self.assertEqual(self.photos[0].comment_count, 1)
+
+    def test_postgresql_full_text_query(self):
+        db = MagicMock()
+        db.get_bind.return_value.dialect.name = "postgresql"
+        keyword_filter, rank = keyword_search('"red sky" -boats', db)
+        dialect = postgresql.dialect()
+        self.assertEqual(
+            str(keyword_filter.compile(dialect=dialect)),
+            "photos.search_vector @@ websearch_to_tsquery(%(websearch_to_tsquery_1)s, "
+            "%(websearch_to_tsquery_2)s)",
+        )
+        self.assertIn("ts_rank(photos.search_vector", str(rank.compile(dialect=dialect)))
+
+    async def test_fuzzy_search_tolerates_typos(self):
+        self.assertEqual(await self.search("sunsett"), [])
+        self.assertEqual(sorted(await self.search("sunsett", fuzzy=True)), [0, 2])
+        self.assertEqual(await self.search("sunsett shor", fuzzy=True), [2])
+        self.assertEqual(await self.search("qwerty", fuzzy=True), [])
+
+    async def test_fuzzy_search_ranks_exact_words_first(self):
+        self.photos[0].tags.append(Tag(name="seas"))
+        await self.session.commit()
+        # the other photos match the similar tag name "sea"
+        self.assertEqual(await self.search("seas", fuzzy=True), [0, 2, 1])
+
+    async def test_postgresql_fuzzy_query(self):
+        db = AsyncMock()
+        db.get_bind = MagicMock()
+        db.get_bind.return_value.dialect.name = "postgresql"
+        keyword_filter, rank = await fuzzy_search("sunsett", db)
+        dialect = postgresql.dialect()
+        compiled = str(keyword_filter.compile(dialect=dialect))
+        self.assertIn("photos.description %%> %(description_1)s", compiled)
+        self.assertIn("tags.name %% %(name_1)s", compiled)
+        self.assertIn("word_similarity(", str(rank.compile(dialect=dialect)))
+        db.execute.assert_awaited_once()
+
+
+class TestTrigrams(unittest.TestCase):
+    def test_similarity_as_pg_trgm(self):
+        self.assertAlmostEqual(similarity("word", "two words"), 4 / 11)
+        self.assertEqual(similarity("Sunset", "sunset"), 1)
+        self.assertEqual(similarity("", "sunset"), 0)
+
+    def test_index_finds_similar_terms(self):
+        index = TrigramIndex(["sunset", "sunrise", "sea", "forest"])
+        self.assertEqual([term for term, _ in index.similar("sunsett", 0.3, 10)], ["sunset"])
+        self.assertEqual(sorted(term for term, _ in index.similar("sun", 0.2, 10)), ["sunrise", "sunset"])
+        self.assertEqual(len(index.similar("sun", 0.2, 1)), 1)
+        index.discard("sunset")
+        self.assertEqual(index.similar("sunsett", 0.3, 10), [])
+        self.assertEqual(len(index), 3)
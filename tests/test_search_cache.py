@@ -0,0 +1,121 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from src.models.models import Photo, Tag, User
+from src.repository.photos import attach_tags, detach_tags, edit_photo_description
+from src.repository.ratings import create_rating
+from src.services.auth import auth_service
+from src.services.search_cache import SearchCache, search_cache
+from tests.conftest import DatabaseTestCase, FakeRedis
+
+
+class TestSearchCache(unittest.TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = patch.object(auth_service, "cache", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = SearchCache(ttl=60)
+
+    def test_key_is_normalized(self):
+        self.assertEqual(
+            self.cache.key(" Sea  SUNSET", 1, None, 10, None, False),
+            self.cache.key("sea sunset", 1.0, None, 10, None, False),
+        )
+        self.assertNotEqual(
+            self.cache.key("sea", None, None, 10, None, False),
+            self.cache.key("sea", None, None, 10, "cursor", False),
+        )
+
+    def test_only_dependent_entries_are_invalidated(self):
+        page = {"items": [{"id": 1}], "next_cursor": None}
+        self.cache.set("search:entry:a", page, photo_ids=[1], tag_ids=[7], words=["sea"])
+        self.cache.set("search:entry:b", page, photo_ids=[2], words=["forest"])
+        self.assertEqual(self.cache.get("search:entry:a"), page)
+
+        self.assertEqual(self.cache.invalidate(tag_ids=[7]), 1)
+        self.assertIsNone(self.cache.get("search:entry:a"))
+        self.assertEqual(self.cache.get("search:entry:b"), page)
+        self.assertEqual(self.cache.invalidate(photo_ids=[3], words=["sea"]), 0)
+        self.assertEqual(self.cache.invalidate(words=["forest"]), 1)
+        self.assertEqual(self.cache.metrics()["invalidated"], 2)
+
+    def test_metrics(self):
+        self.assertIsNone(self.cache.metrics()["hit_ratio"])
+        self.cache.observe(True, 0.001)
+        self.cache.observe(False, 0.003)
+        self.cache.observe(True, 0.003)
+        metrics = self.cache.metrics()
+        self.assertEqual((metrics["hits"], metrics["misses"]), (2, 1))
+        self.assertAlmostEqual(metrics["hit_ratio"], 2 / 3)
+        self.assertAlmostEqual(metrics["hit_latency_ms"], 2)
+        self.assertAlmostEqual(metrics["miss_latency_ms"], 3)
+
+
+class TestSearchInvalidation(DatabaseTestCase):
+    fake_redis = True
+
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        [self.user] = await self.add_users()
+        self.photos = await self.add_photos(self.user, "Boats at the sea", "Dark forest")
+        await self.session.commit()
+        page = {"items": [], "next_cursor": None}
+        search_cache.set("search:entry:sea", page, photo_ids=[self.photos[0].id], words=["sea"])
+        search_cache.set("search:entry:forest", page, photo_ids=[self.photos[1].id], words=["forest"])
+        search_cache.set("search:entry:sunset", page, words=["sunset"])
+
+    def cached(self):
+        return sorted(key.split(":")[-1] for key in self.redis.data if key.startswith("search:entry:"))
+
+    async def test_new_photo_invalidates_its_words_and_tags(self):
+        self.session.add(
+            Photo(description="Sunset", path="p", public_photo_id="p", user_id=self.user.id,
+                  tags=[Tag(name="forest")])
+        )
+        await self.session.commit()
+        self.assertEqual(self.cached(), ["sea"])
+
+    async def test_description_invalidates_the_photo_and_the_words(self):
+        await edit_photo_description(self.user, self.photos[1].id, "Sunset", self.session)
+        self.assertEqual(self.cached(), ["sea"])
+
+    async def test_tags_invalidate_the_photo(self):
+        await attach_tags(self.photos[1].id, ["sunset"], self.session)
+        self.assertEqual(self.cached(), ["sea"])
+        search_cache.set("search:entry:sunset", {}, words=["sunset"])
+        await detach_tags(self.photos[0].id, ["sunset"], self.session)
+        self.assertEqual(self.cached(), ["sea", "sunset"])
+
+    async def test_rating_invalidates_the_photo(self):
+        rater = User(username="rater", email="rater@test.com", password="qwerty")
+        self.session.add(rater)
+        await self.session.commit()
+        await create_rating(5, self.photos[0].id, rater.id, self.session)
+        self.assertEqual(self.cached(), ["forest", "sunset"])
+
+    async def test_rollback_keeps_the_entries(self):
+        self.photos[0].description = "Sunset"
+        await self.session.flush()
+        await self.session.rollback()
+        self.assertEqual(self.cached(), ["forest", "sea", "sunset"])
+
+
+def test_search_route_is_cached(client, get_token, monkeypatch, fake_redis):
+    monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
+    monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
+    monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+    headers = {"Authorization": f"Bearer {get_token}"}
+    hits, misses = search_cache.hits, search_cache.misses
+    with patch("src.repository.photos.search_photos") as search_photos:
+        search_photos.return_value = {"items": [], "next_cursor": None}
+        for _ in range(2):
+            response = client.get(
+                "/api/photos/search/", params={"search_keyword": "Nothing"}, headers=headers
+            )
+            assert response.status_code == 204, response.text
+        search_photos.assert_called_once()
+    assert (search_cache.hits - hits, search_cache.misses - misses) == (1, 1)
+    response = client.get("/api/photos/search/metrics", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["hits"] == search_cache.hits
@@ -0,0 +1,127 @@
+import io
+import tempfile
+import threading
+import time
+import unittest
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from fastapi import HTTPException
+
+from src.services.storage import CloudinaryStorage, LocalStorage, Storage
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 64
+
+
+class TestCloudinaryStorage(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.storage = CloudinaryStorage(max_workers=2, timeout=0.2)
+
+    def tearDown(self):
+        self.storage.shutdown()
+
+    async def test_upload_runs_in_executor(self):
+        def upload(file, public_id, **options):
+            return {"thread": threading.current_thread().name, "public_id": public_id}
+
+        with patch("cloudinary.uploader.upload", upload):
+            result = await self.storage.upload("file", public_id="test")
+        self.assertEqual(result["public_id"], "test")
+        self.assertTrue(result["thread"].startswith("storage"))
+
+    async def test_upload_timeout(self):
+        def upload(file, public_id, **options):
+            time.sleep(0.5)
+
+        with patch("cloudinary.uploader.upload", upload):
+            with self.assertRaises(HTTPException) as error:
+                await self.storage.upload("file", public_id="test")
+        self.assertEqual(error.exception.status_code, 504)
+
+    async def test_upload_large(self):
+        with tempfile.NamedTemporaryFile() as file, patch(
+            "cloudinary.uploader.upload_large", return_value={"public_id": "big"}
+        ) as upload_large:
+            file.write(PNG)
+            file.flush()
+            result = await self.storage.upload_large(file.name, public_id="big")
+        self.assertEqual(result["public_id"], "big")
+        self.assertIn("chunk_size", upload_large.call_args.kwargs)
+
+    async def test_destroy(self):
+        with patch("cloudinary.uploader.destroy", return_value={"result": "ok"}) as destroy:
+            result = await self.storage.destroy("test")
+        self.assertEqual(result, {"result": "ok"})
+        destroy.assert_called_once()
+
+    async def test_destroy_many(self):
+        deleted = {"deleted": {"a": "deleted", "b": "not_found", "c": "error"}}
+        with patch("cloudinary.api.delete_resources", return_value=deleted) as delete:
+            result = await self.storage.destroy_many(["a", "b", "c"])
+        self.assertEqual(result, {"a", "b"})
+        self.assertEqual(delete.call_args.args[0], ["a", "b", "c"])
+
+    def test_build_url(self):
+        url = self.storage.build_url("Photos_of_user/test/1")
+        self.assertIn("Photos_of_user/test/1", url)
+
+    async def test_read_downloads_the_original(self):
+        response = MagicMock(content=PNG)
+        with patch("requests.get", return_value=response) as get:
+            result = await self.storage.read("Photos_of_user/test/1")
+        self.assertEqual(result, PNG)
+        self.assertIn("Photos_of_user/test/1", get.call_args.args[0])
+        response.raise_for_status.assert_called_once()
+
+    def test_backend_must_implement_the_interface(self):
+        class Partial(Storage):
+            async def upload(self, file, public_id, **options):
+                return {}
+
+        with self.assertRaises(TypeError):
+            Partial(max_workers=1, timeout=1)
+
+
+class TestLocalStorage(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.storage = LocalStorage(self.tmp.name, "/media", max_workers=2, timeout=5)
+
+    def tearDown(self):
+        self.storage.shutdown()
+        self.tmp.cleanup()
+
+    async def test_upload_is_content_addressed(self):
+        first = await self.storage.upload(io.BytesIO(PNG), public_id="a")
+        second = await self.storage.upload(PNG, public_id="b")
+        self.assertEqual(first["public_id"], second["public_id"])
+        self.assertTrue(first["public_id"].endswith(".png"))
+        self.assertEqual(first["url"], f"/media/{first['public_id']}")
+        stored = Path(self.tmp.name) / first["public_id"]
+        self.assertEqual(stored.read_bytes(), PNG)
+        self.assertEqual(list(Path(self.tmp.name).glob("*.part")), [])
+
+    async def test_upload_with_format(self):
+        svg = b'<?xml version="1.0"?><svg xmlns="http://www.w3.org/2000/svg"/>'
+        result = await self.storage.upload(svg, public_id="qr", format="svg")
+        self.assertTrue(result["public_id"].endswith(".svg"))
+
+    async def test_upload_from_own_url(self):
+        first = await self.storage.upload(PNG, public_id="a")
+        copy = await self.storage.upload(first["url"], public_id="b")
+        self.assertEqual(copy["public_id"], first["public_id"])
+
+    async def test_upload_remote_url(self):
+        with self.assertRaises(ValueError):
+            await self.storage.upload("http://example.com/a.png", public_id="a")
+
+    async def test_destroy(self):
+        result = await self.storage.upload(PNG, public_id="a")
+        self.assertEqual(await self.storage.destroy(result["public_id"]), {"result": "ok"})
+        self.assertEqual(
+            await self.storage.destroy(result["public_id"]), {"result": "not found"}
+        )
+
+    async def test_destroy_outside_root(self):
+        with self.assertRaises(ValueError):
+            await self.storage.destroy("../../etc/passwd")
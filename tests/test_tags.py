@@ -0,0 +1,490 @@
+import asyncio
+import json
+import sys
+import unittest
+from contextlib import asynccontextmanager
+from unittest.mock import MagicMock, patch
+
+from fastapi import HTTPException
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from src.conf import messages
+from src.models.models import Photo, Tag, User, photo_m2m_tag
+from src.repository.photos import (
+    add_tag_to_photo,
+    assembling_tags,
+    attach_tags,
+    del_photo_tag,
+    detach_tags,
+    get_or_create_tags,
+    normalize_tags,
+    search_photos,
+    search_photos_by_tags,
+)
+from src.repository.tags import suggest_tags
+from src.services.auth import auth_service
+from src.services.bitsets import SPARSE_MAX, Bitset
+from src.services.pagination import Keyset
+from src.services.tag_dictionary import tag_dictionary
+from src.services.tag_query import parse_tag_query
+from tests.conftest import DatabaseTestCase
+
+
+class TestTagResolution(DatabaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.statements = []
+        event.listen(
+            self.engine.sync_engine,
+            "before_cursor_execute",
+            lambda conn, cursor, statement, *args: self.statements.append(statement),
+        )
+
+    def test_normalize_tags(self):
+        self.assertEqual(
+            normalize_tags([" Sea", "sea", "", "  ", "SUNSET ", "sunset", "nature"]),
+            ["sea", "sunset", "nature"],
+        )
+
+    async def test_one_select_and_one_insert(self):
+        self.session.add(Tag(name="nature"))
+        await self.session.commit()
+        self.statements.clear()
+
+        tags = await get_or_create_tags(["Sunset", " nature", "sea", "SEA"], self.session)
+        await self.session.commit()
+
+        self.assertEqual(list(tags), ["sunset", "nature", "sea"])
+        self.assertTrue(all(tag.id for tag in tags.values()))
+        queries = [s for s in self.statements if s.startswith(("SELECT", "INSERT"))]
+        self.assertEqual(len(queries), 2)
+        self.assertIn("ON CONFLICT DO NOTHING", queries[1])
+
+    async def test_tag_created_by_other_session(self):
+        other = async_sessionmaker(self.engine)()
+        other.add(Tag(name="sea"))
+        await other.commit()
+        await other.close()
+
+        tags = await assembling_tags(["sea", "sunset"], self.session)
+        await self.session.commit()
+        self.assertEqual([tag.name for tag in tags], ["sea", "sunset"])
+        result = await self.session.execute(select(Tag.name).order_by(Tag.name))
+        self.assertEqual(result.scalars().all(), ["sea", "sunset"])
+
+    async def test_no_tags(self):
+        self.assertEqual(await get_or_create_tags(["", " "], self.session), {})
+        self.assertEqual(self.statements, [])
+
+
+class TestPhotoTags(DatabaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        [user] = await self.add_users()
+        self.photo = Photo(
+            path="tests/test.jpg", description="test", public_photo_id="test/1", user_id=user.id
+        )
+        self.session.add(self.photo)
+        await self.session.commit()
+        self.statements = []
+        event.listen(
+            self.engine.sync_engine,
+            "before_cursor_execute",
+            lambda conn, cursor, statement, *args: self.statements.append(statement),
+        )
+
+    async def photo_tags(self):
+        result = await self.session.execute(
+            select(Tag.name)
+            .join(photo_m2m_tag, photo_m2m_tag.c.tag_id == Tag.id)
+            .filter(photo_m2m_tag.c.photo_id == self.photo.id)
+            .order_by(Tag.name)
+        )
+        return result.scalars().all()
+
+    async def test_attach_in_one_statement(self):
+        await get_or_create_tags(["sea", "sunset"], self.session)
+        await self.session.commit()
+        self.statements.clear()
+
+        report = await attach_tags(self.photo.id, ["Sea", "sunset"], self.session)
+
+        self.assertEqual(report, {"added": ["sea", "sunset"], "present": [], "rejected": []})
+        inserts = [s for s in self.statements if "INSERT INTO photo_m2m_tag" in s]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(len([s for s in self.statements if s.startswith("SELECT")]), 1)
+        self.assertEqual(await self.photo_tags(), ["sea", "sunset"])
+
+    async def test_attach_reports_present_and_rejected(self):
+        await attach_tags(self.photo.id, ["a1", "a2", "a3", "a4"], self.session)
+
+        report = await attach_tags(self.photo.id, ["a2", "b1", "b2"], self.session)
+
+        self.assertEqual(report, {"added": ["b1"], "present": ["a2"], "rejected": ["b2"]})
+        self.assertEqual(await self.photo_tags(), ["a1", "a2", "a3", "a4", "b1"])
+
+    async def test_attach_to_unknown_photo(self):
+        with self.assertRaises(HTTPException) as error:
+            await attach_tags(self.photo.id + 1, ["sea"], self.session)
+        self.assertEqual(error.exception.status_code, 404)
+
+    async def test_add_tag_to_photo_errors(self):
+        await add_tag_to_photo(self.photo.id, "a1,a2,a3,a4,a5", self.session)
+        for tag, detail in (("a1", messages.TAG_ALREADY_ADDED), ("b1", messages.TOO_MANY_TAGS)):
+            with self.assertRaises(HTTPException) as error:
+                await add_tag_to_photo(self.photo.id, tag, self.session)
+            self.assertEqual(error.exception.detail, detail)
+
+    async def test_detach_in_one_statement(self):
+        await attach_tags(self.photo.id, ["sea", "sunset"], self.session)
+        self.statements.clear()
+
+        report = await detach_tags(self.photo.id, ["sea", "sunset"], self.session)
+
+        self.assertEqual(report, {"removed": ["sea", "sunset"], "absent": []})
+        self.assertEqual(len([s for s in self.statements if s.startswith(("SELECT", "DELETE"))]), 1)
+        self.assertEqual(await self.photo_tags(), [])
+
+    async def test_del_photo_tag_errors(self):
+        await attach_tags(self.photo.id, ["sea"], self.session)
+        await get_or_create_tags(["sunset"], self.session)
+        report = await detach_tags(self.photo.id, ["sea", "sunset"], self.session)
+        self.assertEqual(report, {"removed": ["sea"], "absent": ["sunset"]})
+        for tag, status_code, detail in (
+            ("sunset", 400, messages.PHOTO_HAS_NOT_TAG),
+            ("unknown", 404, messages.TAG_NOT_FOUND),
+        ):
+            with self.assertRaises(HTTPException) as error:
+                await del_photo_tag(self.photo.id, tag, self.session)
+            self.assertEqual((error.exception.status_code, error.exception.detail), (status_code, detail))
+        with self.assertRaises(HTTPException) as error:
+            await detach_tags(self.photo.id + 1, ["sea"], self.session)
+        self.assertEqual(error.exception.status_code, 404)
+
+
+class FakePubSub:
+    def __init__(self, messages):
+        self.messages = messages
+        self.channels = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+
+    async def listen(self):
+        for message in self.messages:
+            yield message
+        await asyncio.Event().wait()
+
+
+class TestTagDictionary(DatabaseTestCase):
+    async def asyncSetUp(self):
+        await super().asyncSetUp()
+        self.session.add_all([Tag(name="sea"), Tag(name="sunset")])
+        await self.session.commit()
+
+        self.cache_patcher = patch("src.services.tag_dictionary.auth_service")
+        self.cache = self.cache_patcher.start().cache
+        tag_dictionary.active = True
+        await tag_dictionary.load(self.session)
+
+        self.statements = []
+        event.listen(
+            self.engine.sync_engine,
+            "before_cursor_execute",
+            lambda conn, cursor, statement, *args: self.statements.append(statement),
+        )
+
+    async def asyncTearDown(self):
+        await tag_dictionary.stop()
+        self.cache_patcher.stop()
+        await super().asyncTearDown()
+
+    async def test_known_tags_without_queries(self):
+        tags = await get_or_create_tags(["Sea", "sunset"], self.session)
+        self.assertEqual({name: tag.id for name, tag in tags.items()}, {"sea": 1, "sunset": 2})
+        self.assertEqual(self.statements, [])
+
+    async def test_created_tags_published_after_commit(self):
+        await get_or_create_tags(["sea", "nature"], self.session)
+        self.cache.publish.assert_not_called()
+        await self.session.commit()
+
+        channel, message = self.cache.publish.call_args.args
+        self.assertEqual(channel, tag_dictionary.channel)
+        message = json.loads(message)
+        self.assertEqual(message["created"], {"nature": 3})
+        self.assertEqual(message["origin"], tag_dictionary.origin)
+        self.assertEqual(tag_dictionary.get("nature"), 3)
+
+    async def test_rolled_back_tags_not_published(self):
+        await get_or_create_tags(["nature"], self.session)
+        await self.session.rollback()
+        await self.session.commit()
+        self.cache.publish.assert_not_called()
+        self.assertIsNone(tag_dictionary.get("nature"))
+
+    async def test_deleted_tag_published(self):
+        tag = await self.session.get(Tag, 1)
+        await self.session.delete(tag)
+        await self.session.commit()
+        self.assertEqual(json.loads(self.cache.publish.call_args.args[1])["deleted"], ["sea"])
+        self.assertIsNone(tag_dictionary.get("sea"))
+
+    def test_inactive_dictionary(self):
+        tag_dictionary.active = False
+        self.assertIsNone(tag_dictionary.get("sea"))
+        self.assertIsNone(tag_dictionary.tag("sea"))
+
+    async def test_listen_applies_changes(self):
+        await tag_dictionary.stop()
+        message = {"created": {"nature": 7}, "deleted": ["sea"], "used": {"sunset": 2}}
+        own = {"created": {"mine": 8}, "origin": tag_dictionary.origin}
+        pubsub = FakePubSub(
+            [
+                {"type": "subscribe", "data": 1},
+                {"type": "message", "data": json.dumps(own)},
+                {"type": "message", "data": json.dumps(message)},
+            ]
+        )
+        client = MagicMock()
+        client.pubsub.return_value = pubsub
+
+        @asynccontextmanager
+        async def session():
+            yield self.session
+
+        with patch("src.services.tag_dictionary.sessionmanager") as sessionmanager:
+            sessionmanager.session = session
+            tag_dictionary.start(client)
+            for _ in range(100):
+                if tag_dictionary.get("nature"):
+                    break
+                await asyncio.sleep(0.01)
+
+        self.assertEqual(pubsub.channels, [tag_dictionary.channel])
+        self.assertEqual(tag_dictionary.get("nature"), 7)
+        self.assertEqual(tag_dictionary.get("sunset"), 2)
+        self.assertIsNone(tag_dictionary.get("sea"))
+        self.assertIsNone(tag_dictionary.get("mine"))
+        self.assertEqual(tag_dictionary.suggest("", 5), [("sunset", 2), ("nature", 0)])
+
+    async def test_search_and_detach_use_known_ids(self):
+        user = User(username="test_user", email="test@test.com", password="qwerty")
+        self.session.add(user)
+        await self.session.flush()
+        photo = Photo(path="p", description="d", public_photo_id="test/1", user_id=user.id)
+        self.session.add(photo)
+        await self.session.commit()
+        await attach_tags(photo.id, ["sea"], self.session)
+        self.statements.clear()
+
+        report = await detach_tags(photo.id, ["sea"], self.session)
+
+        self.assertEqual(report["removed"], ["sea"])
+        self.assertNotIn("tags.name IN", self.statements[0])
+
+        await attach_tags(photo.id, ["sea"], self.session)
+        self.statements.clear()
+        page = await search_photos("sea", 10, None, self.session, user)
+        self.assertEqual([p.id for p in page["items"]], [photo.id])
+        self.assertNotIn("tags.name", self.statements[0])
+
+    async def add_photo(self, tags):
+        user = User(username=f"user{len(tags)}", email=f"{len(tags)}@test.com", password="q")
+        self.session.add(user)
+        await self.session.flush()
+        photo = Photo(path="p", description="d", public_photo_id="p", user_id=user.id, tags=tags)
+        self.session.add(photo)
+        await self.session.commit()
+        return photo
+
+    async def test_suggest_most_used_first(self):
+        tags = await get_or_create_tags(["seal", "sea", "season", "nature"], self.session)
+        await self.session.commit()
+        photo = await self.add_photo([tags["season"]])
+        await self.add_photo([tags["season"], tags["seal"]])
+        await attach_tags(photo.id, ["sunset"], self.session)
+
+        self.statements.clear()
+        suggestions = await suggest_tags(" SE", 2, self.session)
+
+        self.assertEqual(suggestions, [{"name": "season", "count": 2}, {"name": "seal", "count": 1}])
+        self.assertEqual(self.statements, [])
+        self.assertEqual(tag_dictionary.suggest("su", 5), [("sunset", 1)])
+        self.assertEqual(tag_dictionary.suggest("x", 5), [])
+
+    async def test_similar_follows_the_names(self):
+        tags = await get_or_create_tags(["sunset", "sea"], self.session)
+        await self.session.commit()
+        self.assertEqual([name for name, _ in tag_dictionary.similar("sunsett", 0.3, 5)], ["sunset"])
+        await self.session.delete(tags["sunset"])
+        await self.session.commit()
+        self.assertEqual(tag_dictionary.similar("sunsett", 0.3, 5), [])
+
+    async def test_trigram_index_of_the_table_is_kept(self):
+        tag_dictionary.active = False
+        index = await tag_dictionary.trigram_index(self.session)
+        self.assertEqual([name for name, _ in index.similar("sunsett", 0.3, 5)], ["sunset"])
+        self.statements.clear()
+        self.assertIs(await tag_dictionary.trigram_index(self.session), index)
+        self.assertEqual(self.statements, [])
+
+        tags = await get_or_create_tags(["sunrise"], self.session)
+        await self.session.commit()
+        index = await tag_dictionary.trigram_index(self.session)
+        self.assertEqual([name for name, _ in index.similar("sunrse", 0.3, 5)], ["sunrise"])
+        await self.session.delete(tags["sunrise"])
+        await self.session.commit()
+        index = await tag_dictionary.trigram_index(self.session)
+        self.assertEqual(index.similar("sunrse", 0.3, 5), [])
+        self.cache.publish.assert_not_called()
+
+    async def test_usage_follows_photos(self):
+        tags = await get_or_create_tags(["sea", "sunset"], self.session)
+        photo = await self.add_photo(list(tags.values()))
+        self.assertEqual(tag_dictionary.suggest("s", 5), [("sea", 1), ("sunset", 1)])
+
+        await detach_tags(photo.id, ["sea"], self.session)
+        self.assertEqual(tag_dictionary.suggest("s", 5), [("sunset", 1), ("sea", 0)])
+
+        self.session.expire(photo, ["tags"])
+        await self.session.delete(photo)
+        await self.session.commit()
+        self.assertEqual(tag_dictionary.suggest("s", 5), [("sea", 0), ("sunset", 0)])
+
+    async def tagged(self, query, limit=10):
+        pages, cursor = [], None
+        while True:
+            page = await search_photos_by_tags(query, limit, cursor, self.session)
+            pages.append([self.photos.index(photo) for photo in page["items"]])
+            cursor = page["next_cursor"]
+            if cursor is None:
+                return pages
+
+    async def add_tagged_photos(self, *tags):
+        user = User(username="owner", email="owner@test.com", password="q")
+        self.session.add(user)
+        await self.session.flush()
+        self.photos = [
+            Photo(path="p", description="d", public_photo_id="p", user_id=user.id, tags=photo_tags)
+            for photo_tags in tags
+        ]
+        self.session.add_all(self.photos)
+        await self.session.commit()
+
+    async def test_tag_query_on_bitsets(self):
+        sea, sunset = await self.session.get(Tag, 1), await self.session.get(Tag, 2)
+        await self.add_tagged_photos([sea, sunset], [sea], [])
+
+        self.statements.clear()
+        self.assertEqual(await self.tagged("sea NOT sunset"), [[1]])
+        self.assertEqual(len(self.statements), 1)
+        self.assertEqual(await self.tagged("sea OR sunset"), [[0, 1]])
+        self.assertEqual(await self.tagged("NOT sea"), [[2]])
+        self.assertEqual(await self.tagged("(sunset OR NOT sea) sea"), [[0]])
+        self.assertEqual(await self.tagged("unknown OR sunset"), [[0]])
+        self.assertEqual(await self.tagged("sea OR NOT sea", limit=2), [[0, 1], [2]])
+
+        await attach_tags(self.photos[2].id, ["sunset"], self.session)
+        await detach_tags(self.photos[0].id, ["sunset"], self.session)
+        self.assertEqual(await self.tagged("sunset"), [[2]])
+        await self.session.delete(self.photos[1])
+        await self.session.commit()
+        self.assertEqual(await self.tagged("sea"), [[0]])
+
+    async def test_negative_cursor(self):
+        cursor = Keyset(Photo.id).encode([-5])
+        with self.assertRaises(HTTPException) as error:
+            await search_photos_by_tags("sea", 10, cursor, self.session)
+        self.assertEqual(error.exception.detail, messages.INVALID_CURSOR)
+
+    async def test_tag_query_from_database(self):
+        sea, sunset = await self.session.get(Tag, 1), await self.session.get(Tag, 2)
+        await self.add_tagged_photos([sea, sunset], [sea], [])
+        await tag_dictionary.stop()
+        self.assertEqual(await self.tagged("sea NOT sunset"), [[1]])
+        self.assertEqual(await self.tagged("NOT sea"), [[2]])
+        self.assertEqual(await self.tagged("sea OR NOT sea", limit=2), [[0, 1], [2]])
+
+    async def test_suggest_from_database(self):
+        await tag_dictionary.stop()
+        tags = await get_or_create_tags(["sea", "seal", "nature"], self.session)
+        await self.add_photo([tags["seal"]])
+        suggestions = await suggest_tags("se", 5, self.session)
+        self.assertEqual(suggestions, [{"name": "seal", "count": 1}, {"name": "sea", "count": 0}])
+
+
+class TestTagQuery(unittest.TestCase):
+    def test_precedence(self):
+        self.assertEqual(
+            parse_tag_query("Sunset AND beach NOT night OR sea"),
+            (
+                "or",
+                ("and", ("and", ("tag", "sunset"), ("tag", "beach")), ("not", ("tag", "night"))),
+                ("tag", "sea"),
+            ),
+        )
+        self.assertEqual(
+            parse_tag_query('("new york" OR paris) city'),
+            ("and", ("or", ("tag", "new york"), ("tag", "paris")), ("tag", "city")),
+        )
+
+    def test_invalid_queries(self):
+        for query in ["", "sea AND", "(sea", "sea)", 'sea ""', "OR sea", "NOT"]:
+            with self.assertRaises(HTTPException, msg=query) as error:
+                parse_tag_query(query)
+            self.assertEqual(error.exception.detail, messages.INVALID_TAG_QUERY)
+
+    def test_bitsets(self):
+        bits = Bitset([1000, 3, 9, 64, 5_000_000, 9])
+        self.assertEqual(list(bits), [3, 9, 64, 1000, 5_000_000])
+        self.assertFalse(Bitset())
+        self.assertEqual(bits.first(None, 3), [3, 9, 64])
+        self.assertEqual(bits.first(9, 10), [64, 1000, 5_000_000])
+        self.assertEqual(bits.first(1000, 10), [5_000_000])
+        self.assertEqual(bits.first(5_000_000, 10), [])
+
+        # a far photo id takes a chunk of one id, not a bit for every smaller id
+        self.assertEqual(sys.getsizeof(Bitset([5_000_000])._chunks[5_000_000 >> 16]),
+                         sys.getsizeof(Bitset([1])._chunks[0]))
+
+    def test_bitset_operations(self):
+        dense = Bitset(range(0, 3 * SPARSE_MAX, 2))
+        sparse = Bitset([0, 1, 2, 3, 70_000, 70_001])
+        both = dense | sparse
+        self.assertEqual(len(both), len(dense) + 4)
+        self.assertEqual(list(dense & sparse), [0, 2])
+        self.assertEqual(list(sparse - dense), [1, 3, 70_000, 70_001])
+        self.assertEqual((both - sparse).first(None, 2), [4, 6])
+        self.assertEqual(list(both & sparse), list(sparse))
+
+    def test_bitset_switches_containers(self):
+        bits = Bitset(range(SPARSE_MAX))
+        self.assertNotIsInstance(bits._chunks[0], int)
+        bits.add(SPARSE_MAX)
+        self.assertIsInstance(bits._chunks[0], int)
+        bits.discard(0)
+        bits.discard(0)
+        self.assertNotIsInstance(bits._chunks[0], int)
+        self.assertEqual(bits.first(None, 2), [1, 2])
+        for photo_id in range(1, SPARSE_MAX + 1):
+            bits.discard(photo_id)
+        self.assertFalse(bits)
+
+
+def test_suggest_route(client, get_token):
+    with patch.object(auth_service, "cache") as redis_mock:
+        redis_mock.get.return_value = None
+        headers = {"Authorization": f"Bearer {get_token}"}
+        response = client.get("/api/tags/suggest", params={"prefix": "zz"}, headers=headers)
+        assert response.status_code == 200, response.text
+        assert response.json() == []
+        response = client.get("/api/tags/suggest", params={"limit": 0}, headers=headers)
+        assert response.status_code == 422, response.text
@@ -39,10 +39,10 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
     async def test_get_all_users(self):
         contacts = [User(), User(), User()]
         mocked_contacts = MagicMock()
-        mocked_contacts.scalars.return_value.all.return_value = contacts
+        mocked_contacts.all.return_value = [(contact, None, None) for contact in contacts]
         self.session.execute.return_value = mocked_contacts
-        result = await get_all_users(limit=10, offset=0, db=self.session)
-        self.assertEqual(result, contacts)
+        result = await get_all_users(limit=10, cursor=None, db=self.session)
+        self.assertEqual(result["items"], contacts)
 
     async def test_get_user_by_username(self):
         contact = [
@@ -0,0 +1,201 @@
+import hashlib
+import io
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import httpx
+from fastapi import FastAPI, File, HTTPException, UploadFile
+
+from src.conf import messages
+from src.services.auth import auth_service
+from src.conf.constants import (
+    ALLOWED_PHOTO_EXTENSIONS,
+    PHOTO_MAX_DESCRIPTION_LENGTH,
+    PHOTO_MAX_SIZE,
+    UPLOAD_FORM_OVERHEAD,
+)
+from src.services.uploads import IMAGE_SIGNATURES, UploadSizeLimit, guess_extension, read_image
+
+JPEG = b"\xff\xd8\xff\xe0" + b"\x00" * 1024
+
+
+def upload_file(data: bytes, filename: str = "photo.jpg", size: int | None = None):
+    return UploadFile(io.BytesIO(data), filename=filename, size=size)
+
+
+class TestReadImage(unittest.IsolatedAsyncioTestCase):
+    def test_allowed_extensions_have_signatures(self):
+        recognized = {extension.lstrip(".") for extension in IMAGE_SIGNATURES.values()}
+        self.assertEqual(set(ALLOWED_PHOTO_EXTENSIONS) - {"jpeg"}, recognized)
+
+    async def test_read_image(self):
+        image = await read_image(upload_file(JPEG))
+        self.assertEqual(image.data, JPEG)
+        self.assertEqual(image.extension, ".jpg")
+        self.assertEqual(image.size, len(JPEG))
+        self.assertEqual(image.content_hash, hashlib.sha256(JPEG).hexdigest())
+
+    async def test_read_image_without_keeping(self):
+        file = upload_file(JPEG)
+        image = await read_image(file, keep=False)
+        self.assertIsNone(image.data)
+        self.assertEqual(image.size, len(JPEG))
+        self.assertEqual(image.content_hash, hashlib.sha256(JPEG).hexdigest())
+        self.assertEqual(await image.read(), JPEG)
+
+    async def test_declared_size_too_big(self):
+        file = upload_file(JPEG, size=10 * 1024 * 1024)
+        with self.assertRaises(HTTPException) as error:
+            await read_image(file)
+        self.assertEqual(error.exception.detail, messages.WRONG_FILE_SIZE)
+        self.assertEqual(file.file.tell(), 0)
+
+    async def test_size_cap_while_reading(self):
+        with self.assertRaises(HTTPException) as error:
+            await read_image(upload_file(JPEG), max_size=512)
+        self.assertEqual(error.exception.detail, messages.WRONG_FILE_SIZE)
+
+    async def test_wrong_extension(self):
+        with self.assertRaises(HTTPException) as error:
+            await read_image(upload_file(JPEG, filename="photo.exe"))
+        self.assertEqual(error.exception.detail, messages.WRONG_FILE_TYPE)
+
+    async def test_wrong_magic_bytes(self):
+        with self.assertRaises(HTTPException) as error:
+            await read_image(upload_file(b"MZ" + b"\x00" * 100))
+        self.assertEqual(error.exception.detail, messages.WRONG_FILE_TYPE)
+
+    async def test_empty_file(self):
+        with self.assertRaises(HTTPException):
+            await read_image(upload_file(b""))
+
+    def test_guess_extension(self):
+        self.assertEqual(guess_extension(b"\x89PNG\r\n\x1a\n"), ".png")
+        self.assertEqual(guess_extension(JPEG), ".jpg")
+        self.assertEqual(guess_extension(b"text"), "")
+
+
+class TestUploadSizeLimit(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        inner = FastAPI()
+
+        @inner.post("/upload")
+        async def upload(file: UploadFile = File()):
+            return {"size": len(await file.read())}
+
+        app = UploadSizeLimit(inner, {("POST", "/upload"): 4096})
+        self.client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+        self.pulled = 0
+
+    async def asyncTearDown(self):
+        await self.client.aclose()
+
+    async def post(self, size: int, **headers):
+        body = (
+            b'--b\r\nContent-Disposition: form-data; name="file"; filename="photo.jpg"\r\n\r\n'
+            + JPEG[:4] + b"\x00" * size + b"\r\n--b--\r\n"
+        )
+
+        async def chunks():
+            for start in range(0, len(body), 1024):
+                self.pulled += 1
+                yield body[start : start + 1024]
+
+        headers["Content-Type"] = "multipart/form-data; boundary=b"
+        return await self.client.post("/upload", content=chunks(), headers=headers)
+
+    async def test_body_within_the_limit(self):
+        response = await self.post(2048)
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertEqual(response.json(), {"size": 2052})
+
+    async def test_declared_length_over_the_limit(self):
+        response = await self.post(2048, **{"Content-Length": "5000"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], messages.WRONG_FILE_SIZE)
+        self.assertEqual(self.pulled, 0)
+
+    async def test_streamed_body_over_the_limit(self):
+        response = await self.post(64 * 1024)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()["detail"], messages.WRONG_FILE_SIZE)
+        self.assertLess(self.pulled, 10)
+
+
+def test_post_photo_too_big_is_not_received(client, get_token, monkeypatch):
+    monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
+    monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
+    monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+    with patch("src.repository.photos.storage.upload", new_callable=AsyncMock) as upload:
+        response = client.post(
+            "/api/photos/",
+            headers={"Authorization": f"Bearer {get_token}"},
+            files={"file": ("big.jpg", JPEG + b"\x00" * (PHOTO_MAX_SIZE + UPLOAD_FORM_OVERHEAD), "image/jpeg")},
+            data={"photo_description": "too big photo", "tags": "big"},
+        )
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == messages.WRONG_FILE_SIZE
+    upload.assert_not_called()
+
+
+def test_post_photo_rejected_before_upload(client, get_token, monkeypatch):
+    with patch.object(auth_service, "cache") as redis_mock, patch(
+        "src.repository.photos.storage.upload"
+    ) as upload:
+        redis_mock.get.return_value = None
+        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
+        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
+        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        headers = {"Authorization": f"Bearer {get_token}"}
+        response = client.post(
+            "/api/photos/",
+            headers=headers,
+            files={"file": ("photo.jpg", b"not a picture", "image/jpeg")},
+            data={"photo_description": "test photo", "tags": "test"},
+        )
+        assert response.status_code == 400, response.text
+        assert response.json()["detail"] == messages.WRONG_FILE_TYPE
+        upload.assert_not_called()
+
+
+def test_post_photos_bulk(client, get_token, monkeypatch):
+    with patch.object(auth_service, "cache") as redis_mock, patch(
+        "src.repository.photos.storage.upload"
+    ) as upload:
+        redis_mock.get.return_value = None
+        upload.return_value = {"url": "http://test.com/bulk", "public_id": "test/bulk"}
+        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
+        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
+        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
+        headers = {"Authorization": f"Bearer {get_token}"}
+        picture = b"\xff\xd8\xff\xe0bulk" + b"\x00" * 64
+        response = client.post(
+            "/api/photos/bulk/",
+            headers=headers,
+            files=[
+                ("files", ("first.jpg", picture, "image/jpeg")),
+                ("files", ("second.jpg", picture, "image/jpeg")),
+                ("files", ("bad.jpg", b"not a picture", "image/jpeg")),
+                ("files", ("long.jpg", picture, "image/jpeg")),
+            ],
+            data={
+                "descriptions": [
+                    "first photo",
+                    "second photo",
+                    "bad photo",
+                    "x" * (PHOTO_MAX_DESCRIPTION_LENGTH + 1),
+                ],
+                "tags": ["bulk_tag,other_tag", "bulk_tag", "", ""],
+            },
+        )
+        assert response.status_code == 201, response.text
+        data = response.json()
+        assert data["created"] == 2
+        assert data["failed"] == 2
+        assert data["results"][0]["photo_id"] is not None
+        assert data["results"][1]["photo_id"] is not None
+        assert data["results"][2]["detail"] == messages.WRONG_FILE_TYPE
+        assert data["results"][3]["detail"] == messages.DESCRIPTION_TOO_LONG
+        # the same content is uploaded once, read again from the request
+        upload.assert_called_once()
+        assert upload.call_args.args[0] == picture